@@ -0,0 +1,120 @@
+# SCD-30 driver layer for Dakota
+#
+# The SCD-30 measures on its own schedule, every measurement_interval secs
+# (2 by default), and holds the latest sample until it's read.  Dakota used to
+# check for data every SENSOR_READ_FREQ secs with no regard to that: most of
+# the sensor's samples were never read, a check that landed between samples
+# zeroed the inside line until the next one, and reading CO2, humidity and
+# temperature through the library's properties asked the sensor whether it
+# had data again before each of them, then read CO2 and humidity a second time
+# for the histories.
+#
+# A Co2Sensor sets the sensor's measurement interval to our read interval, so
+# it samples exactly as often as we read, and reads each sample once:
+#
+#   - poll() asks once whether a sample is ready.  If not, it keeps the last
+#     good reading and tries again in RETRY secs.  The two clocks differ a
+#     little, so now and again a poll comes early and takes a retry to get
+#     back in step
+#   - the readings of a sample are read once each, into the attributes here
+#   - the temperature calibration goes in the sensor's temperature_offset
+#     register, which only subtracts, so a calibration that adds is done here
+#   - the interval and offset are kept in the sensor's flash, so they're only
+#     written when they're different, not on every boot
+#   - a new interval starts the sensor measuring over, so the first poll after
+#     writing one waits for its first sample
+#   - a reading STALE_INTERVALS intervals old isn't fresh any more
+#
+# The SCD-30 has no averaging of its own to turn on, and the PyPortal doesn't
+# wire up its RDY pin, so this is as few transactions as a sample can take.
+
+import time
+
+RETRY = 2				# secs, the sensor's shortest interval
+MIN_INTERVAL = 2		# secs, what the sensor allows
+MAX_INTERVAL = 1_800
+STALE_INTERVALS = 5		# intervals without a sample before the reading isn't fresh
+
+_NS = 1_000_000_000
+
+class Co2Sensor:
+
+	def __init__(self, scd30, interval, calibration):
+		self.scd30 = scd30
+		self.interval = max(MIN_INTERVAL, min(MAX_INTERVAL, int(interval)))
+		self.calibration = calibration		# degrees C, whatever the offset register isn't doing
+		self.co2 = 0						# ppm
+		self.temp = 0.0						# degrees C, calibrated
+		self.humidity = 0.0					# % RH
+		self.read_ns = None					# time.monotonic_ns() of the last good sample
+		self.first_ns = time.monotonic_ns()	# when the first sample should be ready
+
+		self.samples = 0
+		self.misses = 0						# polls with no sample ready
+		self.errors = 0
+		self.writes = 0						# interval and offset writes to the sensor's flash
+
+		self._configure(calibration)
+
+	# a sample recent enough to show
+	@property
+	def fresh(self):
+		if self.read_ns == None:
+			return False
+		return time.monotonic_ns() - self.read_ns < STALE_INTERVALS * self.interval * _NS
+
+	# read a sample if there's one ready, returns secs until it's worth polling again
+	def poll(self):
+		scd30 = self.scd30
+		try:
+			if not scd30.data_available:
+				wait = (self.first_ns - time.monotonic_ns()) / _NS
+				if self.read_ns == None and wait > 0:
+					return wait + RETRY
+				self.misses = self.misses + 1
+				return RETRY
+			co2 = scd30.CO2
+			temp = scd30.temperature
+			humidity = scd30.relative_humidity
+		except Exception as e:
+			print("!!!! SCD-30", e)
+			self.errors = self.errors + 1
+			return RETRY
+
+		# it reads 0 for a sample or two after starting
+		if co2 <= 0:
+			self.misses = self.misses + 1
+			return RETRY
+
+		self.co2 = co2
+		self.temp = temp + self.calibration
+		self.humidity = humidity
+		self.read_ns = time.monotonic_ns()
+		self.samples = self.samples + 1
+		return self.interval
+
+	def report(self):
+		print("  SCD-30: %d samples, %d early polls, %d errors, every %d secs, %+.2f C in Python, %d config writes" % (
+			self.samples, self.misses, self.errors, self.interval, self.calibration, self.writes))
+		return;
+
+	# match the sensor's interval and temperature offset to ours, writing only what's changed
+	def _configure(self, calibration):
+		scd30 = self.scd30
+		try:
+			if scd30.measurement_interval != self.interval:
+				scd30.measurement_interval = self.interval
+				self.writes = self.writes + 1
+				self.first_ns = time.monotonic_ns() + self.interval * _NS		# it starts measuring over
+
+			offset = 0.0
+			if calibration < 0:
+				offset = round(-calibration * 100) / 100
+			if abs(scd30.temperature_offset - offset) >= 0.01:
+				scd30.temperature_offset = offset
+				self.writes = self.writes + 1
+			self.calibration = calibration + offset
+		except Exception as e:
+			print("!!!! SCD-30 setup failed:", e)
+			self.errors = self.errors + 1
+		return;
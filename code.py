@@ -13,93 +13,381 @@ import time
 import displayio
 import vectorio
 import gc
+import jsonpick
+import hubpayload
+import fetcher
+import datacache
+import state
+import textfmt
+import history
+import sdlog
+import wifi
+import policy
+import timekeeper
+import co2sensor
+import telemetry
+import render
+import labelcache
+import sprites
+import scheduler
+import health
+import instrument
 import adafruit_scd30
-import adafruit_requests as requests
-import adafruit_esp32spi.adafruit_esp32spi_socket as socket
 from adafruit_display_text import bitmap_label
 from adafruit_bitmap_font import bitmap_font
 from adafruit_esp32spi import adafruit_esp32spi
 from digitalio import DigitalInOut
 from analogio import AnalogIn
 
+# light sleep isn't on every board (or every CircuitPython version)
+try:
+	import alarm
+except ImportError:
+	alarm = None
+
+# nor is a touchscreen, without one the main page is all there is
+try:
+	import adafruit_touchscreen
+except ImportError:
+	adafruit_touchscreen = None
+
 def main_loop( esp ):
 
 	print("########## main_loop start")
 
-	# timing variable, so we call APIs in a reasonable way
-	Tick = 0
+	# the data and the screen were made at startup (see the end of this file),
+	#   if we're starting over they carry on just as they were
+	S = Data
+	weather = S.weather
+	forecast = S.forecast
+	air_quality = S.air_quality
+	inside = S.inside
+	clock = S.clock
+	status = S.status
+	if status.connected != Wifi.connected:
+		status.connected = Wifi.connected
+		status.changed()
+
+	# each job runs on its own schedule (see scheduler.py) and the loop sleeps
+	#   until the next one is due.  Drawing comes first, so there's something
+	#   on screen before we spend time connecting
+	Sched = scheduler.Scheduler(Health)
+
+	# something the display shows has changed
+	def data_changed():
+		Sched.wake("render")
+		return;
+
+	# the other API is due soon anyway: call it now, while the connection
+	#   this one just used is still open (see fetcher.Session)
+	def coalesce(name):
+		secs = Sched.due_in(name)
+		if secs != None and secs < COALESCE_WINDOW:
+			Sched.wake(name)
+		return;
+
+	# remember what we got, in case we have to start over
+	def cache_data():
+		if weather.status_code == 200:
+			datacache.save(weather, air_quality, Last_Weather, Last_Air_Quality)
+		return;
+
+	def sensor_task():
+		# needs no internet connection (and will continue even if connection fails),
+		#   runs again when the sensor's next sample is due
+		wait = get_sensor_data(S)
+		data_changed()
+		return wait
+
+	def clock_task():
+		set_now(clock)
+		data_changed()
+
+		# next run is right as the minute turns over
+		return secs_to_next_minute()
+
+	# network time from the ESP32, as often as it's needed (see timekeeper.py)
+	def time_task():
+		if not status.connected:
+			return CONNECTION_FREQ
+		wait = Time.sync(esp)
+		Sched.wake("clock")
+		return wait
+
+	def render_task():
+		show_data(Screen, Views, Texts, Warning, Charts)
+		return;
+
+	# a tap shows the next page, and after PAGE_TIMEOUT untouched it's back to the main page
+	Tapped = False
+	Screen.show_page(0)
+
+	def page_task():
+		nonlocal Tapped
+		if Tapped:
+			Tapped = False
+			Screen.next_page()
+		else:
+			Screen.show_page(0)
+		data_changed()
+		if Screen.page != 0:
+			return PAGE_TIMEOUT
+		return;
+
+	# check the light often right after it changes, less often while it stays the same
+	Backlight_Wait = BACKLIGHT_FREQ
+
+	def backlight_task():
+		nonlocal Backlight_Wait
+		was_dark = is_dark(status)
+		set_backlight(status)
+
+		if is_dark(status) != was_dark:
+			Backlight_Wait = BACKLIGHT_FREQ
+		else:
+			Backlight_Wait = min(Backlight_Wait * 2, BACKLIGHT_MAX_FREQ)
+		return Backlight_Wait
+
+	# joining the network goes on in the background (see wifi.py), this just
+	#   moves it along and notices when it's done or the connection drops
+	def connection_task():
+		wait = Wifi.step()
+		if Wifi.connected != status.connected:
+			status.connected = Wifi.connected
+			status.changed()
+			data_changed()
+			if Wifi.connected and not Time.synced:
+				Sched.wake("time")
+		return wait
+
+	# downloads in progress, see fetcher.py
+	Weather_Fetch = None
+	Air_Quality_Fetch = None
+
+	def weather_task():
+		global Last_Weather, Last_Air_Quality
+		nonlocal Weather_Fetch
+		if Weather_Fetch == None:
+			if not status.connected:
+				return CONNECTION_FREQ		# try again once we're connected
+			if HUB_URL != None:
+				Weather_Fetch = start_hub(esp)
+			else:
+				Weather_Fetch = start_weather(esp)
+
+		# move the download along a bit at a time, so the other tasks keep going
+		if not Weather_Fetch.step():
+			return FETCH_STEP
+
+		was_temp = weather.temp
+		was_conditions = weather.conditions
+		if HUB_URL != None:
+			# the hub sends the air quality along with the weather
+			get_hub_data(Weather_Fetch, weather, air_quality)
+			if air_quality.status_code == 200:
+				Last_Air_Quality = time.time()
+		else:
+			get_weather(Weather_Fetch, weather, forecast)
+			coalesce("air_quality")
+		Weather_Fetch = None
+
+		# only a good answer counts, a failure is tried again soon (see policy.py)
+		ok = weather.status_code == 200
+		if ok:
+			Last_Weather = time.time()
+			# the time zone, and the time itself until there's network time
+			Time.set_zone(weather.timezone_offset)
+			Time.hint(time.time() + int(weather.local_time_correction) - weather.timezone_offset)
+		cache_data()
+
+		# time zone may have changed
+		Sched.wake("clock")
+		data_changed()
+		wait = Weather_Policy.next_delay(ok, weather_mode(weather, clock, was_temp, was_conditions))
+
+		# the last good weather stays up while the policy is trying again soon
+		if not ok and Weather_Policy.gave_up():
+			clear_data(weather)
+		# the hub's air quality goes with the weather, or once it's a period overdue
+		if HUB_URL != None and air_quality.status_code != 200:
+			if (not ok and Weather_Policy.gave_up()) or time.time() - Last_Air_Quality > AIR_QUALITY_FREQ:
+				clear_data(air_quality)
+		return wait
+
+	def air_quality_task():
+		global Last_Air_Quality
+		nonlocal Air_Quality_Fetch
+		if Air_Quality_Fetch == None:
+			if not status.connected:
+				return CONNECTION_FREQ
+			Air_Quality_Fetch = start_air_quality(esp)
+
+		if not Air_Quality_Fetch.step():
+			return FETCH_STEP
+
+		get_air_quality(Air_Quality_Fetch, air_quality)
+		Air_Quality_Fetch = None
+		coalesce("weather")
+
+		ok = air_quality.status_code == 200
+		if ok:
+			Last_Air_Quality = time.time()
+		cache_data()
+		data_changed()
+		wait = Air_Quality_Policy.next_delay(ok, air_quality_mode(air_quality, clock))
+		if not ok and Air_Quality_Policy.gave_up():
+			clear_data(air_quality)
+		return wait
+
+	# slowest pass through the loop since telemetry was last queued, ms
+	Loop_Ms = 0
+
+	def telemetry_task():
+		nonlocal Loop_Ms
+		queue_telemetry(S, esp, Loop_Ms)
+		Loop_Ms = 0
+		return;
+
+	def upload_task():
+		if not Telemetry.busy and not status.connected:
+			return CONNECTION_FREQ
+		return Telemetry.step(esp)
+
+	def stats_task():
+		Sched.report()
+		state.report(Texts + (Warning,))
+		report_history()
+		Labels.report()
+		Time.report()
+		Health.report()
+		if Sensor != None:
+			Sensor.report()
+		Wifi.report()
+		Http.report()
+		Weather_Policy.report()
+		if HUB_URL == None:
+			Air_Quality_Policy.report()
+		if Telemetry != None:
+			Telemetry.report()
+		return;
+
+	# cached data means the APIs aren't due until their usual time is up
+	now = time.time()
+	weather_delay = max(0, Last_Weather + WEATHER_FREQ - now)
+	air_quality_delay = max(0, Last_Air_Quality + AIR_QUALITY_FREQ - now)
+
+	Sched.add("sensor", SENSOR_READ_FREQ, sensor_task)
+	Sched.add("clock", None, clock_task)
+	Sched.add("time", None, time_task)
+	Sched.add("render", None, render_task)
+	Sched.add("page", None, page_task, None)
+	Sched.add("backlight", BACKLIGHT_FREQ, backlight_task)
+	Sched.add("connection", CONNECTION_FREQ, connection_task)
+	Sched.add("weather", WEATHER_FREQ, weather_task, weather_delay)
+	if HUB_URL == None:
+		Sched.add("air_quality", AIR_QUALITY_FREQ, air_quality_task, air_quality_delay)
+	# sockets kept open from before a restart may not be any good
+	Http.close()
+	if Telemetry != None:
+		# a request left over from before a restart isn't going anywhere
+		Telemetry.close()
+		Sched.add("telemetry", TELEMETRY_FREQ, telemetry_task, TELEMETRY_FREQ)
+		Sched.add("upload", None, upload_task, TELEMETRY_FREQ)
+	Sched.add("stats", STATS_FREQ, stats_task, STATS_FREQ)
+
+	# what's wrong with the loop even though its passes finish, None if nothing
+	#   is (see health.py).  The clock moves on every minute once the time is
+	#   known, and one that doesn't means the screen is stuck too
+	Clock_Rev = clock.rev
+	Clock_Moved = time.monotonic_ns()
+
+	def loop_problem():
+		nonlocal Clock_Rev, Clock_Moved
+		now = time.monotonic_ns()
+		if clock.rev != Clock_Rev or not Time.known:
+			Clock_Rev = clock.rev
+			Clock_Moved = now
+		elif now - Clock_Moved > CLOCK_STUCK * 1_000_000_000:
+			return "clock stopped"
+		return None
 
-	# All of our data will be in this persistent map
-	Data = { }
+	# loop forever, unless exception
+	loop_count = 0
+	try:
+		while True:
+			loop_count = loop_count + 1
+			print("\n########## Top of loop ", loop_count)
+
+			started = time.monotonic_ns()
+			Sched.run_due()
+			took = time.monotonic_ns() - started
+			Loop_Ms = max(Loop_Ms, took // 1_000_000)
+
+			# the pass finished, so the watchdog is fed if nothing's wrong (see health.py)
+			Health.passed(took, loop_problem())
+
+			# "d" on the serial console dumps stage timings, when instrumented
+			instrument.poll_serial()
+
+			# sleep until the next task is due, or the screen is tapped, with the
+			#   watchdog stopped (or, if it can't be, not for longer than it allows)
+			wait = Sched.delay()
+			longest = Health.pause()
+			if longest != None:
+				wait = min(wait, longest)
+			woke = nap(wait, status)
+			Health.resume()
+			if woke:
+				Tapped = True
+				Sched.wake("page")
+	finally:
+		# on the way out with an exception, let go of the sockets downloads had
+		#   open (the ESP32 only has a few)
+		if Weather_Fetch != None:
+			Weather_Fetch.close()
+		if Air_Quality_Fetch != None:
+			Air_Quality_Fetch.close()
 
-	# time is unknown as we start, but known once a correction is found.  Time
-	# may not be very accurate if API calls are failing, but we'll show it anyway
-	Data['month'] = '--'
-	Data['day_of_month'] = '--'
-	Data['day_of_week'] = '--'
-	Data['hour'] = '--'
-	Data['minute'] = '--'
+	return;
 
-	# last time we got data from various sources
-	Last_Weather = 0
-	Last_Air_Quality = 0
-	Last_Sensor_Read = 0
+# the screen: every page, label and shape on it, and what each one shows.  Made
+#   just once, at startup, returns (screen, views, texts, warning, charts)
+def build_ui(S):
 
-	# create the UI elements just once
 	lstr = "--"
 
-	# temperature
-	temp_label = bitmap_label.Label(BigFont, text=lstr, color=GRAY)
-	temp_label.anchor_point = (0.0, 1.0)
-	temp_label.anchored_position = (10, 60)
-	Data['temp_label'] = temp_label
+	# temperature, in big digits from the sprite sheet (see sprites.py)
+	temp_grid = Digits.grid("000", (0.0, 1.0), (10, 60))
 
 	# humidity
 	hum_label = bitmap_label.Label(MedFont, text=lstr, color=GRAY)
 	hum_label.anchor_point = (0.0, 1.0)
 	hum_label.anchored_position = (128, 62)
-	Data['humidity_label'] = hum_label
 
-	# conditions
-	cond_label = bitmap_label.Label(MedFont, text=lstr, color=DEFAULT)
-	cond_label.anchor_point = (0.0, 1.0)
-	cond_label.anchored_position = (204, 62)
-	Data['cond_label'] = cond_label
+	# conditions, and below the AQI, UV and flex lines, are slots the label
+	#   cache swaps rendered labels into (see labelcache.py)
+	cond_slot = displayio.Group()
 
 	# date and time
 	date_label = bitmap_label.Label(MedFont, text=lstr, color=GRAY)
 	date_label.anchor_point = (0.0, 1.0)
 	date_label.anchored_position = (10, 310)
-	Data['date_label'] = date_label
-
-	time_label = bitmap_label.Label(BigFont, text=lstr, color=GRAY)
-	time_label.anchor_point = (1.0, 1.0)
-	time_label.anchored_position = (470, 305)
-	Data['time_label'] = time_label
-
-	# air quality
-	aqi_label = bitmap_label.Label(SmFont, text=lstr, color=DEFAULT)
-	aqi_label.anchor_point = (0.0, 1.0)
-	aqi_label.anchored_position = (30, 192)
-	Data['aqi_label'] = aqi_label
-
-	# uv index
-	uv_label = bitmap_label.Label(SmFont, text=lstr, color=DEFAULT)
-	uv_label.anchor_point = (0.0, 1.0)
-	uv_label.anchored_position = (30, 152)
-	Data['uv_label'] = uv_label
-
-	# flex line
-	flex_label = bitmap_label.Label(SmFont, text=lstr, color=DEFAULT)
-	flex_label.anchor_point = (0.0, 1.0)
-	flex_label.anchored_position = (30, 112)
-	Data['flex_label'] = flex_label
+
+	time_grid = Digits.grid("00:00", (1.0, 1.0), (470, 305))
+
+	# air quality, uv index and flex line
+	aqi_slot = displayio.Group()
+	uv_slot = displayio.Group()
+	flex_slot = displayio.Group()
 
 	# inside
 	inside_label = bitmap_label.Label(SmFont, text=lstr, color=DEFAULT)
 	inside_label.anchor_point = (0.0, 1.0)
 	inside_label.anchored_position = (30, 232)
-	Data['inside_label'] = inside_label
+
+	# which way CO2 is heading, drawn next to the inside line
+	arrow_palette = displayio.Palette(1)
+	co2_arrow = vectorio.Polygon(pixel_shader=arrow_palette, points=TREND_OUTLINES[TREND_FLAT], x=450, y=212)
 
 	# draw underlying graphics
 	underlay_palette = displayio.Palette(1)
@@ -111,212 +399,439 @@ def main_loop( esp ):
 	display_group = displayio.Group()
 	display_group.append(line1)
 	display_group.append(line2)
-	display_group.append(temp_label)
+	display_group.append(temp_grid)
 	display_group.append(hum_label)
-	display_group.append(cond_label)
-	display_group.append(time_label)
+	display_group.append(cond_slot)
+	display_group.append(time_grid)
 	display_group.append(date_label)
-	display_group.append(aqi_label)
-	display_group.append(uv_label)
+	display_group.append(aqi_slot)
+	display_group.append(uv_slot)
 	display_group.append(inside_label)
-	display_group.append(flex_label)
-	Data['display_group'] = display_group
-
-	# loop forever, unless exception
-	loop_count = 0
-	while True:
-		loop_count = loop_count + 1
-
-		# time in secs
-		Tick = time.time()
-
-		print("\n########## Top of loop ", loop_count)
-
-
-		# Connect to wifi
-		print("* Checking connection")
-
-		Data['connected'] = False
-		if not esp.is_connected:
-			try:
-				esp.connect_AP(secrets["ssid"], secrets["password"])
-			except Exception as e:
-				print("!!!! Exception connecting to WiFi: " + e)
-
-			print("Connected to", str(esp.ssid, "utf-8"), "\tRSSI:", esp.rssi)
-			print("IP address", esp.pretty_ip(esp.ip_address), "\n")
-
-		# if connection was established then do stuff
-		if esp.is_connected:
-			print("* Connected")
-			Data['connected'] = True
-
-			# get weather, if it's time to do so
-			since_weather = Tick - Last_Weather
-			if since_weather > WEATHER_FREQ:
-				get_weather( esp, Data )
-				Last_Weather = Tick
-
-			# get air quality if it's time
-			since_air_quality = Tick - Last_Air_Quality
-			if since_air_quality > AIR_QUALITY_FREQ:
-				get_air_quality(esp, Data)
-				Last_Air_Quality = Tick
-
-		# read sensor if it's time - needs no internet connection (and will continue even if connection fails)
-		since_sensor_read = Tick - Last_Sensor_Read
-		if since_sensor_read > SENSOR_READ_FREQ:
-			get_sensor_data(Data)
-			Last_Sensor_Read = Tick
-
-		# wrangle the time
-		set_now(Data)
-
-		# set up the flex line
-		set_flex(Data)
-
-		# got all the data, now show it on screen
-		show_data(Data)
-
-		# wait thorugh main heartbeat time
-		time.sleep( MAIN_SLEEP )
-
-	return;
-
-def get_weather( esp, Data ):
+	display_group.append(flex_slot)
+	display_group.append(co2_arrow)
+
+	# what each label shows is worked out from the state it depends on, and
+	#   only when that state changes.  The screen only redraws labels that change
+	weather = S.weather
+	air_quality = S.air_quality
+	inside = S.inside
+	clock = S.clock
+	status = S.status
+	texts = (
+		state.Derived(temp_text, weather),
+		state.Derived(humidity_text, weather),
+		state.Derived(conditions_text, weather),
+		state.Derived(date_text, clock),
+		state.Derived(time_text, clock),
+		state.Derived(aqi_text, air_quality),
+		state.Derived(uv_text, weather),
+		state.Derived(flex_line, status, weather, air_quality, clock),
+		state.Derived(inside_text, inside),
+		state.Derived(co2_arrow_shape, inside) )
+	warning = state.Derived(warning_level, status, weather)
+
+	main = render.Page(display_group)
+	views = (
+		Digits.view(main, temp_grid, False, lstr, GRAY),
+		main.view(hum_label, GRAY),
+		Labels.view(main, cond_slot, MedFont, (0.0, 1.0), (204, 62), lstr, DEFAULT),
+		main.view(date_label, GRAY),
+		Digits.view(main, time_grid, True, lstr, GRAY),
+		Labels.view(main, aqi_slot, SmFont, (0.0, 1.0), (30, 192), lstr, DEFAULT),
+		Labels.view(main, uv_slot, SmFont, (0.0, 1.0), (30, 152), lstr, DEFAULT),
+		Labels.view(main, flex_slot, SmFont, (0.0, 1.0), (30, 112), lstr, DEFAULT),
+		main.view(inside_label, DEFAULT),
+		main.shape(co2_arrow, arrow_palette, TREND_OUTLINES) )
+
+	# the other pages are drawn in the background just the same, and a tap
+	#   only has to switch to one
+	forecast_page, forecast_views, forecast_texts = build_forecast_page(S.forecast)
+	history_page, history_views, history_texts, charts = build_history_page(inside)
+
+	screen = render.Screen(board.DISPLAY, (main, forecast_page, history_page))
+	return screen, views + forecast_views + history_views, texts + forecast_texts + history_texts, warning, charts
+
+# a label with its bottom left corner at x, y
+def page_label(font, x, y, text, color):
+	label = bitmap_label.Label(font, text=text, color=color)
+	label.anchor_point = (0.0, 1.0)
+	label.anchored_position = (x, y)
+	return label
+
+# the week ahead, a row a day: the day, a word for the weather and high / low
+def build_forecast_page(forecast):
+	group = displayio.Group()
+	page = render.Page(group)
+	group.append(page_label(MedFont, 10, 40, "Next 7 days", GRAY))
+
+	views = []
+	texts = []
+	for day in range(state.FORECAST_DAYS):
+		y = 84 + day * 33
+		day_label = page_label(SmFont, 20, y, "--", GRAY)
+		summary_label = page_label(SmFont, 110, y, "--", DEFAULT)
+		temps_label = page_label(SmFont, 460, y, "--", GRAY)
+		temps_label.anchor_point = (1.0, 1.0)
+		group.append(day_label)
+		group.append(summary_label)
+		group.append(temps_label)
+
+		day_text, summary_text, temps_text = forecast_texts(day)
+		views.append(page.view(day_label, GRAY))
+		views.append(page.view(summary_label, DEFAULT))
+		views.append(page.view(temps_label, GRAY))
+		texts.append(state.Derived(day_text, forecast))
+		texts.append(state.Derived(summary_text, forecast))
+		texts.append(state.Derived(temps_text, forecast))
+
+	return page, tuple(views), tuple(texts)
+
+# the last day of inside readings, a chart each with its range over it
+def build_history_page(inside):
+	group = displayio.Group()
+	page = render.Page(group)
+	group.append(page_label(MedFont, 10, 40, "Inside, last 24 hours", GRAY))
+
+	views = []
+	texts = []
+	charts = []
+	top = 70
+	for title, series, span in ((b"CO2 ppm", Co2_History, CHART_SPAN_CO2),
+			(b"Temp F", Temp_History, CHART_SPAN_TEMP),
+			(b"Humidity %", Humidity_History, CHART_SPAN_HUMIDITY)):
+		caption = page_label(SmFont, 20, top, "--", DEFAULT)
+		palette = displayio.Palette(2)
+		palette.make_transparent(0)
+		palette[1] = DEFAULT
+		bitmap = displayio.Bitmap(CHART_WIDTH, CHART_HEIGHT, 2)
+		group.append(caption)
+		group.append(displayio.TileGrid(bitmap, pixel_shader=palette, x=20, y=top + 6))
+
+		views.append(page.view(caption, DEFAULT))
+		texts.append(state.Derived(history_caption(title, series), inside))
+		charts.append((page.chart(bitmap, span), series))
+		top = top + CHART_HEIGHT + 36
+
+	return page, tuple(views), tuple(texts), tuple(charts)
+
+# start downloading the weather, the response is picked apart as it streams in
+def start_weather( esp ):
 	print("***** Getting Weather")
+	return fetcher.HttpFetch(esp, OPEN_WEATHER_URL, jsonpick.JsonPicker(WEATHER_PICKS), session=Http)
 
-	Data['temp'] = "--"
-	Data['humidity'] = "--"
-	Data['pressure'] = "--"
-	Data['uv_index'] = "--"
-	Data['conditions'] = "--"
-	Data['wind_dir'] = 0
-	Data['wind_speed'] = 0
-	Data['sunrise'] = 0
-	Data['sunset'] = 0
-	Data['weather_alert'] = 'NoAlert'
-	Data['local_time_correction'] = 0
-	Data['weather_status_code'] = 0
-
-	weather_response = requests.get(OPEN_WEATHER_URL)
+# weather download has finished (or failed), put what we got into weather
+#   and the forecast
+def get_weather( fetch, weather, forecast ):
+	print("***** Got Weather,", fetch.timings())
 
-	Data['weather_status_code'] = weather_response.status_code
+	# a failure leaves the last good weather up, it's cleared once the
+	#   policy gives up (see weather_task)
+	weather.status_code = fetch.status
 
-	if weather_response.status_code == 200:
+	if fetch.ok:
 
 		# all sorts of crap can fail in here
 		try:
-			rjson = weather_response.json()
-			current = rjson['current']
-			daily = rjson['daily'][0]
+			# only in the response when there is one
+			weather.alert = "NoAlert"
+
+			# just the values we show, picked out as the response streamed in
+			rjson = fetch.sink.found
 
 			# fix up the time by saving correction factor from current unix time 
 			#   (from API) and onboard clock time
-			unix_time = int(current['dt'])
+			unix_time = int(rjson['current.dt'])
 			tz_off = int(rjson['timezone_offset'])
 			local_unix_time = unix_time + tz_off
 			local_time_correction = local_unix_time - time.time()
-			Data['local_time_correction'] = local_time_correction
+			weather.local_time_correction = local_time_correction
+			weather.timezone_offset = tz_off
 
 			# get all the other weather stuff
-			Data['temp'] = round(convert_ktof(float(current['temp'])))
-			Data['humidity'] = round(current['humidity'])
-			Data['pressure'] = round(current['pressure'])
-			Data['uv_index'] = float(current['uvi'])
+			weather.temp = round(convert_ktof(float(rjson['current.temp'])))
+			weather.humidity = round(rjson['current.humidity'])
+			weather.pressure = round(rjson['current.pressure'])
+			weather.uv_index = float(rjson['current.uvi'])
 
-			local_sunrise_time = int(current['sunrise']) + tz_off
-			local_sunset_time = int(current['sunset']) + tz_off
+			local_sunrise_time = int(rjson['current.sunrise']) + tz_off
+			local_sunset_time = int(rjson['current.sunset']) + tz_off
 
-			Data['sunrise'] = local_sunrise_time
-			Data['sunset'] = local_sunset_time
-			Data['moon_phase'] = float(daily['moon_phase'])
+			weather.sunrise = local_sunrise_time
+			weather.sunset = local_sunset_time
+			weather.moon_phase = float(rjson['daily.0.moon_phase'])
 
 			# upper case the condition string (CircuitPython has no "capitalize()")
 			# 	strangely, this is a UI issue, the upper cased string actually helps
-			c_str = current["weather"][0]["description"]
+			c_str = rjson['current.weather.0.description']
 			cond_str = c_str[0].upper() + c_str[1:].lower()
-			Data['conditions'] = cond_str	
+			weather.conditions = cond_str	
+
+			weather.wind_dir = wind_dir_index(int(rjson['current.wind_deg']))
+			weather.wind_speed = convert_mpstomph(int(rjson['current.wind_speed']))
 
-			Data['wind_dir'] = get_wind_dir_str(int(current['wind_deg']))
-			Data['wind_speed'] = convert_mpstomph(int(current['wind_speed']))
+			# alerts are only in the response when there are some
+			events = rjson.get('alerts.*.event', ())
+			starts = rjson.get('alerts.*.start', ())
+			ends = rjson.get('alerts.*.end', ())
+			for i in range(min(len(events), len(starts), len(ends))):
+				# only show alerts that are in effect now
+				if unix_time > starts[i] and unix_time < ends[i]:
+					weather.alert = events[i]
+					break
 
-			# there may be no alert and this may fail
-			alerts = rjson['alerts']
-			alert = alerts[0]['event']
-			start = alerts[0]['start']
-			end = alerts[0]['end']
-			# only show alerts that are in effect now
-			if unix_time > start and unix_time < end:
-				Data['weather_alert'] = alert
+			get_forecast(rjson, tz_off, forecast)
 
 		except Exception as e:
 			print("      Weather API exception:", e)
 
-	weather_response.close()
+	weather.changed()
+	return;
 
+# the days after today from the daily list, the forecast we have is kept
+#   unless there's a whole new one
+def get_forecast(rjson, tz_off, forecast):
+	days = rjson.get('daily.*.dt', ())
+	lows = rjson.get('daily.*.temp.min', ())
+	highs = rjson.get('daily.*.temp.max', ())
+	summaries = rjson.get('daily.*.weather.0.main', ())
+	n = min(len(days), len(lows), len(highs), len(summaries), state.FORECAST_DAYS + 1) - 1
+	if n <= 0:
+		return;
+
+	for i in range(n):
+		# 1 Jan 1970 was a Thursday, and Monday is 0
+		forecast.day_of_week[i] = ((int(days[i + 1]) + tz_off) // 86400 + 3) % 7
+		forecast.low[i] = round(convert_ktof(float(lows[i + 1])))
+		forecast.high[i] = round(convert_ktof(float(highs[i + 1])))
+		forecast.summary[i] = summaries[i + 1]
+	forecast.days = n
+	forecast.changed()
 	return;
 
-def get_air_quality(esp, Data):
-	print("***** Getting Air Quality")
+# with a hub on the LAN (see tools/hub), weather and air quality come from it
+#   in one small binary payload instead of from OpenWeatherMap
+def start_hub(esp):
+	print("***** Getting Weather from hub")
+	return fetcher.HttpFetch(esp, HUB_WEATHER_URL, hubpayload.Receiver(), session=Http)
+
+def get_hub_data(fetch, weather, air_quality):
+	print("***** Got hub data,", fetch.timings())
+
+	if fetch.ok and hubpayload.apply(fetch.sink.payload, weather, air_quality, time.time()):
+		return;
+
+	# no answer, or not one we understand: the same as the APIs failing
+	print("      Hub response not usable, status", fetch.status)
+	weather.status_code = fetch.status
+	weather.changed()
+	air_quality.status_code = fetch.status
+	air_quality.changed()
+	return;
 
-	Data['aq_index'] = 0
-	Data['aqi_status_code'] = 0
+# the policy has given up on a source, show "--" but keep the status code, and
+#   the weather's time zone, which hasn't gone stale
+def clear_data(source):
+	status_code = source.status_code
+	if isinstance(source, state.Weather):
+		zone = (source.timezone_offset, source.local_time_correction)
+		source.clear()
+		source.timezone_offset, source.local_time_correction = zone
+	else:
+		source.clear()
+	source.status_code = status_code
+	source.changed()
+	return;
+
+def start_air_quality(esp):
+	print("***** Getting Air Quality")
+	return fetcher.HttpFetch(esp, OPEN_WEATHER_AQI_URL, jsonpick.JsonPicker(AIR_QUALITY_PICKS), session=Http)
 
-	aqi_response = requests.get(OPEN_WEATHER_AQI_URL)
+def get_air_quality(fetch, air_quality):
+	print("***** Got Air Quality,", fetch.timings())
 
-	Data['aqi_status_code'] = aqi_response.status_code
+	# like the weather, a failure leaves the last good value up
+	air_quality.status_code = fetch.status
 
-	if aqi_response.status_code == 200:
+	if fetch.ok:
 
 		try:
-			rjson = aqi_response.json()
+			rjson = fetch.sink.found
 
-			size = len(rjson['list']) # should be just 1 item in list, but zero means "error, no data".
-			if size > 0:
-				aqi_index = rjson['list'][0]['main']['aqi']		
-				Data['aq_index'] = int(aqi_index)
+			# should be just 1 item in list, but zero means "error, no data".
+			if 'list.0.main.aqi' in rjson:
+				aqi_index = rjson['list.0.main.aqi']
+				air_quality.aq_index = int(aqi_index)
+			else:
+				air_quality.aq_index = 0
 		except Exception as e:
 			print("      Air Quality API exception", e)
 
-	aqi_response.close()
-
+	air_quality.changed()
 	return;
 
-def get_sensor_data(Data):
+# returns secs until the sensor is worth polling again (see co2sensor.py)
+def get_sensor_data(S):
 	print("***** Getting Sensor Data")
+	inside = S.inside
+	if Sensor == None:
+		return None
+
+	samples = Sensor.samples
+	wait = Sensor.poll()
+	if Sensor.samples != samples:
+		temp = convert_ctof(Sensor.temp)
+		inside.co2 = round(Sensor.co2)
+		inside.humidity = round(Sensor.humidity)
+		inside.temp = round(temp)
+
+		Co2_History.add(Sensor.co2)
+		Temp_History.add(temp)
+		Humidity_History.add(Sensor.humidity)
+		log_sensor_data(S)
+		inside.co2_trend = Co2_History.trend()
+	elif Sensor.fresh or inside.co2 == 0:
+		# keep showing the last good reading
+		return wait
+	else:
+		# nothing for a while, zero means no reading
+		inside.co2 = 0
+		inside.humidity = 0
+		inside.temp = 0
+
+	inside.changed()
+	return wait
+
+# add the latest reading to the log on the SD card, once we know the local time
+def log_sensor_data(S):
+	weather = S.weather
+	if Sensor_Log == None or not Time.known:
+		return;
+
+	Sensor_Log.add(Time.local(),
+		Co2_History.last(), Temp_History.last(), Humidity_History.last(),
+		weather.temp, weather.humidity, S.air_quality.aq_index)
+	return;
 
-	# assume it won't work
-	Data['inside_co2'] = 0
-	Data['inside_humidity'] = 0
-	Data['inside_temp'] = 0
-
-	# if we have data, capture it
-	try:
-		if Scd30.data_available:
-			Data['inside_co2'] = round(Scd30.CO2)
-			Data['inside_humidity'] = round(Scd30.relative_humidity)
-
-			# Get temp and apply calibration
-			temp = Scd30.temperature
-			temp = temp + TEMP_SENSOR_CALIBRATION
+# queue a round of readings and device health for Adafruit IO (see telemetry.py),
+#   stamped in UTC once the time is known
+def queue_telemetry(S, esp, loop_ms):
+	weather = S.weather
+	stamp = 0
+	if Time.known:
+		stamp = Time.utc()
+
+	inside = S.inside
+	if Sensor != None and Sensor.fresh:
+		Telemetry.add(FEED_CO2, inside.co2, stamp)
+		Telemetry.add(FEED_INSIDE_TEMP, inside.temp, stamp)
+		Telemetry.add(FEED_INSIDE_HUMIDITY, inside.humidity, stamp)
+
+	Telemetry.add(FEED_LOOP_MS, loop_ms, stamp)
+	Telemetry.add(FEED_MEM_FREE, gc.mem_free(), stamp)
+	Telemetry.add(FEED_WEATHER_STATUS, weather.status_code, stamp)
+	Telemetry.add(FEED_AQI_STATUS, S.air_quality.status_code, stamp)
+
+	if S.status.connected and Wifi.rssi.count > 0:
+		Telemetry.add(FEED_RSSI, Wifi.rssi.last(), stamp)
+	return;
 
-			Data['inside_temp'] = round(convert_ctof(temp))
-	except Exception as e:
-		print("SCD-30", e)
+# the day's min, mean and max for each of the sensor's readings
+def report_history():
+	print("  history        min    mean     max   trend")
+	for name, series in (("CO2 ppm", Co2_History), ("temp F", Temp_History), ("humidity %", Humidity_History)):
+		if series.count == 0:
+			print("  %-10s  no readings yet" % name)
+		else:
+			trend = series.trend()
+			if trend == None:
+				trend = 0
+			print("  %-10s %7.1f %7.1f %7.1f %+7.1f" % (name, series.min(), series.mean(), series.max(), trend))
 
+	if Sensor_Log != None:
+		print("  sensor log:", Sensor_Log.records, "records,", Sensor_Log.flushes, "writes,", Sensor_Log.errors, "errors")
 	return;
 
-def set_backlight(Data):
+# wait for the next task, in light sleep if it's dark and there's a while to wait
+#   (nobody is watching the screen closely in a dark room)
+def nap(secs, status):
+	if alarm != None and secs > LIGHT_SLEEP_MIN and is_dark(status):
+		wake_at = alarm.time.TimeAlarm(monotonic_time=time.monotonic() + secs)
+		alarm.light_sleep_until_alarms(wake_at)
+		return False
+
+	if Touch == None:
+		time.sleep(secs)
+		return False
+
+	# awake, so watch for a tap while we wait, returns True if there was one.
+	#   Closely while another page is up and someone's paging through, every
+	#   so often on the main page, each look is a wakeup
+	poll = TOUCH_POLL if Screen.page != 0 else TOUCH_IDLE_POLL
+	while secs > poll:
+		if tapped():
+			return True
+		time.sleep(poll)
+		secs = secs - poll
+	if tapped():
+		return True
+	time.sleep(secs)
+	return False
+
+# a new touch, not one still held down from before
+def tapped():
+	global Touch_Down
+	down = Touch.touch_point != None
+	tap = down and not Touch_Down
+	Touch_Down = down
+	return tap
+
+# how soon to call the weather API again: sooner while there's an alert or the
+#   weather is changing, later overnight (see policy.py)
+def weather_mode(weather, clock, was_temp, was_conditions):
+	if weather.status_code != 200:
+		return policy.NORMAL
+	if weather.alert != "NoAlert":
+		return policy.FAST
+	if isinstance(weather.temp, int) and isinstance(was_temp, int) and abs(weather.temp - was_temp) >= WEATHER_CHANGE_TEMP:
+		return policy.FAST
+	if was_conditions != "--" and weather.conditions != was_conditions:
+		return policy.FAST
+	if is_night(clock):
+		return policy.SLOW
+	return policy.NORMAL
+
+# and the air quality API, sooner while the air is bad
+def air_quality_mode(air_quality, clock):
+	if air_quality.aq_index >= AQI_BAD:
+		return policy.FAST
+	if is_night(clock):
+		return policy.SLOW
+	return policy.NORMAL
+
+def is_night(clock):
+	return clock.hour >= NIGHT_START or (clock.hour >= 0 and clock.hour < NIGHT_END)
+
+# secs until the local time minute changes, so the clock flips right on time
+def secs_to_next_minute():
+	return Time.ms_to_next_minute() / 1000
+
+def is_dark(status):
+	return status.ambient != None and status.ambient < DARK_AMBIENT
+
+def set_backlight(status):
 	ambient = Light_Sensor.value
-	Data['ambient'] = ambient
 	board.DISPLAY.auto_brightness = False
 
-	if ambient < 1000:
+	if ambient < DARK_AMBIENT:
 		board.DISPLAY.brightness = 0.51
 	else:
 		board.DISPLAY.brightness = 0.89
 
+	# nothing shown depends on the exact level, only on dark or not
+	was_dark = is_dark(status)
+	status.ambient = ambient
+	if is_dark(status) != was_dark:
+		status.changed()
 	return;
 
 def convert_ktof(k):
@@ -331,392 +846,282 @@ def convert_mpstomph(mps):
 	mphstr = round(mps * 2.237)
 	return mphstr;
 
-def get_wind_dir_str(wind_dir):
-	wind_dir_str = "--"
-
-	wind_dir_str = "--"
-	if wind_dir >= 0 and wind_dir < 23:
-		wind_dir_str = "North"
-	elif wind_dir >= 23 and wind_dir < 68:
-		wind_dir_str = "Northeast"
-	elif wind_dir >= 68 and wind_dir < 113:
-		wind_dir_str = "East"
-	elif wind_dir >= 113 and wind_dir < 158:
-		wind_dir_str = "Southeast"
-	elif wind_dir >= 158 and wind_dir < 203:
-		wind_dir_str = "South"
-	elif wind_dir >= 203 and wind_dir < 248:
-		wind_dir_str = "Southwest"
-	elif wind_dir >= 248 and wind_dir < 293:
-		wind_dir_str = "West"
-	elif wind_dir >= 293 and wind_dir < 338:
-		wind_dir_str = "Northweast"
-	elif wind_dir >= 338:
-		wind_dir_str = "North"
-
-	return wind_dir_str
-
-def get_uvi_string(uvi):
-	uvstr = "--"
+# compass point the wind is from, an index into WIND_DIRS, -1 if unknown
+def wind_dir_index(wind_deg):
+	if wind_deg < 0:
+		return -1
+	return (wind_deg + 22) // 45 % 8
 
+# classes of UV index, index into UV_STRINGS and UV_COLORS
+def uvi_class(uvi):
 	try:
-		# UV Index as a string
-		if uvi>10:
-			uvstr = "Danger"
-		elif uvi>7:
-			uvstr = "Very High"
-		elif uvi>5:
-			uvstr = "High"
-		elif uvi>2:
-			uvstr = "Medium"
-		else:
-			uvstr = "Low"
-	except Exception as e:
-		print("    > No AQI string")
-
-	return uvstr;
-
-def get_uvi_color(uvi):
-	uvi_color = DEFAULT
-
-	try:
-		if uvi>10:
-			uvi_color = VERY_BAD
-		elif uvi>7:
-			uvi_color = BAD
-		elif uvi>5:
-			uvi_color = MODERATE
-		elif uvi>2:
-			uvi_color = FAIR
-		else:
-			uvi_color = GOOD
-	except Exception as e:
-		print("    > No UV color")
-
-	return uvi_color;
-
-def get_aqi_string(aqi):
-
-	aqistr = '--'
-
-	try:
-		aqi = int(aqi)
-		if aqi >= 1 and aqi <= 5:
-			aqistr = AIR_QUALITY[aqi]
-	except Exception as e:
-		print("    > No AQI string")
-
-	return aqistr;
-
-def get_aqi_color(aqi):
-	aqi_color = DEFAULT
-
-	try:
-		aqi = int(aqi)
-
-		if aqi == 1:
-			aqi_color = GOOD
-		elif aqi == 2:
-			aqi_color = FAIR
-		elif aqi == 3:
-			aqi_color = MODERATE
-		elif aqi == 4:
-			aqi_color = BAD
-		else:
-			aqi_color = VERY_BAD
+		return textfmt.classify(UV_CLASS, UV_CLASS_LOW, textfmt.ceil_int(uvi))
 	except Exception as e:
-		print("    > No AQI color")
+		return -1		# no UV index yet
 
-	return aqi_color;
+def get_aqi_index(aqi):
+	if isinstance(aqi, int) and aqi >= 1 and aqi <= 5:
+		return aqi
+	return 0
 
 def get_humidity_color(hum):
-	hum_color = DEFAULT
-
-	if hum<30:
-		hum_color = GOOD
-	elif hum>80:
-		hum_color = MODERATE
-	elif hum>90:
-		hum_color = BAD
-
-	return hum_color;
-
-def set_warning_led(Data):
-	# check for weather alert
-	alertstr = Data['weather_alert']
-
-	# check for not connected to internet
-	connected = Data['connected']
-	
-	if connected == False: 				# if not connected, alerts are moot
-		set_warning_level(YELLOW_ALERT)
-	elif alertstr == "NoAlert":
-		set_warning_level(ALLGOOD)
+	if not isinstance(hum, int):		# no weather yet
+		return DEFAULT
+	return HUMIDITY_COLORS[textfmt.classify(HUMIDITY_CLASS, HUMIDITY_CLASS_LOW, hum)]
+
+# neopixel color: yellow when offline, red for a weather alert
+def warning_level(status, weather):
+	if status.connected == False: 		# if not connected, alerts are moot
+		return YELLOW_ALERT
+	elif weather.alert == "NoAlert":
+		return ALLGOOD
 	else:
-		set_warning_level(RED_ALERT)
-
-	return;
+		return RED_ALERT
 
 def set_warning_level(warn):
-	Pixel[0] = warn
+	if Pixel[0] != warn:
+		Pixel[0] = warn
 	return;
 
-# correct local time and get display strings 
-def set_now(Data):
+# correct local time and note the date and time shown, the clock only counts as
+#   changed when the minute does
+def set_now(clock):
 	print("* Wrangling time")
 
-	# correct local clock to internet clock
-	local_time_correction = int(Data['local_time_correction'])
-	the_time = time.time() + local_time_correction
+	# the clock shows "--:--" until we know the time from somewhere
+	if not Time.known:
+		return;
+	the_time = Time.local()
 	timestruct = time.localtime(the_time)
 
-	# various human readable strings
-	dow = timestruct.tm_wday
-	dowstr = "--"
-	if dow >= 0 and dow <= 6:
-		dowstr = DAY_OF_WEEK[dow]
-	Data['day_of_week'] = dowstr
-
-	mon = timestruct.tm_mon
-	monstr = "--"
-	if mon >= 1 and mon <= 12:
-		monstr = MONTH_ABBR[mon]
-	Data['month'] = monstr
-
-	Data['day_of_month'] = str(timestruct.tm_mday)
-
-	# hour and minute, with leading zero for minute
-	Data['hour'] = str(timestruct.tm_hour)
-
-	m = timestruct.tm_min
-	if m < 10:
-		mstr = "0" + str(m)
-	else:
-		mstr = str(m)
-	Data['minute'] = mstr
-
+	if timestruct.tm_min == clock.minute and timestruct.tm_hour == clock.hour and timestruct.tm_mday == clock.day_of_month:
+		return;
+
+	clock.year = timestruct.tm_year
+	clock.month = timestruct.tm_mon
+	clock.day_of_month = timestruct.tm_mday
+	clock.day_of_week = timestruct.tm_wday
+	clock.hour = timestruct.tm_hour
+	clock.minute = timestruct.tm_min
+	clock.local_time = the_time - timestruct.tm_sec
+	clock.changed()
 	return;
 
-def show_data(Data):
+def show_data(screen, views, texts, warning, charts):
 
 	print("* Showing Data")
 
-	# set backlight brightness, based on ambient light sensor
-	set_backlight(Data)
-
-	# update display
-	draw_display(Data)
+	# update display, every page of it
+	draw_display(views, texts)
+	for chart, series in charts:
+		chart.update(series)
 
 	# set warning light
-	set_warning_led(Data)
+	set_warning_level(warning.get())
+
+	# push any changes out to the screen and collect garbage left over
+	#   from all that graphics activity
+	if screen.refresh():
+		collect_garbage()
 
-	# collect garbage left over from all that graphics activity
-	gc.collect()
+	print("  Free memory:", gc.mem_free())
 	return;
 
 def get_temp_color(t):
-	c = DEFAULT
-
-	try:
-		t = int(t)
-		if t > 100:
-			c = SCORTCH
-		elif t > 89:
-			c = HOT
-		elif t > 74:
-			c = WARM
-		elif t > 49:
-			c = MILD
-		elif t > 32:
-			c = COLD
-		else:
-			c = FREEZING
-	except Exception as e:
-		print("   > No temp color")
-
-	return c;
-
-def get_sunrise(Data):
-	sr = None
-
-	try:
-		# correct local clock to internet clock
-		local_time_correction = int(Data['local_time_correction'])
-		the_time = time.time() + local_time_correction
-
-		sr_secs = Data['sunrise'] - the_time 
-		sr_mins = round(sr_secs/60)
-
-		if sr_mins > 0 and sr_mins < 60:
-			sr = str(sr_mins) + " to minutes sunrise"
-	except Exception as e:
-		print("    > Sunrise")
-
-	return sr;
-
-def get_sunset(Data):
-	ss = None
-
-	try:
-		# correct local clock to internet clock
-		local_time_correction = int(Data['local_time_correction'])
-		the_time = time.time() + local_time_correction
-
-		ss_secs = Data['sunset'] - the_time
-		ss_mins = round(ss_secs/60)
-
-		if ss_mins > 0 and ss_mins < 60:
-			ss = str(ss_mins) + " minutes to sunset"
-	except Exception as e:
-		print("    > Sunset")
-
-	return ss;
-
-def get_moon_phase(Data):
-	mp = None
-
+	if not isinstance(t, int):
+		return DEFAULT
+	return TEMP_COLORS[textfmt.classify(TEMP_CLASS, TEMP_CLASS_LOW, t)]
+
+# minutes until a local time, if it's within the hour
+def minutes_until(when, clock):
+	mins = round((when - clock.local_time) / 60)
+	if mins > 0 and mins < 60:
+		return mins
+	return None
+
+def get_moon_phase(weather):
 	try:
-		phase = 0.0
-		phase = float(Data['moon_phase'])
+		phase = float(weather.moon_phase)
 		if phase > 0.48 and phase < 0.52:
-			mp = "Look for full moon"
+			return True
 	except Exception as e:
 		print("    > No Moon phase")
 	
-	return mp;
+	return False
 
-def set_flex(Data):		# flex line is informative, but also fun
-	print("* Setting Flex line")
+# what each label shows, worked out from the state it's given (see the
+#   Deriveds in main_loop).  Each fills in its own line (see textfmt.py), so
+#   nothing is allocated unless what the line says has changed
 
-	flex_str = "--"
-	flex_color = DEFAULT
+def flex_line(status, weather, air_quality, clock):		# flex line is informative, but also fun
+	print("* Setting Flex line")
+	line = Flex_Line
 
 	# check for daily stuff
-	sunrise = get_sunrise(Data)
-	sunset = get_sunset(Data)
-	moon_phase = get_moon_phase(Data)
-	connected = Data['connected']
-	alert_str = Data['weather_alert']
+	sunrise = minutes_until(weather.sunrise, clock)
+	sunset = minutes_until(weather.sunset, clock)
 
-	if connected == False:
-		flex_str = "NO INTERNET CONNECTION"
-		flex_color = VERY_BAD
+	if status.connected == False:
+		line.start(VERY_BAD).add(b"NO INTERNET CONNECTION")
 
-	elif Data['weather_alert'] != "NoAlert":
+	elif weather.alert != "NoAlert":
 		# weather alerts are a big deal, safety-wise
-		flex_str = alert_str
-		flex_color = BAD
+		line.start(BAD).add(weather.alert)
 
-	elif Data['month'] == "May" and Data['day_of_month'] == "28":
+	elif clock.month == 5 and clock.day_of_month == 28:
 		# birthdays are special
-		flex_str = "Happy birthday PATRICIA!!"
-		flex_color = FAIR
+		line.start(FAIR).add(b"Happy birthday PATRICIA!!")
 
-	elif Data['weather_status_code'] != 200:
-		flex_str = "Weather API response: " + Data['weather_status_code']
-		flex_color = MODERATE
+	elif weather.status_code != 200:
+		line.start(MODERATE).add(b"Weather API response: ").add_int(weather.status_code)
 
-	elif Data['aqi_status_code'] != 200:
-		flex_str = "Air Quality API response: " + Data['aqi_status_code']
-		flex_color = MODERATE
+	elif air_quality.status_code != 200:
+		line.start(MODERATE).add(b"Air Quality API response: ").add_int(air_quality.status_code)
 
 	elif sunrise != None:
-		flex_str = sunrise
-		flex_color = MODERATE
+		line.start(MODERATE).add_int(sunrise).add(b" minutes to sunrise")
 
 	elif sunset != None:
-		flex_str = sunset
-		flex_color = MODERATE
+		line.start(MODERATE).add_int(sunset).add(b" minutes to sunset")
 
-	elif moon_phase != None:
-		flex_str = moon_phase
-		flex_color = MODERATE
+	elif get_moon_phase(weather):
+		line.start(MODERATE).add(b"Look for full moon")
 
 	else:
 		# if nothing else, do wind speed and pressure (color is default)
-		try:
-			pressure = Data['pressure']
-			wind_speed = Data['wind_speed']
-			wind_dir = Data['wind_dir']
+		line.start(DEFAULT)
+		if weather.wind_speed < 3:
+			line.add(b"Winds calm")
+		else:
+			line.add(WIND_DIRS[weather.wind_dir]).add(b" winds at ").add_value(weather.wind_speed).add(b"mph")
+		line.add(b", ").add_value(weather.pressure).add(b"mb")
 
-			if wind_speed < 3:
-				flex_str = "Winds calm"
-			else:
-				flex_str = wind_dir + " winds " + " at " + str(wind_speed) + "mph"
-			flex_str  = flex_str + ", " + str(pressure) + "mb"
+	return line.finish()
 
-		except Exception as e:
-			print("    > No wind speed, wind direction or pressure:", e)
+def temp_text(weather):
+	return Temp_Line.start(get_temp_color(weather.temp)).add_value(weather.temp).finish()
 
-	Data['flex_string'] = flex_str
-	Data['flex_color'] = flex_color
+def humidity_text(weather):
+	return Humidity_Line.start(get_humidity_color(weather.humidity)).add_value(weather.humidity).add(b"%").finish()
 
- 	return;
+def conditions_text(weather):
+	return Conditions_Line.start(DEFAULT).add(weather.conditions).finish()
 
-# ================================================================
-def draw_display(Data):
-	print ("* Drawing Display")
-	# draw display by plugging new strings into existing labels
+def date_text(clock):
+	line = Date_Line.start(GRAY)
+	dow = clock.day_of_week
+	if dow >= 0 and dow <= 6:
+		line.add(DAY_OF_WEEK[dow])
+	else:
+		line.add(b"--")
 
-	# temperature
-	tval = Data['temp']
-	temp_label = Data['temp_label']
-	temp_label.color = get_temp_color(tval)
-	temp_label.text = str(tval)
+	line.add(b", ").add(MONTH_ABBR[clock.month]).add(b" ")
 
-	# humidity
-	hum = Data['humidity']
-	hstr = str(hum) + "%"
-	hum_label = Data['humidity_label']
-	hum_label.text = hstr
-	hum_label.color = get_humidity_color(hum)
-
-	# conditions
-	cstr = Data['conditions']
-	cond_label = Data['cond_label']
-	cond_label.color = DEFAULT
-	cond_label.text = cstr
+	if clock.day_of_month > 0:
+		line.add_int(clock.day_of_month)
+	else:
+		line.add(b"--")
+	return line.finish()
 
-	# date and time
-	dstr = Data['day_of_week'] + ", " + Data['month'] + " " + Data['day_of_month']
-	date_label = Data['date_label']
-	date_label.text = dstr
-
-	tstr = Data['hour'] + ":" + Data['minute']
-	time_label = Data['time_label']
-	time_label.text = tstr
-
-	# air quality
-	aqi = Data['aq_index']
-	astr = "Air Quality:  " + get_aqi_string(aqi)
-	aqi_label = Data['aqi_label']
-	aqi_label.color = get_aqi_color(aqi)
-	aqi_label.text = astr
-
-	# uv index
-	uvi = Data['uv_index']
-	ustr = "UV Danger:  " + get_uvi_string(uvi)
-	uv_label = Data['uv_label']
-	uvcol = get_uvi_color(uvi)
-	uv_label.color = uvcol
-	uv_label.text = ustr
-
-	# flex line
-	flex_str = Data['flex_string']
-	flex_color = Data['flex_color']
-	flex_label = Data['flex_label']
-	flex_label.text = flex_str
-	flex_label.color = flex_color
+def time_text(clock):
+	line = Time_Line.start(GRAY)
+	if clock.hour < 0:
+		line.add(b"--:--")
+	else:
+		# hour and minute, with leading zero for minute
+		line.add_int(clock.hour).add(b":").add_int(clock.minute, 2)
+	return line.finish()
+
+def aqi_text(air_quality):
+	aqi = get_aqi_index(air_quality.aq_index)
+	return Aqi_Line.start(AQI_COLORS[aqi]).add(b"Air Quality:  ").add(AIR_QUALITY[aqi]).finish()
+
+def uv_text(weather):
+	uv = uvi_class(weather.uv_index)
+	line = Uv_Line.start(DEFAULT).add(b"UV Danger:  ")
+	if uv < 0:
+		line.add(b"--")
+	else:
+		line.color = UV_COLORS[uv]
+		line.add(UV_STRINGS[uv])
+	return line.finish()
+
+def inside_text(inside):
+	line = Inside_Line.start(DEFAULT)
+	line.add(b"Inside:   ").add_value(inside.temp).add(b"   ").add_value(inside.humidity).add(b"%   ")
+	line.add_value(inside.co2).add(b"ppm")
+	return line.finish()
+
+# what one row of the forecast page shows, day 0 is tomorrow
+def forecast_texts(day):
+	day_line = textfmt.Line(4)
+	summary_line = textfmt.Line(16)
+	temps_line = textfmt.Line(12)
+
+	def forecast_day(forecast):
+		if day >= forecast.days:
+			return day_line.start(GRAY).add(b"--").finish()
+		return day_line.start(GRAY).add(DAY_OF_WEEK[forecast.day_of_week[day]]).finish()
+
+	def forecast_summary(forecast):
+		if day >= forecast.days:
+			return summary_line.start(DEFAULT).add(b"--").finish()
+		return summary_line.start(DEFAULT).add(forecast.summary[day]).finish()
+
+	def forecast_temps(forecast):
+		if day >= forecast.days:
+			return temps_line.start(GRAY).add(b"--").finish()
+		high = forecast.high[day]
+		return temps_line.start(get_temp_color(high)).add_int(high).add(b" / ").add_int(forecast.low[day]).finish()
+
+	return forecast_day, forecast_summary, forecast_temps
+
+# the caption over a history chart, the day's range of the series
+def history_caption(title, series):
+	line = textfmt.Line(32)
+
+	def history_text(inside):
+		return line.start(DEFAULT).add(title).add(b"   ").add_value(series.min()).add(b" to ").add_value(series.max()).finish()
+
+	return history_text
+
+# CO2 trend arrow, hidden until there's enough history
+def co2_arrow_shape(inside):
+	trend = inside.co2_trend
+	if trend == None:
+		return ARROW_HIDDEN
+	elif trend > CO2_TREND_PPM:
+		return ARROW_UP
+	elif trend < -CO2_TREND_PPM:
+		return ARROW_DOWN
+	else:
+		return ARROW_FLAT
+
+# compiled PCF fonts load far faster than BDF text, but fall back to the BDF if
+#   there isn't one.  Then load every glyph we'll draw in one go, rather than
+#   stalling the first draw while they're found one at a time
+def load_font(name, glyphs):
+	try:
+		font = bitmap_font.load_font("/fonts/" + name + ".pcf")
+	except OSError:
+		print("!!!! No compiled font for", name, "using BDF")
+		font = bitmap_font.load_font("/fonts/" + name + ".bdf")
+
+	font.load_glyphs(glyphs)
+	return font;
+
+# ================================================================
+def draw_display(views, texts):
+	print ("* Drawing Display")
+	# draw display by handing each view what its label should show.  Texts are
+	#   only worked out again when their state has changed, and the views only
+	#   touch the labels that changed
+	i = 0
+	while i < len(views):
+		shown = texts[i].get()
+		views[i].update(shown.text, shown.color)
+		i = i + 1
 
-	# inside
-	freestr = str(gc.mem_free())
-	istr = "Inside:   " + str(Data['inside_temp']) + "   " + str(Data['inside_humidity']) + "%   " + str(Data['inside_co2']) + "ppm" + "        (" + freestr + ")"
-	inside_label = Data['inside_label']
-	inside_label.text = istr	
-
-	# show it all
-	display_group = Data['display_group'] 
-	board.DISPLAY.show(display_group)	
 	return;
 
 ################################### START ###########################################
@@ -737,22 +1142,108 @@ LONGITUDE = secrets['Longitude']
 OPEN_WEATHER_URL = "http://api.openweathermap.org/data/3.0/onecall?lat="+LATITUDE+"&lon="+LONGITUDE+"&exclude=hourly,minutely&appid="+WEATHER_API_KEY
 OPEN_WEATHER_AQI_URL = "http://api.openweathermap.org/data/2.5/air_pollution?lat="+LATITUDE+"&lon="+LONGITUDE+"&appid="+WEATHER_API_KEY
 
-MAIN_SLEEP = 10   			# how much to sleep in main loop, secs
-EXCEPTION_SLEEP = 20		# how much to sleep in exception loop (when things are failing badly), secs
+# a hub on the LAN to get the weather from, if there is one (see tools/hub)
+HUB_URL = secrets.get('hub_url')
+if HUB_URL != None:
+	HUB_WEATHER_URL = HUB_URL+"?lat="+LATITUDE+"&lon="+LONGITUDE
+
+# an Adafruit IO account to send telemetry to, if there is one (see telemetry.py).
+#   Feeds are in a group, so their keys are "dakota.co2" and so on
+AIO_USERNAME = secrets.get('aio_username')
+AIO_KEY = secrets.get('aio_key')
+AIO_GROUP = secrets.get('aio_group', "dakota")
+AIO_URL = secrets.get('aio_url', telemetry.AIO_URL)		# tools/aio/mockio.py, for trying it out
+FEED_CO2 = 0
+FEED_INSIDE_TEMP = 1
+FEED_INSIDE_HUMIDITY = 2
+FEED_LOOP_MS = 3
+FEED_MEM_FREE = 4
+FEED_RSSI = 5
+FEED_WEATHER_STATUS = 6
+FEED_AQI_STATUS = 7
+AIO_FEEDS = ( "co2", "inside-temp", "inside-humidity", "loop-ms", "mem-free", "rssi", "weather-status", "aqi-status" )
+
+# the only parts of the API responses we use, everything else is skipped as it streams in
+WEATHER_PICKS = (
+	"timezone_offset",
+	"current.dt", "current.temp", "current.humidity", "current.pressure", "current.uvi",
+	"current.sunrise", "current.sunset", "current.wind_deg", "current.wind_speed",
+	"current.weather.0.description",
+	"daily.0.moon_phase",
+	"daily.*.dt", "daily.*.temp.min", "daily.*.temp.max", "daily.*.weather.0.main",
+	"alerts.*.event", "alerts.*.start", "alerts.*.end" )
+AIR_QUALITY_PICKS = ( "list.0.main.aqi", )
+
+EXCEPTION_SLEEP = 20		# most to sleep in exception loop (when things are failing badly), secs
+RESTART_WAIT = 1			# secs, first sleep after main_loop fails
+RESTART_STABLE = 600		# secs main_loop has to run for before the sleep starts over from RESTART_WAIT
+WATCHDOG_TIMEOUT = 16		# secs a pass through the loop can take before the board is reset, the SAMD51's longest
+CLOCK_STUCK = 150			# secs the clock can go without moving on, once the time is known, before the loop is unhealthy
 
 # these constants have to do with how often we do things (like ask for weather data from internet)
 # prime numbers so they won't match up very often...
 WEATHER_FREQ = 601       # secs
 AIR_QUALITY_FREQ = 3_307 # secs
-SENSOR_READ_FREQ = 47    # secs
-
-# Degrees C calibration factor for this particular SCD-30 sensor from known good sensors
+SENSOR_READ_FREQ = 47    # secs, also the SCD-30's measurement interval
+CONNECTION_FREQ = 11     # secs
+BACKLIGHT_FREQ = 5       # secs, right after the light changes
+BACKLIGHT_MAX_FREQ = 17  # secs, while the light stays the same
+LIGHT_SLEEP_MIN = 1      # secs, shorter waits aren't worth light sleep
+STATS_FREQ = 3_607       # secs, how often task timings are printed
+FETCH_STEP = 0.05        # secs between steps of a download in progress
+COALESCE_WINDOW = 300    # secs, an API due this soon is called along with the other one
+
+# API calls come sooner while things are happening and later overnight, within a daily budget (see policy.py)
+WEATHER_FAST_FREQ = 307          # secs, during an alert or while the weather is changing
+WEATHER_SLOW_FREQ = 1_801        # secs, overnight
+WEATHER_DAILY_BUDGET = 400       # calls, One Call 3.0 is free up to 1,000 a day
+AIR_QUALITY_FAST_FREQ = 1_201    # secs, while the air is bad
+AIR_QUALITY_SLOW_FREQ = 7_207    # secs, overnight
+AIR_QUALITY_DAILY_BUDGET = 60    # calls
+WEATHER_CHANGE_TEMP = 3          # degrees F between calls that counts as changing
+AQI_BAD = 3                      # aq index from "Unhealthy for sensitives" up
+NIGHT_START = 23                 # local hour
+NIGHT_END = 6
+PAGE_TIMEOUT = 60        # secs a page other than the main one stays up untouched
+TOUCH_POLL = 0.1         # secs between looks at the touchscreen while a page other than the main one is up
+TOUCH_IDLE_POLL = 0.5    # secs between looks on the main page, a tap has to be held about this long
+LABEL_CACHE_BYTES = 16_384      # bytes of rendered labels kept for the flex, conditions, AQI and UV lines
+TELEMETRY_FREQ = 307     # secs, how often readings are queued for Adafruit IO
+
+# light sensor reading below which the room is dark
+DARK_AMBIENT = 1000
+
+# Degrees C calibration factor for this particular SCD-30 sensor from known good sensors,
+#   written to the sensor's temperature offset (see co2sensor.py)
 TEMP_SENSOR_CALIBRATION = -0.8  
 
+# sensor history, a day of readings at SENSOR_READ_FREQ (see history.py)
+HISTORY_SIZE = 24 * 3600 // SENSOR_READ_FREQ + 1
+TREND_SAMPLES = 16			# CO2 trend compares the last 16 readings (12.5 mins) with the 16 before
+CO2_TREND_PPM = 25			# ppm change in the average that gets an up or down arrow
+
+# history page charts, a column every few readings (see render.ChartView)
+CHART_WIDTH = 440			# pixels
+CHART_HEIGHT = 56
+CHART_SPAN_CO2 = 100		# least range a chart shows, ppm
+CHART_SPAN_TEMP = 4			# degrees F
+CHART_SPAN_HUMIDITY = 10	# percent
+
+# CO2 trend arrow outlines, 16x18 pixels
+TREND_UP = 0
+TREND_FLAT = 1
+TREND_DOWN = 2
+TREND_OUTLINES = (
+	[(0, 18), (8, 0), (16, 18)],
+	[(0, 0), (16, 9), (0, 18)],
+	[(0, 0), (16, 0), (8, 18)] )
+
 # Some string values
-AIR_QUALITY = [ "--", "Good", "Moderate", "Unhealthy for sensitives", "Unhealthy", "Very Unhealthy"]
-DAY_OF_WEEK = [ "Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-MONTH_ABBR = [ "--", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec" ]
+AIR_QUALITY = ( b"--", b"Good", b"Moderate", b"Unhealthy for sensitives", b"Unhealthy", b"Very Unhealthy" )
+DAY_OF_WEEK = ( b"Mon", b"Tue", b"Wed", b"Thu", b"Fri", b"Sat", b"Sun" )
+MONTH_ABBR = ( b"--", b"Jan", b"Feb", b"Mar", b"Apr", b"May", b"Jun", b"Jul", b"Aug", b"Sep", b"Oct", b"Nov", b"Dec" )
+UV_STRINGS = ( b"Low", b"Medium", b"High", b"Very High", b"Danger" )
+WIND_DIRS = ( b"North", b"Northeast", b"East", b"Southeast", b"South", b"Southwest", b"West", b"Northwest", b"--" )
 
 # Neopixel warning colors
 ALLGOOD = (0, 0, 0)				# for the neopixel "all good" is "off"
@@ -778,10 +1269,49 @@ VERY_BAD = (252, 40, 80)
 
 DEFAULT = (0, 200, 40)
 
+# colors for each class of reading, the classes come from lookup tables rather
+#   than if/elif chains (see textfmt.py).  UV index classes go by the index
+#   rounded up: over 2 is medium, over 5 high, over 7 very high and over 10 danger
+TEMP_COLORS = (FREEZING, COLD, MILD, WARM, HOT, SCORTCH)
+TEMP_CLASS_LOW = 32
+TEMP_CLASS = textfmt.class_table(TEMP_CLASS_LOW, 101, (33, 50, 75, 90, 101))
+HUMIDITY_COLORS = (GOOD, DEFAULT, MODERATE, BAD)
+HUMIDITY_CLASS_LOW = 29
+HUMIDITY_CLASS = textfmt.class_table(HUMIDITY_CLASS_LOW, 91, (30, 81, 91))
+UV_COLORS = (GOOD, FAIR, MODERATE, BAD, VERY_BAD)
+UV_CLASS_LOW = 2
+UV_CLASS = textfmt.class_table(UV_CLASS_LOW, 11, (3, 6, 8, 11))
+AQI_COLORS = (DEFAULT, GOOD, FAIR, MODERATE, BAD, VERY_BAD)
+
+# CO2 trend arrow, outline and color
+ARROW_HIDDEN = textfmt.Fixed(None, None)
+ARROW_UP = textfmt.Fixed(TREND_UP, MODERATE)
+ARROW_FLAT = textfmt.Fixed(TREND_FLAT, DEFAULT)
+ARROW_DOWN = textfmt.Fixed(TREND_DOWN, GOOD)
+
+# each display line is written into its own buffer, allocated once
+Temp_Line = textfmt.Line(8)
+Humidity_Line = textfmt.Line(8)
+Conditions_Line = textfmt.Line(40)
+Date_Line = textfmt.Line(16)
+Time_Line = textfmt.Line(8)
+Aqi_Line = textfmt.Line(40)
+Uv_Line = textfmt.Line(24)
+Flex_Line = textfmt.Line(64)
+Inside_Line = textfmt.Line(40)
+
+# glyphs each font draws, the compiled fonts hold only these (see tools/fontc.py)
+ALNUM = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BIG_GLYPHS = "0123456789:-"					# time and temperature
+DIGIT_TILE_WIDTH = 20							# pixels, half a big digit (see sprites.py)
+MED_GLYPHS = ALNUM + " ,%-./'"				# humidity, conditions and date
+SM_GLYPHS = ALNUM + " !\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~"	# alerts can say anything
+
 # set up fonts
-BigFont = bitmap_font.load_font("/fonts/Source_Sans_Pro_Bold-72.bdf")
-MedFont = bitmap_font.load_font("/fonts/Source_Sans_Pro-32.bdf")
-SmFont = bitmap_font.load_font("/fonts/Source_Sans_Pro-24.bdf")
+# the big digits are drawn once into a sprite sheet, and the font let go
+Digits = sprites.SpriteSheet(load_font("Source_Sans_Pro_Bold-72", BIG_GLYPHS), BIG_GLYPHS, DIGIT_TILE_WIDTH)
+MedFont = load_font("Source_Sans_Pro-32", MED_GLYPHS)
+SmFont = load_font("Source_Sans_Pro-24", SM_GLYPHS)
 
 # display stuff
 DISPLAY_WIDTH = 480
@@ -795,7 +1325,13 @@ Esp32_reset = DigitalInOut(board.ESP_RESET)
 spi = busio.SPI(board.SCK, board.MOSI, board.MISO)
 esp = adafruit_esp32spi.ESP_SPIcontrol(spi, Esp32_cs, Esp32_ready, Esp32_reset)
 
-requests.set_socket(socket, esp)
+# the WiFi connection, kept here so its uptime and counts survive main_loop restarts
+Wifi = wifi.Connection(esp, secrets["ssid"], secrets["password"], CONNECTION_FREQ)
+
+# sensor log on the SD card (shares the SPI bus with the ESP32), if there's a card
+Sensor_Log = None
+if sdlog.mount(spi, board.SD_CS):
+	Sensor_Log = sdlog.Log()
 
 # SCD-30 sensor
 try:
@@ -805,24 +1341,122 @@ except Exception as e:
 	print("!!!! No SCD-30 sensor")
 	Scd30 = None
 
+# reads the SCD-30 once per sample, at its own interval (see co2sensor.py)
+Sensor = None
+if Scd30 != None:
+	Sensor = co2sensor.Co2Sensor(Scd30, SENSOR_READ_FREQ, TEMP_SENSOR_CALIBRATION)
+
+# when to call the APIs again, kept here so the daily budgets survive main_loop restarts
+Weather_Policy = policy.FetchPolicy("weather", WEATHER_FREQ, WEATHER_FAST_FREQ, WEATHER_SLOW_FREQ, WEATHER_DAILY_BUDGET)
+Air_Quality_Policy = policy.FetchPolicy("air quality", AIR_QUALITY_FREQ, AIR_QUALITY_FAST_FREQ, AIR_QUALITY_SLOW_FREQ,
+	AIR_QUALITY_DAILY_BUDGET)
+
+# watches the loop and feeds the watchdog, kept here so the histograms survive
+#   main_loop restarts.  Says where it was stuck if the last reset was a stall
+Health = health.Supervisor(WATCHDOG_TIMEOUT)
+Health.recall()
+
+# wall clock time, kept here so the drift it's learned survives main_loop restarts
+Time = timekeeper.TimeKeeper()
+
+# looked-up addresses and kept-alive connections for the fetches (see fetcher.py)
+Http = fetcher.Session(esp)
+
+# telemetry queues, allocated once here so they survive main_loop restarts
+Telemetry = None
+if AIO_USERNAME != None and AIO_KEY != None:
+	Telemetry = telemetry.Uploader(AIO_USERNAME, AIO_KEY, [AIO_GROUP + "." + f for f in AIO_FEEDS],
+		AIO_URL, session=Http)
+
+# labels already rendered for the lines that go round the same few texts
+Labels = labelcache.LabelCache(bitmap_label.Label, LABEL_CACHE_BYTES)
+
+# sensor history, allocated once here so it survives main_loop restarts and
+#   never grows (about 11K per reading)
+Co2_History = history.Series(HISTORY_SIZE, 1, TREND_SAMPLES)
+Temp_History = history.Series(HISTORY_SIZE, 10, TREND_SAMPLES)
+Humidity_History = history.Series(HISTORY_SIZE, 10, TREND_SAMPLES)
+print("Sensor history:", Co2_History.nbytes() + Temp_History.nbytes() + Humidity_History.nbytes(), "bytes")
+
 # we'll be using the built-in light sensor
 Light_Sensor = AnalogIn(board.LIGHT)
 
+# touchscreen, for paging through the screens
+Touch = None
+Touch_Down = False
+if adafruit_touchscreen != None:
+	Touch = adafruit_touchscreen.Touchscreen(board.TOUCH_XL, board.TOUCH_XR, board.TOUCH_YD, board.TOUCH_YU,
+		calibration=((5200, 59000), (5800, 57000)), size=(board.DISPLAY.width, board.DISPLAY.height))
+
 # onboard neopixel
 Pixel = neopixel.NeoPixel(board.NEOPIXEL, 1, auto_write=True)
 Pixel[0] = ALLGOOD
 
-# call the main loop forever.  If an exception, report it and go again
-while True:
-	try:
-		main_loop ( esp )
+# time each stage of the loop and watch the heap, this costs nothing unless
+#   instrument.ENABLED is turned on
+get_weather = instrument.wrap("get_weather", get_weather)
+get_air_quality = instrument.wrap("get_air_quality", get_air_quality)
+get_sensor_data = instrument.wrap("get_sensor_data", get_sensor_data)
+set_now = instrument.wrap("set_now", set_now)
+flex_line = instrument.wrap("flex_line", flex_line)
+draw_display = instrument.wrap("draw_display", draw_display)
+collect_garbage = instrument.wrap("gc.collect", gc.collect)
+
+# All of our data is in here, one group for each source (see state.py), and the
+#   screen that shows it.  They're made just once, here, so when main_loop has to
+#   start over it carries on with the same labels and the last good data instead
+#   of allocating it all again on a heap that's likely what made it fail.  Time
+#   is unknown as we start, but known once a correction is found.  Time may not
+#   be very accurate if API calls are failing, but we'll show it anyway
+Data = state.State()
+
+# last time we got good data from the APIs, by the onboard clock
+Last_Weather = 0
+Last_Air_Quality = 0
+
+# start from the last good data, if it's fresh enough, so there's something on
+#   screen right away and the APIs aren't called again until they're due
+cached = datacache.load(Data.weather, Data.air_quality)
+if cached != None:
+	print("* Using cached data")
+	Last_Weather, Last_Air_Quality = cached
+	Time.set_zone(Data.weather.timezone_offset)
+	Time.hint(time.time() + int(Data.weather.local_time_correction) - Data.weather.timezone_offset)
+
+Screen, Views, Texts, Warning, Charts = build_ui(Data)
+
+# call the main loop forever.  If an exception, report it and go again, after
+#   a wait that starts short and doubles each time main_loop fails again soon.
+#   The screen and data are kept, so there's no blank screen while we wait
+def run_forever(esp):
+	Health.start()
+	wait = RESTART_WAIT
+	while True:
+		started = time.monotonic()
+		try:
+			main_loop ( esp )
 
-	except Exception as e:
-		print ("!!!! Dakota main_loop threw exception: ", e )
-		print(type(e))
-		print("Retry...")
+		# stuck somewhere, leave a breadcrumb and reset (where there is no reset,
+		#   it starts over like any other failure)
+		except health.WatchDogTimeout:
+			Health.fail("main_loop")
+
+		except Exception as e:
+			print ("!!!! Dakota main_loop threw exception: ", e )
+			print(type(e))
 
-	time.sleep(EXCEPTION_SLEEP)
+		# a loop that ran for a good while before it failed isn't failing over and over
+		if time.monotonic() - started > RESTART_STABLE:
+			wait = RESTART_WAIT
+		print("Retry in", wait, "secs...")
+		collect_garbage()
+		Health.sleep(wait)
+		wait = min(wait * 2, EXCEPTION_SLEEP)
+
+	return;
 
-print("Dakota Done")
+# (the host simulator in tools/sim loads this file without starting the loop)
+if __name__ == "__main__":
+	run_forever(esp)
 
+	print("Dakota Done")
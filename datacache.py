@@ -0,0 +1,124 @@
+# Last-known-good data cache for Dakota
+#
+# Keeps the fields we fetched from the APIs, the local time correction and
+# when the fetches happened in one small binary record in NVM (flash that
+# survives a reset).  On the way back into main_loop, a record that is still
+# fresh fills the screen straight away and tells the loop the APIs aren't due
+# yet, instead of showing "--" and hitting both APIs at once.
+#
+# Times in the record are onboard clock times (time.time()), the same clock
+# main_loop keeps its Last_* counters in.  It keeps running through a reload
+# of code.py but starts over when the board is reset or loses power, and then
+# there's no telling how old the record is and it's ignored.
+
+import struct
+import time
+
+from records import checksum, pack_number, unpack_number, pack_float, unpack_float, pack_string, unpack_string
+
+try:
+	import microcontroller
+	Nvm = microcontroller.nvm
+except (ImportError, AttributeError):
+	Nvm = None
+
+NVM_OFFSET = 0			# where the record lives in NVM
+MAX_AGE = 3_607			# secs, older records aren't worth showing
+SAVE_FREQ = 1_801		# secs, least time between writes, flash wears out
+
+_MAGIC = b"DK"
+_VERSION = 3
+
+# magic, version, saved at, last weather, last air quality, local time correction,
+#   timezone offset, temp, humidity, pressure, wind speed, uv index, moon phase,
+#   sunrise, sunset, weather status, aqi status, aq index, conditions, wind direction,
+#   weather alert
+_FORMAT = "<2sBxIIIiihhhhffIIhhBx24sb11x40s"
+_SIZE = struct.calcsize(_FORMAT)
+RECORD_SIZE = _SIZE + 2		# plus checksum
+
+_last_save = None
+
+def save(weather, air_quality, last_weather, last_air_quality):
+	global _last_save
+
+	now = int(time.time())
+	if Nvm is None or (_last_save is not None and now - _last_save < SAVE_FREQ):
+		return False
+
+	try:
+		record = struct.pack(_FORMAT, _MAGIC, _VERSION,
+			now, last_weather, last_air_quality,
+			int(weather.local_time_correction),
+			int(weather.timezone_offset),
+			pack_number(weather.temp),
+			pack_number(weather.humidity),
+			pack_number(weather.pressure),
+			pack_number(weather.wind_speed),
+			pack_float(weather.uv_index),
+			pack_float(weather.moon_phase),
+			int(weather.sunrise),
+			int(weather.sunset),
+			int(weather.status_code),
+			int(air_quality.status_code),
+			int(air_quality.aq_index),
+			pack_string(weather.conditions, 24),
+			int(weather.wind_dir),
+			pack_string(weather.alert, 40))
+		record = record + struct.pack("<H", checksum(record))
+
+		Nvm[NVM_OFFSET:NVM_OFFSET + RECORD_SIZE] = record
+		_last_save = now
+	except Exception as e:
+		print("    > Data cache not saved:", e)
+		return False
+
+	return True
+
+# put a fresh record into weather and air_quality (see state.py), returns
+#   (last_weather, last_air_quality), or None if there's no record worth using
+def load(weather, air_quality):
+	if Nvm is None:
+		return None
+
+	try:
+		record = bytes(Nvm[NVM_OFFSET:NVM_OFFSET + RECORD_SIZE])
+		if record[:2] != _MAGIC or record[2] != _VERSION:
+			return None
+		if struct.unpack_from("<H", record, _SIZE)[0] != checksum(record[:_SIZE]):
+			return None
+
+		(magic, version, saved_at, last_weather, last_air_quality, correction, tz_off,
+			temp, humidity, pressure, wind_speed, uv_index, moon_phase, sunrise, sunset,
+			weather_status_code, aqi_status_code, aq_index,
+			conditions, wind_dir, weather_alert) = struct.unpack_from(_FORMAT, record)
+
+		# onboard clock restarted or record is stale
+		now = int(time.time())
+		if saved_at > now or now - saved_at > MAX_AGE:
+			return None
+
+		weather.local_time_correction = correction
+		weather.timezone_offset = tz_off
+		weather.temp = unpack_number(temp)
+		weather.humidity = unpack_number(humidity)
+		weather.pressure = unpack_number(pressure)
+		weather.wind_speed = unpack_number(wind_speed)
+		weather.uv_index = unpack_float(uv_index)
+		weather.moon_phase = unpack_float(moon_phase)
+		weather.sunrise = sunrise
+		weather.sunset = sunset
+		weather.status_code = weather_status_code
+		weather.conditions = unpack_string(conditions)
+		weather.wind_dir = wind_dir
+		weather.alert = unpack_string(weather_alert)
+		weather.changed()
+
+		air_quality.status_code = aqi_status_code
+		air_quality.aq_index = aq_index
+		air_quality.changed()
+	except Exception as e:
+		print("    > Data cache not loaded:", e)
+		return None
+
+	return (last_weather, last_air_quality)
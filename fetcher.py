@@ -0,0 +1,428 @@
+# Non-blocking HTTP fetches over the ESP32 coprocessor for Dakota
+#
+# requests.get() holds up the whole device until the response is in, and a
+# socket that hangs holds it up for good.  An HttpFetch instead moves through
+# explicit states (connect, send, read headers, read body), doing a bounded
+# amount of work each time step() is called, so the rest of the loop keeps
+# going while a download is in progress.  Each state has its own timeout.
+#
+# The body goes to a sink a chunk at a time as it arrives; anything with a
+# feed(chunk) method and a done property will do, such as a JsonPicker.  The
+# fetch stops reading as soon as the sink is done.
+#
+# Looking up the host and opening a socket through the ESP32 is most of the
+# time a fetch takes.  A fetch made with a Session asks the server to keep
+# the connection open (HTTP/1.0 keep-alive, so there's never a chunked body
+# to undo), and when the whole body has been read the Session holds on to the
+# socket for the next fetch from the same host.  The Session also remembers
+# looked-up addresses for DNS_TTL secs.  Each fetch keeps how long it took to
+# connect and how long the request and response took.
+#
+# https:// URLs are fetched over the ESP32's TLS (TLS_MODE).  The ESP32 looks
+# the host up itself for those, it needs the name to check the certificate,
+# so there's no address to remember.
+
+import time
+
+# states
+CONNECT = 0
+SEND = 1
+HEADERS = 2
+BODY = 3
+DONE = 4
+FAILED = 5
+
+STATE_NAMES = ("connect", "send", "headers", "body", "done", "failed")
+
+STEP_BYTES = 512			# most bytes read in one step
+MAX_LINE = 128				# longest header line kept, the rest is dropped
+
+# secs allowed in each state, for the body it's secs without any data
+CONNECT_TIMEOUT = 5
+SEND_TIMEOUT = 5
+HEADERS_TIMEOUT = 10
+BODY_TIMEOUT = 10
+_TIMEOUTS = (CONNECT_TIMEOUT, SEND_TIMEOUT, HEADERS_TIMEOUT, BODY_TIMEOUT)
+_NS = 1_000_000_000
+
+DNS_TTL = 3_600			# secs a looked-up address is used for
+IDLE_TIMEOUT = 30		# secs a kept-alive socket waits for another fetch, servers give up after a minute or so
+DRAIN_MAX = 4_096		# most body bytes read past a done sink, to keep the connection
+
+_CR = 13
+_LF = 10
+
+def split_url(url):
+	# "http[s]://host[:port]/path" -> (host, port, path, tls)
+	if url.startswith("http://"):
+		rest, port, tls = url[7:], 80, False
+	elif url.startswith("https://"):
+		rest, port, tls = url[8:], 443, True
+	else:
+		raise ValueError("Only http:// and https:// URLs are supported")
+	slash = rest.find("/")
+	if slash < 0:
+		host, path = rest, "/"
+	else:
+		host, path = rest[:slash], rest[slash:]
+
+	colon = host.find(":")
+	if colon >= 0:
+		port = int(host[colon + 1:])
+		host = host[:colon]
+	return host, port, path, tls
+
+class HttpFetch:
+
+	def __init__(self, esp, url, sink, method="GET", body=None, headers=None, session=None):
+		self.esp = esp
+		self.sink = sink
+		self.session = session
+		self.status = 0				# HTTP status code, once we have it
+		self.length = None			# Content-Length, if the server sent one
+		self.keep_alive = False		# server will keep the connection open
+		self.received = 0			# body bytes so far
+		self.error = None
+		self.socket = None
+		self.reused = False			# on a socket kept from an earlier fetch
+		self.retried = False
+
+		self.host, self.port, path, self.tls = split_url(url)
+		request = method + " " + path + " HTTP/1.0\r\nHost: " + self.host + "\r\nUser-Agent: Dakota\r\n"
+		if session != None:
+			request = request + "Connection: keep-alive\r\n"
+		if headers != None:
+			for name in headers:
+				request = request + name + ": " + headers[name] + "\r\n"
+		if body != None:
+			request = request + "Content-Length: " + str(len(body)) + "\r\n"
+		request = request + "\r\n"
+
+		self.request = request.encode()
+		if body != None:
+			self.request = self.request + body
+
+		self.line = bytearray(MAX_LINE)
+		self.line_length = 0
+
+		self.started = time.monotonic_ns()
+		self.connected = None		# when the connection was ready to send on
+		self.ended = None			# when it finished or failed
+		self.state = None
+		self._open()
+
+	@property
+	def finished(self):
+		return self.state == DONE or self.state == FAILED
+
+	@property
+	def ok(self):
+		return self.state == DONE and self.status == 200
+
+	def elapsed(self):
+		end = self.ended
+		if end == None:
+			end = time.monotonic_ns()
+		return (end - self.started) / _NS
+
+	# secs to look up the host and connect, 0 on a reused connection
+	def connect_secs(self):
+		if self.connected == None:
+			return self.elapsed()
+		return (self.connected - self.started) / _NS
+
+	# secs from sending the request to the end of the response
+	def transfer_secs(self):
+		if self.connected == None:
+			return 0
+		end = self.ended
+		if end == None:
+			end = time.monotonic_ns()
+		return (end - self.connected) / _NS
+
+	# "connect 0.31 transfer 1.20 secs", with "reused" if it was
+	def timings(self):
+		text = "connect %.2f transfer %.2f secs" % (self.connect_secs(), self.transfer_secs())
+		if self.reused:
+			text = text + " reused"
+		return text
+
+	# do a bit more of the fetch, returns True once it's finished (or failed)
+	def step(self):
+		if self.finished:
+			return True
+
+		try:
+			state = self.state
+			if state == CONNECT:
+				if self.esp.socket_connected(self.socket):
+					self.connected = time.monotonic_ns()
+					self._enter(SEND)
+			elif state == SEND:
+				self.esp.socket_write(self.socket, self.request)
+				self._enter(HEADERS)
+			elif state == HEADERS or state == BODY:
+				self._read()
+		except Exception as e:
+			self._fail(STATE_NAMES[self.state] + " " + str(e))
+
+		if not self.finished and time.monotonic_ns() - self.entered > _TIMEOUTS[self.state] * _NS:
+			self._fail(STATE_NAMES[self.state] + " timed out")
+
+		return self.finished
+
+	# give up on the fetch, if it's still going
+	def close(self):
+		if not self.finished:
+			self.retried = True
+			self._fail("closed")
+		return;
+
+	def _open(self):
+		self._enter(CONNECT)
+		session = self.session
+		if session != None:
+			self.socket = session.take(self.host, self.port)
+			if self.socket != None:
+				self.reused = True
+				self.connected = self.started
+				self._enter(SEND)
+				return;
+
+		try:
+			if self.tls:
+				self.socket = self.esp.get_socket()
+				self.esp.socket_open(self.socket, self.host, self.port, self.esp.TLS_MODE)
+				return;
+			if session != None:
+				address = session.resolve(self.host)
+			else:
+				address = self.esp.get_host_by_name(self.host)
+			self.socket = self.esp.get_socket()
+			self.esp.socket_open(self.socket, address, self.port, self.esp.TCP_MODE)
+		except Exception as e:
+			self._fail("connect " + str(e))
+		return;
+
+	def _read(self):
+		esp = self.esp
+		available = esp.socket_available(self.socket)
+		if available == 0:
+			if not esp.socket_connected(self.socket):
+				# server has closed its end, that's the end of the body, unless it
+				#   said there was more and the sink is still waiting for it
+				if self.state != BODY:
+					self._fail("closed before headers")
+				elif self.length != None and self.received < self.length and (self.sink == None or not self.sink.done):
+					self._fail("closed %d bytes short" % (self.length - self.received))
+				else:
+					self._finish()
+			return;
+
+		chunk = esp.socket_read(self.socket, min(available, STEP_BYTES))
+		if len(chunk) == 0:
+			return;
+		self.entered = time.monotonic_ns()
+
+		if self.state == HEADERS:
+			start = self._headers(chunk)
+			if self.state != BODY or start >= len(chunk):
+				return;
+			chunk = chunk[start:]
+
+		self._body(chunk)
+		return;
+
+	# walk through header bytes, returns where the body starts in chunk
+	def _headers(self, chunk):
+		line = self.line
+		i = 0
+		for c in chunk:
+			i = i + 1
+			if c == _LF:
+				self._header_line(str(line[:self.line_length], "utf-8"))
+				self.line_length = 0
+				if self.state != HEADERS:
+					break
+			elif c != _CR and self.line_length < MAX_LINE:
+				line[self.line_length] = c
+				self.line_length = self.line_length + 1
+		return i
+
+	def _header_line(self, text):
+		if text == "":
+			self._enter(BODY)
+			if self.length == 0:
+				self._finish()
+		elif self.status == 0:
+			# status line, "HTTP/1.1 200 OK"
+			parts = text.split(" ")
+			self.status = int(parts[1])
+		else:
+			colon = text.find(":")
+			if colon > 0:
+				name = text[:colon].lower()
+				if name == "content-length":
+					self.length = int(text[colon + 1:].strip())
+				elif name == "connection":
+					self.keep_alive = text[colon + 1:].strip().lower() == "keep-alive"
+		return;
+
+	def _body(self, chunk):
+		self.received = self.received + len(chunk)
+		if self.sink != None and not self.sink.done:
+			self.sink.feed(chunk)
+			# the rest of the body is only worth reading to keep the connection
+			if self.sink.done and not self._keepable(DRAIN_MAX):
+				self._finish()
+				return;
+
+		if self.length != None and self.received >= self.length:
+			self._finish()
+		return;
+
+	# could the connection go back to the session once another few bytes are read
+	def _keepable(self, more=0):
+		return (self.session != None and self.keep_alive and self.length != None
+			and self.length - self.received <= more)
+
+	def _enter(self, state):
+		self.state = state
+		self.entered = time.monotonic_ns()
+		return;
+
+	def _finish(self):
+		if self._keepable() and self.state == BODY:
+			self.session.give(self.host, self.port, self.socket)
+			self.socket = None
+		self._close_socket()
+		self._end(DONE)
+		return;
+
+	def _fail(self, error):
+		self._close_socket()
+
+		# a kept-alive connection the server had already given up on, try a new one
+		if self.reused and not self.retried and self.status == 0:
+			self.retried = True
+			self.reused = False
+			self.connected = None
+			self.line_length = 0
+			self.started = time.monotonic_ns()
+			self._open()
+			return;
+
+		print("      Fetch from", self.host, "failed:", error)
+		if self.state == CONNECT and self.session != None:
+			self.session.forget(self.host)
+		self.error = error
+		self._end(FAILED)
+		return;
+
+	def _end(self, state):
+		self._enter(state)
+		self.ended = self.entered
+		self.request = None
+		if self.session != None:
+			self.session.record(self)
+		return;
+
+	def _close_socket(self):
+		if self.socket != None:
+			try:
+				self.esp.socket_close(self.socket)
+			except Exception:
+				pass
+			self.socket = None
+		return;
+
+class Session:
+	# looked-up addresses and kept-alive sockets, shared by the fetches made with it
+
+	def __init__(self, esp, dns_ttl=DNS_TTL, idle_timeout=IDLE_TIMEOUT):
+		self.esp = esp
+		self.dns_ttl = dns_ttl * _NS
+		self.idle_timeout = idle_timeout * _NS
+		self.addresses = {}			# host: (address, good until)
+		self.idle = {}				# (host, port): (socket, idle since)
+
+		self.fetches = 0
+		self.reused = 0
+		self.failed = 0
+		self.lookups = 0			# DNS lookups actually made
+		self.connect_ns = 0
+		self.transfer_ns = 0
+
+	def resolve(self, host):
+		now = time.monotonic_ns()
+		cached = self.addresses.get(host)
+		if cached != None and now < cached[1]:
+			return cached[0]
+
+		self.lookups = self.lookups + 1
+		address = self.esp.get_host_by_name(host)
+		self.addresses[host] = (address, now + self.dns_ttl)
+		return address
+
+	# the address didn't work, look it up again next time
+	def forget(self, host):
+		self.addresses.pop(host, None)
+		return;
+
+	# a kept-alive socket to host that's still open, or None
+	def take(self, host, port):
+		idle = self.idle.pop((host, port), None)
+		if idle == None:
+			return None
+
+		socket, since = idle
+		try:
+			if time.monotonic_ns() - since < self.idle_timeout and self.esp.socket_connected(socket):
+				return socket
+		except Exception:
+			pass
+		self._close(socket)
+		return None
+
+	def give(self, host, port, socket):
+		old = self.idle.pop((host, port), None)
+		if old != None:
+			self._close(old[0])
+		self.idle[(host, port)] = (socket, time.monotonic_ns())
+		return;
+
+	# close the sockets being kept, the ESP32 only has a few
+	def close(self):
+		for key in self.idle:
+			self._close(self.idle[key][0])
+		self.idle = {}
+		return;
+
+	def record(self, fetch):
+		self.fetches = self.fetches + 1
+		if fetch.state == FAILED:
+			self.failed = self.failed + 1
+			return;
+		if fetch.reused:
+			self.reused = self.reused + 1
+		self.connect_ns = self.connect_ns + fetch.connected - fetch.started
+		self.transfer_ns = self.transfer_ns + fetch.ended - fetch.connected
+		return;
+
+	def report(self):
+		done = self.fetches - self.failed
+		if done == 0:
+			print("  http: no fetches yet")
+			return;
+		print("  http: %d fetches, %d on kept-alive connections, %d failed, %d DNS lookups" % (
+			self.fetches, self.reused, self.failed, self.lookups))
+		print("        mean connect %.2f secs, mean transfer %.2f secs" % (
+			self.connect_ns / done / _NS, self.transfer_ns / done / _NS))
+		return;
+
+	def _close(self, socket):
+		try:
+			self.esp.socket_close(socket)
+		except Exception:
+			pass
+		return;
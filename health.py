@@ -0,0 +1,311 @@
+# Loop health and watchdog supervisor for Dakota
+#
+# run_forever only starts main_loop over when it throws.  A read that never
+# comes back (a socket inside a fetch, an ESP32 that's wedged) just stops the
+# loop, and the screen sits there showing whatever it had until somebody
+# pulls the plug.
+#
+# A Supervisor arms the hardware watchdog (microcontroller.watchdog) and feeds
+# it after each pass through the loop that finishes, so one that doesn't
+# finish within WATCHDOG_TIMEOUT trips it.  Finishing isn't all there is to it:
+# the loop says what's wrong with it, if anything, along with each pass (a
+# clock that's stopped moving, say), and it's only fed while nothing is.  A
+# loop that's had something wrong with it for a whole timeout is failed the
+# same as one that's stuck.  It's armed in RAISE mode rather
+# than RESET: the timeout is raised as a WatchDogTimeout wherever the loop is
+# stuck, which gives fail() the chance to write a breadcrumb to NVM (the stage
+# that stalled, how long it had been in it, the slowest stage since the last
+# feed, free heap) before it resets the board.  The next boot prints it.
+#
+#   - fail() switches the watchdog to RESET before it writes anything, so a
+#     hang in there still gets the board reset
+#   - a WatchDogTimeout caught by some except Exception on its way up leaves
+#     the watchdog stopped, and the next feed() notices and fails the same way
+#   - the watchdog is stopped while the loop naps (pause() and resume()), so a
+#     nap can run to the next minute, or through light sleep, and still not
+#     look like a stall.  A board that can't stop its watchdog naps for at
+#     most max_sleep, half the timeout, at a time instead
+#
+# Each stage (a scheduler task, and so each blocking call it makes) is timed
+# into a Histogram of log2 buckets of ms, as is each pass through the loop,
+# and the stats print them.  Recording one is a few integer ops.
+
+import gc
+import struct
+import time
+from array import array
+
+from records import checksum, pack_string, unpack_string
+
+try:
+	import microcontroller
+	Nvm = microcontroller.nvm
+except (ImportError, AttributeError):
+	microcontroller = None
+	Nvm = None
+
+# the watchdog isn't on every board (or every CircuitPython version)
+try:
+	from watchdog import WatchDogMode, WatchDogTimeout
+except ImportError:
+	WatchDogMode = None
+
+	class WatchDogTimeout(Exception):
+		pass
+
+BUCKETS = 16			# under 1ms, then 1ms, 2-3ms, 4-7ms ... up to 16s and over
+NVM_OFFSET = 256		# where the breadcrumb lives in NVM, clear of datacache's record
+
+_MS_NS = 1_000_000
+_NS = 1_000_000_000
+_MAGIC = b"HB"
+_VERSION = 1
+
+# magic, version, stage, ms in it, slowest stage since the last feed, its ms,
+#   ms since the last feed, free heap, passes, secs up
+_FORMAT = "<2sBx16sI16sIIIII"
+_SIZE = struct.calcsize(_FORMAT)
+RECORD_SIZE = _SIZE + 2		# plus checksum
+
+class Histogram:
+	__slots__ = ("counts", "total", "worst")
+
+	def __init__(self):
+		self.counts = array("L", [0] * BUCKETS)
+		self.total = 0
+		self.worst = 0			# ms
+
+	def add(self, ms):
+		bucket = 0
+		n = ms
+		while n > 0 and bucket < BUCKETS - 1:
+			n = n >> 1
+			bucket = bucket + 1
+		self.counts[bucket] = self.counts[bucket] + 1
+		self.total = self.total + 1
+		if ms > self.worst:
+			self.worst = ms
+		return;
+
+	# upper bound, in ms, of the bucket holding the fraction p of the samples
+	def percentile(self, p):
+		want = p * self.total
+		seen = 0
+		for bucket in range(BUCKETS):
+			seen = seen + self.counts[bucket]
+			if seen >= want and seen > 0:
+				return (1 << bucket) - 1 if bucket < BUCKETS - 1 else self.worst
+		return 0
+
+class Supervisor:
+
+	def __init__(self, timeout):
+		self.timeout = timeout
+		self.max_sleep = timeout / 2
+		self.watchdog = None
+		self.paused = False
+		self.stages = {}				# name: Histogram
+		self.loop = Histogram()			# each pass through the loop
+		self.stage = None				# the stage running now, None between them
+		self.stage_ns = 0
+		self.fed_ns = time.monotonic_ns()
+		self.healthy_ns = self.fed_ns	# the last pass with nothing wrong
+		self.slowest = None				# slowest stage since the last feed
+		self.slowest_ms = 0
+		self.passes = 0
+
+	# start the watchdog, on boards that have one
+	def start(self):
+		if microcontroller == None or WatchDogMode == None:
+			return;
+		try:
+			self.watchdog = microcontroller.watchdog
+			self._arm()
+		except Exception as e:
+			print("!!!! No watchdog:", e)
+			self.watchdog = None
+		return;
+
+	def begin(self, stage):
+		self.stage = stage
+		self.stage_ns = time.monotonic_ns()
+		return;
+
+	def end(self):
+		ms = (time.monotonic_ns() - self.stage_ns) // _MS_NS
+		histogram = self.stages.get(self.stage)
+		if histogram == None:
+			histogram = self.stages[self.stage] = Histogram()
+		histogram.add(ms)
+		if ms >= self.slowest_ms:
+			self.slowest = self.stage
+			self.slowest_ms = ms
+		self.stage = None
+		return;
+
+	# a pass through the loop that finished, took_ns long.  problem is what's
+	#   wrong with the loop all the same, None if nothing is
+	def passed(self, took_ns, problem=None):
+		self.passes = self.passes + 1
+		self.loop.add(took_ns // _MS_NS)
+		if problem == None:
+			self.feed()
+		elif time.monotonic_ns() - self.healthy_ns > self.timeout * _NS:
+			self.fail(problem, stalled=False)
+		return;
+
+	def feed(self):
+		watchdog = self.watchdog
+		if watchdog != None:
+			if watchdog.mode == None:
+				# it went off and the WatchDogTimeout was caught along the way
+				self.fail("watchdog")
+			else:
+				watchdog.feed()
+		self.fed_ns = time.monotonic_ns()
+		self.healthy_ns = self.fed_ns
+		self.slowest = None
+		self.slowest_ms = 0
+		return;
+
+	# stop the watchdog for a nap, returns the longest the nap can be, None if
+	#   there's no limit
+	def pause(self):
+		if self.watchdog == None:
+			return None
+		try:
+			self.watchdog.deinit()
+		except Exception:
+			return self.max_sleep
+		self.paused = True
+		return None
+
+	# start it again after a nap
+	def resume(self):
+		if not self.paused:
+			return;
+		self.paused = False
+		try:
+			self._arm()
+		except Exception as e:
+			print("!!!! Watchdog not restarted:", e)
+			self.watchdog = None
+		return;
+
+	# sleep secs without tripping the watchdog
+	def sleep(self, secs):
+		longest = self.pause()
+		while longest != None and secs > longest:
+			time.sleep(longest)
+			self.feed()
+			secs = secs - longest
+		time.sleep(secs)
+		self.resume()
+		return;
+
+	# leave a breadcrumb and reset the board, why stands in for the stage if
+	#   there's none to blame, or is what's to blame if the loop hasn't
+	#   stalled.  Where there's no reset it comes back, with the watchdog
+	#   running again, and the loop carries on
+	def fail(self, why, stalled=True):
+		if self.watchdog != None:
+			try:
+				self.watchdog.mode = WatchDogMode.RESET
+				self.watchdog.feed()
+			except Exception:
+				pass
+
+		# what's wrong if it isn't stuck, else the stage it's stuck in, or if it's
+		#   got out of it, the one that took too long
+		now = time.monotonic_ns()
+		if not stalled:
+			stage = why
+			stage_ms = (now - self.healthy_ns) // _MS_NS
+		elif self.stage != None:
+			stage = self.stage
+			stage_ms = (now - self.stage_ns) // _MS_NS
+		elif self.slowest != None:
+			stage = self.slowest
+			stage_ms = self.slowest_ms
+		else:
+			stage = why
+			stage_ms = 0
+		if stalled:
+			print("!!!! Stalled in", stage, "for", stage_ms, "ms, resetting")
+		else:
+			print("!!!! Loop unhealthy,", stage, "for", stage_ms, "ms, resetting")
+		self._save(stage, stage_ms, (now - self.fed_ns) // _MS_NS, now // _NS)
+		if microcontroller != None:
+			try:
+				microcontroller.reset()
+			except Exception as e:
+				print("!!!! No reset:", e)
+
+		self.stage = None
+		self.slowest = None
+		self.slowest_ms = 0
+		self.healthy_ns = now
+		if self.watchdog != None:
+			try:
+				self._arm()
+			except Exception as e:
+				print("!!!! Watchdog not restarted:", e)
+				self.watchdog = None
+		return;
+
+	def _arm(self):
+		self.watchdog.timeout = self.timeout
+		self.watchdog.mode = WatchDogMode.RAISE
+		self.watchdog.feed()
+		self.fed_ns = time.monotonic_ns()
+		return;
+
+	# print the breadcrumb from before the last reset, if there is one, and clear it
+	def recall(self):
+		if Nvm == None:
+			return None
+		try:
+			record = bytes(Nvm[NVM_OFFSET:NVM_OFFSET + RECORD_SIZE])
+			if record[:2] != _MAGIC or record[2] != _VERSION:
+				return None
+			if struct.unpack_from("<H", record, _SIZE)[0] != checksum(record[:_SIZE]):
+				return None
+			(magic, version, stage, stage_ms, slowest, slowest_ms, since_feed_ms,
+				mem_free, passes, uptime) = struct.unpack_from(_FORMAT, record)
+			Nvm[NVM_OFFSET:NVM_OFFSET + 2] = b"\0\0"
+		except Exception as e:
+			print("    > Breadcrumb not read:", e)
+			return None
+
+		stage = unpack_string(stage)
+		print("!!!! Last reset: stalled in %s for %d ms, slowest since the feed %s at %d ms, fed %d ms before, %d bytes free, %d passes, up %d secs" % (
+			stage, stage_ms, unpack_string(slowest) or "none", slowest_ms, since_feed_ms, mem_free, passes, uptime))
+		return stage
+
+	def report(self):
+		print("  health         runs     p50     p99   worst ms")
+		self._report_line("loop pass", self.loop)
+		for name, histogram in self.stages.items():
+			self._report_line(name, histogram)
+		return;
+
+	def _report_line(self, name, histogram):
+		if histogram.total == 0:
+			return;
+		print("  %-12s %6d %7d %7d %8d" % (name, histogram.total, histogram.percentile(0.5), histogram.percentile(0.99),
+			histogram.worst))
+		return;
+
+	def _save(self, stage, stage_ms, since_feed_ms, uptime):
+		if Nvm == None:
+			return;
+		try:
+			record = struct.pack(_FORMAT, _MAGIC, _VERSION,
+				pack_string(stage, 16), stage_ms,
+				pack_string(self.slowest or "", 16), self.slowest_ms,
+				since_feed_ms, gc.mem_free(), self.passes, uptime)
+			record = record + struct.pack("<H", checksum(record))
+			Nvm[NVM_OFFSET:NVM_OFFSET + RECORD_SIZE] = record
+		except Exception as e:
+			print("    > Breadcrumb not saved:", e)
+		return;
@@ -0,0 +1,143 @@
+# Sensor history for Dakota
+#
+# Each SCD-30 reading (CO2, temperature, humidity) keeps a day of samples in
+# a Series: a ring buffer in an array of 16 bit ints, allocated once at
+# startup, so memory use is fixed and known up front and the history never
+# grows or fragments the heap.  Readings that aren't whole numbers are kept as
+# fixed point, temperature in tenths of a degree for instance.
+#
+# The stats are kept up to date as each sample goes in, in constant time
+# rather than by walking the buffer:
+#   mean   a running sum of everything in the ring
+#   min    a queue of ring positions whose samples only increase (and the
+#   max      reverse for max), the front is the answer.  Samples that can
+#            never be the min again are dropped off the back as new ones
+#            arrive, and the front drops off when its sample is overwritten
+#   trend  running sums of the newest trend_samples and the trend_samples
+#            before those, the difference of their means
+
+from array import array
+
+class Series:
+
+	def __init__(self, capacity, scale=1, trend_samples=16):
+		if capacity < 2 * trend_samples:
+			raise ValueError("Series needs room for two trend windows")
+		self.capacity = capacity
+		self.scale = scale					# samples are value * scale
+		self.trend_samples = trend_samples
+
+		self.samples = array("h", [0] * capacity)
+		self.head = 0						# where the next sample goes
+		self.count = 0						# samples in the ring
+		self.added = 0						# samples ever added, clear() or not
+		self.total = 0						# sum of the samples in the ring
+
+		# monotonic queues of ring positions, each a ring of its own
+		self.min_queue = array("H", [0] * capacity)
+		self.min_start = 0
+		self.min_length = 0
+		self.max_queue = array("H", [0] * capacity)
+		self.max_start = 0
+		self.max_length = 0
+
+		self.recent = 0						# sum of the newest trend_samples
+		self.prior = 0						# sum of the trend_samples before those
+
+	# bytes held by the buffers, all allocated here in __init__
+	def nbytes(self):
+		return self.capacity * (self.samples.itemsize + self.min_queue.itemsize + self.max_queue.itemsize)
+
+	def add(self, value):
+		sample = round(value * self.scale)
+		if sample > 32767:
+			sample = 32767
+		elif sample < -32768:
+			sample = -32768
+
+		samples = self.samples
+		capacity = self.capacity
+		head = self.head
+
+		# the trend windows slide along by one
+		k = self.trend_samples
+		if self.count >= k:
+			leaving = samples[(head - k) % capacity]
+			self.recent = self.recent - leaving
+			self.prior = self.prior + leaving
+			if self.count >= 2 * k:
+				self.prior = self.prior - samples[(head - 2 * k) % capacity]
+		self.recent = self.recent + sample
+
+		# the oldest sample is about to be overwritten, if it's at the front of
+		#   a queue that's the only place it can be
+		if self.count == capacity:
+			self.total = self.total - samples[head]
+			if self.min_length > 0 and self.min_queue[self.min_start] == head:
+				self.min_start = (self.min_start + 1) % capacity
+				self.min_length = self.min_length - 1
+			if self.max_length > 0 and self.max_queue[self.max_start] == head:
+				self.max_start = (self.max_start + 1) % capacity
+				self.max_length = self.max_length - 1
+		else:
+			self.count = self.count + 1
+
+		samples[head] = sample
+		self.total = self.total + sample
+
+		# drop everything the new sample beats, then queue it
+		queue = self.min_queue
+		length = self.min_length
+		while length > 0 and samples[queue[(self.min_start + length - 1) % capacity]] >= sample:
+			length = length - 1
+		queue[(self.min_start + length) % capacity] = head
+		self.min_length = length + 1
+
+		queue = self.max_queue
+		length = self.max_length
+		while length > 0 and samples[queue[(self.max_start + length - 1) % capacity]] <= sample:
+			length = length - 1
+		queue[(self.max_start + length) % capacity] = head
+		self.max_length = length + 1
+
+		self.head = (head + 1) % capacity
+		self.added = self.added + 1
+		return;
+
+	# the stats are None until there's a sample (two trend windows for the trend)
+
+	def last(self):
+		if self.count == 0:
+			return None
+		return self.samples[(self.head - 1) % self.capacity] / self.scale
+
+	def min(self):
+		if self.count == 0:
+			return None
+		return self.samples[self.min_queue[self.min_start]] / self.scale
+
+	def max(self):
+		if self.count == 0:
+			return None
+		return self.samples[self.max_queue[self.max_start]] / self.scale
+
+	def mean(self):
+		if self.count == 0:
+			return None
+		return self.total / self.count / self.scale
+
+	# how much the newest trend_samples have moved from the ones before them, on average
+	def trend(self):
+		if self.count < 2 * self.trend_samples:
+			return None
+		return (self.recent - self.prior) / self.trend_samples / self.scale
+
+	def clear(self):
+		self.head = 0
+		self.count = 0
+		self.total = 0
+		self.min_length = 0
+		self.max_length = 0
+		self.recent = 0
+		self.prior = 0
+		return;
@@ -0,0 +1,105 @@
+# The weather payload a Dakota hub serves, shared by the hub and the devices
+#
+# A hub (tools/hub) calls OpenWeatherMap once for everyone at a location and
+# boils the two responses down to the values Dakota shows, already converted
+# (degrees F, mph, local sunrise and sunset, the alert in effect).  They go
+# out as one fixed-layout binary record, so a device reads a hundred-odd bytes
+# into a buffer instead of streaming several K of JSON through a parser.
+#
+# Numbers that are missing go as NO_NUMBER (or NaN) and come back as "--",
+# the same as the data cache (see records.py).
+
+import struct
+
+from records import checksum, pack_number, unpack_number, pack_float, unpack_float, pack_string, unpack_string
+
+_MAGIC = b"DH"
+_VERSION = 1
+
+# magic, version, current unix time, timezone offset, local sunrise, local sunset,
+#   temp F, humidity, pressure, wind mph, uv index, moon phase, wind direction,
+#   aq index, weather status, aqi status, conditions, weather alert
+_FORMAT = "<2sBxIiIIhhhhffbBhh24s40s"
+_SIZE = struct.calcsize(_FORMAT)
+SIZE = _SIZE + 2		# plus checksum
+
+# the fields that go into a payload, as the hub fills them in
+FIELDS = ("dt", "timezone_offset", "sunrise", "sunset", "temp", "humidity", "pressure",
+	"wind_speed", "uv_index", "moon_phase", "wind_dir", "aq_index", "weather_status",
+	"aqi_status", "conditions", "alert")
+
+def pack(values):
+	record = struct.pack(_FORMAT, _MAGIC, _VERSION,
+		int(values.get("dt", 0)),
+		int(values.get("timezone_offset", 0)),
+		int(values.get("sunrise", 0)),
+		int(values.get("sunset", 0)),
+		pack_number(values.get("temp")),
+		pack_number(values.get("humidity")),
+		pack_number(values.get("pressure")),
+		pack_number(values.get("wind_speed")),
+		pack_float(values.get("uv_index")),
+		pack_float(values.get("moon_phase")),
+		int(values.get("wind_dir", -1)),
+		int(values.get("aq_index", 0)),
+		int(values.get("weather_status", 0)),
+		int(values.get("aqi_status", 0)),
+		pack_string(values.get("conditions"), 24),
+		pack_string(values.get("alert", "NoAlert"), 40))
+	return record + struct.pack("<H", checksum(record))
+
+# put a payload into weather and air_quality (see state.py), now is the
+#   onboard clock (time.time()).  Returns False, and leaves them alone, if the
+#   payload isn't a good one.  A source the hub couldn't get only takes the
+#   status code, the last good values stay until the caller gives up on them
+def apply(payload, weather, air_quality, now):
+	if len(payload) < SIZE or payload[:2] != _MAGIC or payload[2] != _VERSION:
+		return False
+	if struct.unpack_from("<H", payload, _SIZE)[0] != checksum(memoryview(payload)[:_SIZE]):
+		return False
+
+	(magic, version, dt, tz_off, sunrise, sunset, temp, humidity, pressure, wind_speed,
+		uv_index, moon_phase, wind_dir, aq_index, weather_status, aqi_status,
+		conditions, alert) = struct.unpack_from(_FORMAT, payload)
+
+	weather.status_code = weather_status
+	if weather_status == 200:
+		weather.local_time_correction = dt + tz_off - now
+		weather.timezone_offset = tz_off
+		weather.temp = unpack_number(temp)
+		weather.humidity = unpack_number(humidity)
+		weather.pressure = unpack_number(pressure)
+		weather.wind_speed = unpack_number(wind_speed)
+		if weather.wind_speed == "--":
+			weather.wind_speed = 0
+		weather.uv_index = unpack_float(uv_index)
+		weather.moon_phase = unpack_float(moon_phase)
+		weather.wind_dir = wind_dir
+		weather.sunrise = sunrise
+		weather.sunset = sunset
+		weather.conditions = unpack_string(conditions)
+		weather.alert = unpack_string(alert)
+	weather.changed()
+
+	air_quality.status_code = aqi_status
+	if aqi_status == 200:
+		air_quality.aq_index = aq_index
+	air_quality.changed()
+	return True
+
+# collects a payload as it's downloaded, a sink for fetcher.HttpFetch
+class Receiver:
+
+	def __init__(self):
+		self.payload = bytearray(SIZE)
+		self.received = 0
+
+	@property
+	def done(self):
+		return self.received >= SIZE
+
+	def feed(self, chunk):
+		n = min(len(chunk), SIZE - self.received)
+		self.payload[self.received:self.received + n] = chunk[:n]
+		self.received = self.received + n
+		return;
@@ -0,0 +1,140 @@
+# Per-stage timing and heap instrumentation for Dakota
+#
+# Wraps the stages of the main loop (get_weather, draw_display, gc.collect and
+# so on) and keeps, for the last RING runs of each: how long it took, bytes
+# allocated, and free memory and the largest free block before and after.
+# Type "d" on the serial console to dump it all, "c" to clear it.
+#
+# Everything hangs off ENABLED.  It's a const, so with it off the compiler
+# drops the instrumentation code and wrap() hands back the function untouched:
+# production pays nothing.  Finding the largest free block means a gc.collect()
+# and a dozen trial allocations, so turn this on only while hunting down
+# MemoryErrors, and expect the timings to include some of that overhead.
+
+import gc
+import time
+
+try:
+	from micropython import const
+except ImportError:
+	def const(x):
+		return x
+
+ENABLED = const(0)		# set to 1 to turn instrumentation on
+
+RING = 16				# runs kept per stage
+LARGEST_STEP = 64		# bytes, how closely the largest free block is found
+
+STAGES = ("get_weather", "get_air_quality", "get_sensor_data", "set_now",
+	"flex_line", "draw_display", "gc.collect")
+
+# fields kept for each run, in one ring buffer apiece
+_FIELDS = ("us", "alloc", "free_before", "free_after", "largest_before", "largest_after")
+
+if ENABLED:
+	import supervisor
+	import sys
+	from array import array
+
+	_rings = [array("l", [0] * (len(STAGES) * RING)) for f in _FIELDS]
+	_next = array("H", [0] * len(STAGES))		# where each stage's next run goes
+	_runs = array("L", [0] * len(STAGES))		# runs so far for each stage
+
+# wrap func so each call is recorded under stage name, or just hand it back
+#   if instrumentation is off
+def wrap(name, func):
+	if not ENABLED:
+		return func
+	return _Timed(STAGES.index(name), func)
+
+# a wrapped func.  A class rather than a closure so it can carry func's
+#   __name__, which state.report and the like print (CircuitPython functions
+#   don't take new attributes)
+class _Timed:
+	__slots__ = ("stage", "func", "__name__")
+
+	def __init__(self, stage, func):
+		self.stage = stage
+		self.func = func
+		self.__name__ = getattr(func, "__name__", STAGES[stage])
+
+	def __call__(self, *args):
+		free_before = gc.mem_free()
+		largest_before = largest_free()
+		alloc_before = gc.mem_alloc()
+		start = time.monotonic_ns()
+		try:
+			return self.func(*args)
+		finally:
+			us = (time.monotonic_ns() - start) // 1000
+			# a collection during the stage makes this go negative
+			alloc = gc.mem_alloc() - alloc_before
+			_record(self.stage, (us, alloc, free_before, gc.mem_free(), largest_before, largest_free()))
+
+# the largest single allocation that would succeed right now, to within
+#   LARGEST_STEP bytes.  Collects garbage first so trial allocations can't pile up
+def largest_free():
+	gc.collect()
+	low = 0
+	high = gc.mem_free()
+	while high - low > LARGEST_STEP:
+		size = (low + high) // 2
+		try:
+			trial = bytearray(size)
+			del trial
+			gc.collect()
+			low = size
+		except MemoryError:
+			high = size
+	return low
+
+def _record(stage, values):
+	slot = stage * RING + _next[stage]
+	for i in range(len(_FIELDS)):
+		_rings[i][slot] = values[i]
+	_next[stage] = (_next[stage] + 1) % RING
+	_runs[stage] = _runs[stage] + 1
+	return;
+
+# look for a command on the serial console, call this once a pass through the loop
+def poll_serial():
+	if not ENABLED:
+		return;
+
+	while supervisor.runtime.serial_bytes_available:
+		command = sys.stdin.read(1)
+		if command == "d":
+			dump()
+		elif command == "c":
+			clear()
+	return;
+
+def clear():
+	if ENABLED:
+		for ring in _rings:
+			for i in range(len(ring)):
+				ring[i] = 0
+		for i in range(len(STAGES)):
+			_next[i] = 0
+			_runs[i] = 0
+	return;
+
+def dump():
+	if not ENABLED:
+		print("instrumentation is off, see instrument.ENABLED")
+		return;
+
+	print("########## instrumentation, oldest run first")
+	print("stage            runs        us     alloc  free before   free after  largest before  largest after")
+	for stage in range(len(STAGES)):
+		runs = _runs[stage]
+		kept = min(runs, RING)
+		for n in range(kept):
+			# oldest kept run first
+			i = (_next[stage] - kept + n) % RING
+			slot = stage * RING + i
+			print("%-15s %5d %9d %9d %12d %12d %15d %14d" % (STAGES[stage], runs - kept + n + 1,
+				_rings[0][slot], _rings[1][slot], _rings[2][slot], _rings[3][slot],
+				_rings[4][slot], _rings[5][slot]))
+	print("##########")
+	return;
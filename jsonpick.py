@@ -0,0 +1,281 @@
+# Streaming, key-selective JSON reader for Dakota
+#
+# The OpenWeatherMap responses are far bigger than the handful of values we
+# show, and building the whole document as a dict is where the heap runs out.
+# Instead, the response is fed in a chunk at a time and only the values at
+# the wanted paths are kept.  Containers nobody asked for are skipped by
+# counting brackets, so memory use depends on the paths, not on the payload.
+#
+# Paths are dotted: object keys by name, array positions by number and "*"
+# for any array position, e.g. "current.temp", "daily.0.moon_phase" or
+# "alerts.*.event".  Values under a "*" path come back as a list, in document
+# order.  Only scalars (strings, numbers, true, false, null) are picked.
+
+from textfmt import utf8_end
+
+CHUNK_SIZE = 256		# bytes read from the socket at a time
+MAX_TOKEN = 96			# longest string or number kept, longer ones are cut short
+MAX_MATCHES = 8			# most values kept for one "*" path
+
+# parser states
+_VALUE = 0			# expecting a value
+_KEY = 1			# expecting a key or the end of an object
+_COLON = 2			# expecting the colon after a key
+_NEXT = 3			# expecting a comma or the end of a container
+_STRING = 4			# inside a string value
+_KEY_STRING = 5		# inside a key
+_SCALAR = 6			# inside a number, true, false or null
+_SKIP = 7			# skipping over an unwanted object or array
+_DONE = 8			# top level value is finished
+
+# characters, as the ints we get when walking over bytes
+_QUOTE = 34
+_BACKSLASH = 92
+_COMMA = 44
+_COLON_CHAR = 58
+_OPEN_OBJECT = 123
+_CLOSE_OBJECT = 125
+_OPEN_ARRAY = 91
+_CLOSE_ARRAY = 93
+_WHITESPACE = b" \t\r\n"
+_ESCAPES = { 98: 8, 102: 12, 110: 10, 114: 13, 116: 9 }	# \b \f \n \r \t
+
+class JsonPicker:
+
+	def __init__(self, paths):
+		# each pattern is (path, parts, many) where parts are bytes keys,
+		#   int positions or None for "*"
+		self.patterns = []
+		for path in paths:
+			parts = []
+			for part in path.split("."):
+				if part == "*":
+					parts.append(None)
+				elif part.isdigit():
+					parts.append(int(part))
+				else:
+					parts.append(part.encode())
+			self.patterns.append((path, parts, None in parts))
+
+		self.buf = bytearray(MAX_TOKEN)
+		self.reset()
+
+	def reset(self):
+		self.found = {}
+		self.keys = []			# where we are: bytes for keys, int for positions
+		self.state = _VALUE
+		self.count = 0			# bytes used in buf
+		self.target = None		# pattern the value being read belongs to
+		self.escape = 0			# 1 after a backslash
+		self.hex_left = 0		# \u digits still to skip
+		self.skip_depth = 0
+		self.skip_string = False
+		return;
+
+	@property
+	def done(self):
+		return self.state == _DONE
+
+	def feed(self, chunk):
+		for c in chunk:
+			state = self.state
+
+			if state == _SKIP:
+				if self.skip_string:
+					if self.escape:
+						self.escape = 0
+					elif c == _BACKSLASH:
+						self.escape = 1
+					elif c == _QUOTE:
+						self.skip_string = False
+				elif c == _QUOTE:
+					self.skip_string = True
+				elif c == _OPEN_OBJECT or c == _OPEN_ARRAY:
+					self.skip_depth += 1
+				elif c == _CLOSE_OBJECT or c == _CLOSE_ARRAY:
+					self.skip_depth -= 1
+					if self.skip_depth == 0:
+						self._end_value()
+
+			elif state == _STRING or state == _KEY_STRING:
+				if self.hex_left:
+					# dropping the hex digits of a \u escape
+					self.hex_left -= 1
+				elif self.escape:
+					self.escape = 0
+					if c == 117:	# \uXXXX, our fonts are ASCII anyway
+						self.hex_left = 4
+						c = 63		# "?"
+					else:
+						c = _ESCAPES.get(c, c)
+					self._append(c)
+				elif c == _BACKSLASH:
+					self.escape = 1
+				elif c == _QUOTE:
+					if state == _KEY_STRING:
+						self.keys[-1] = bytes(self.buf[:self.count])
+						self.state = _COLON
+					else:
+						if self.target is not None:
+							# a string cut short at MAX_TOKEN may end partway through a character
+							self._keep(str(self.buf[:utf8_end(self.buf, self.count)], "utf-8"))
+						self._end_value()
+				else:
+					self._append(c)
+
+			elif state == _SCALAR:
+				if c in _WHITESPACE or c == _COMMA or c == _CLOSE_OBJECT or c == _CLOSE_ARRAY:
+					if self.target is not None:
+						self._keep(self._scalar())
+					self._end_value()
+					if self.state == _NEXT:
+						self._next(c)
+				else:
+					self._append(c)
+
+			elif c in _WHITESPACE:
+				pass
+
+			elif state == _VALUE:
+				self._value(c)
+
+			elif state == _NEXT:
+				self._next(c)
+
+			elif state == _KEY:
+				if c == _QUOTE:
+					self.count = 0
+					self.state = _KEY_STRING
+				elif c == _CLOSE_OBJECT:
+					self._close()
+				else:
+					raise ValueError("JSON key expected")
+
+			elif state == _COLON:
+				if c != _COLON_CHAR:
+					raise ValueError("JSON colon expected")
+				self.state = _VALUE
+
+			else:
+				# _DONE: anything after the top level value is ignored
+				break
+		return;
+
+	def _value(self, c):
+		if c == _CLOSE_ARRAY and self.keys and isinstance(self.keys[-1], int):
+			# empty array
+			self._close()
+			return;
+
+		want = self._match()
+		self.count = 0
+		if c == _OPEN_OBJECT or c == _OPEN_ARRAY:
+			if want == 1:
+				if c == _OPEN_OBJECT:
+					self.keys.append(b"")
+					self.state = _KEY
+				else:
+					self.keys.append(0)
+					self.state = _VALUE
+			else:
+				self.skip_depth = 1
+				self.skip_string = False
+				self.escape = 0
+				self.state = _SKIP
+		elif c == _QUOTE:
+			self.state = _STRING
+		else:
+			self._append(c)
+			self.state = _SCALAR
+		return;
+
+	def _next(self, c):
+		if c == _COMMA:
+			keys = self.keys
+			if isinstance(keys[-1], int):
+				keys[-1] += 1
+				self.state = _VALUE
+			else:
+				self.state = _KEY
+		elif c == _CLOSE_OBJECT or c == _CLOSE_ARRAY:
+			self._close()
+		elif c not in _WHITESPACE:
+			raise ValueError("JSON comma expected")
+		return;
+
+	def _close(self):
+		self.keys.pop()
+		self._end_value()
+		return;
+
+	def _end_value(self):
+		self.target = None
+		if self.keys:
+			self.state = _NEXT
+		else:
+			self.state = _DONE
+		return;
+
+	def _append(self, c):
+		# only values being kept and keys are worth the copy
+		if self.count < MAX_TOKEN and (self.target is not None or self.state == _KEY_STRING):
+			self.buf[self.count] = c
+			self.count += 1
+		return;
+
+	def _match(self):
+		# 2 if the current path is wanted, 1 if something below it is, else 0
+		keys = self.keys
+		depth = len(keys)
+		want = 0
+		for pattern in self.patterns:
+			parts = pattern[1]
+			if len(parts) < depth:
+				continue
+			for i in range(depth):
+				part = parts[i]
+				if part is None:
+					if not isinstance(keys[i], int):
+						break
+				elif part != keys[i]:
+					break
+			else:
+				if len(parts) == depth:
+					self.target = pattern
+					return 2
+				want = 1
+		return want
+
+	def _scalar(self):
+		text = str(self.buf[:self.count], "utf-8")
+		if text == "true":
+			return True
+		if text == "false":
+			return False
+		if text == "null":
+			return None
+		if "." in text or "e" in text or "E" in text:
+			return float(text)
+		return int(text)
+
+	def _keep(self, value):
+		path, parts, many = self.target
+		if not many:
+			self.found[path] = value
+		else:
+			values = self.found.get(path)
+			if values is None:
+				self.found[path] = [value]
+			elif len(values) < MAX_MATCHES:
+				values.append(value)
+		return;
+
+# read a response a chunk at a time, returning a dict of path: value for the
+#   paths that were found.  Missing paths are simply not in the dict
+def pick(response, paths, chunk_size=CHUNK_SIZE):
+	picker = JsonPicker(paths)
+	for chunk in response.iter_content(chunk_size=chunk_size):
+		picker.feed(chunk)
+		if picker.done:
+			break
+	return picker.found
@@ -0,0 +1,155 @@
+# Rendered label cache for Dakota
+#
+# The flex line goes round the same few messages (sunrise and sunset, the moon,
+# wind and pressure, the API status, alerts) and the conditions, AQI and UV
+# lines only ever show a handful of texts, but setting .text on a bitmap_label
+# rasterizes the whole bitmap again every time.  A LabelCache keeps the labels
+# it has rendered, keyed by (text, font, color), so a message that comes round
+# again is swapped into place instead of drawn again.
+#
+# Each cached line on the screen is a slot: a displayio.Group holding the one
+# label being shown.  A CachedView looks after a slot and has the same
+# update(text, color) as render.LabelView, so draw_display doesn't know the
+# difference.  The cache is held to a byte budget, estimated from each label's
+# bitmap plus the objects around it, and the label used longest ago goes first.
+# A label being shown is never evicted, and when two slots want the same text
+# at once the second gets a label of its own that isn't kept.
+
+# bytes for a label's Group, TileGrid and Palette, on top of its bitmap
+LABEL_OVERHEAD = 256
+
+class LabelCache:
+
+	def __init__(self, label_class, budget):
+		self.label_class = label_class		# bitmap_label.Label
+		self.budget = budget
+		self.used = 0
+		self.entries = {}					# (text, font, color): _Entry
+		self.tick = 0
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	# a CachedView of slot, an empty Group already in the page's group, showing text to begin with
+	def view(self, page, slot, font, anchor_point, anchored_position, text, color):
+		view = CachedView(self, page, slot, font, anchor_point, anchored_position, color)
+		view.update(text, color)
+		return view
+
+	# an entry showing text, rendered now if it isn't cached or is shown elsewhere
+	def take(self, text, font, color):
+		self.tick = self.tick + 1
+		key = (text, font, color)
+		entry = self.entries.get(key)
+		if entry != None and not entry.shown:
+			self.hits = self.hits + 1
+			entry.used = self.tick
+			entry.shown = True
+			return entry
+
+		self.misses = self.misses + 1
+		label = self.label_class(font, text=text, color=color)
+		entry = _Entry(key, label, label_bytes(label))
+		entry.used = self.tick
+		entry.shown = True
+		if key not in self.entries and entry.nbytes <= self.budget:
+			self._make_room(entry.nbytes)
+			self.entries[key] = entry
+			self.used = self.used + entry.nbytes
+			entry.kept = True
+		return entry
+
+	# an entry is no longer shown, it stays cached if it was kept
+	def give(self, entry):
+		entry.shown = False
+		return;
+
+	def clear(self):
+		for key in list(self.entries):
+			entry = self.entries[key]
+			if not entry.shown:
+				self._evict(key)
+		return;
+
+	def hit_rate(self):
+		total = self.hits + self.misses
+		if total == 0:
+			return 0.0
+		return self.hits / total
+
+	def report(self):
+		print("  labels: %d hits, %d misses (%.0f%% hit), %d cached in %d of %d bytes, %d evicted" % (
+			self.hits, self.misses, 100 * self.hit_rate(), len(self.entries), self.used, self.budget, self.evictions))
+		return;
+
+	def _make_room(self, nbytes):
+		while self.used + nbytes > self.budget:
+			oldest = None
+			for key, entry in self.entries.items():
+				if not entry.shown and (oldest == None or entry.used < self.entries[oldest].used):
+					oldest = key
+			if oldest == None:
+				return;
+			self._evict(oldest)
+			self.evictions = self.evictions + 1
+		return;
+
+	def _evict(self, key):
+		entry = self.entries.pop(key)
+		entry.kept = False
+		self.used = self.used - entry.nbytes
+		return;
+
+class _Entry:
+	__slots__ = ("key", "label", "nbytes", "used", "shown", "kept")
+
+	def __init__(self, key, label, nbytes):
+		self.key = key
+		self.label = label
+		self.nbytes = nbytes
+		self.used = 0
+		self.shown = False
+		self.kept = False
+
+# about what a label takes: a 1 bit bitmap in rows of 32 bit words, and the rest
+def label_bytes(label):
+	box = label.bounding_box
+	return (box[2] + 31) // 32 * 4 * box[3] + LABEL_OVERHEAD
+
+class CachedView:
+	__slots__ = ("cache", "page", "slot", "font", "anchor_point", "anchored_position", "entry", "text", "color")
+
+	def __init__(self, cache, page, slot, font, anchor_point, anchored_position, color):
+		self.cache = cache
+		self.page = page
+		self.slot = slot
+		self.font = font
+		self.anchor_point = anchor_point
+		self.anchored_position = anchored_position
+		self.entry = None
+		self.text = None
+		self.color = color
+
+	def update(self, text, color=None):
+		if color == None:
+			color = self.color
+		if text == self.text and color == self.color:
+			return;
+
+		entry = self.cache.take(text, self.font, color)
+		label = entry.label
+		label.anchor_point = self.anchor_point
+		label.anchored_position = self.anchored_position
+		if len(self.slot) > 0:
+			self.slot[0] = label
+		else:
+			self.slot.append(label)
+		if self.entry != None:
+			self.cache.give(self.entry)
+
+		self.entry = entry
+		self.text = text
+		self.color = color
+		self.page.dirty = True
+		return;
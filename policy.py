@@ -0,0 +1,95 @@
+# When to call an API again, for Dakota
+#
+# The wait before the next call is worked out after each call instead of
+# being fixed.  After a failure it starts short and doubles with every failure
+# in a row, with some jitter so a houseful of devices that lost the internet
+# together don't all call back at the same moment, and it's never longer than
+# the usual period.  After a success it's the usual period, the fast period
+# while something is going on (an alert, the weather changing) or the slow
+# period overnight.  Until the failures have gone on long enough that the
+# waits are back up to the usual period (gave_up()), what the last good call
+# got is worth keeping on the screen.
+#
+# All of that is held to a daily budget of calls.  While what's left of the
+# budget would last the rest of the day at the usual period the waits are as
+# above; once it wouldn't, the calls left are spread over the time left, so
+# a run of failures or a long alert can't use up the day's calls by noon.
+# A "day" is 24 hours of time.monotonic_ns() from its first call, not midnight.
+
+import random
+import time
+
+# modes, what the next call is for
+NORMAL = 0
+FAST = 1
+SLOW = 2
+
+BACKOFF_MIN = 15		# secs, wait after the first failure
+JITTER = 0.25			# failure waits are this fraction either way of the doubling
+DAY = 86_400			# secs
+
+_NS = 1_000_000_000
+
+class FetchPolicy:
+
+	# periods are secs between calls in each mode, budget is calls a day
+	def __init__(self, name, period, fast, slow, budget, backoff_min=BACKOFF_MIN):
+		self.name = name
+		self.periods = (period, fast, slow)
+		self.budget = budget
+		self.backoff_min = backoff_min
+		self.day_start = None
+		self.today = 0				# calls since day_start
+
+		self.calls = 0
+		self.failures = 0
+		self.failing = 0			# failures in a row
+		self.paced = 0				# times the budget made a wait longer
+
+	# count a call that just finished, returns secs until the next one
+	def next_delay(self, ok, mode=NORMAL):
+		now = time.monotonic_ns()
+		if self.day_start == None or now - self.day_start >= DAY * _NS:
+			self.day_start = now
+			self.today = 0
+		self.today = self.today + 1
+		self.calls = self.calls + 1
+
+		if ok:
+			self.failing = 0
+			wait = self.periods[mode]
+		else:
+			self.failures = self.failures + 1
+			self.failing = self.failing + 1
+			wait = self.backoff_min * (1 << min(self.failing - 1, 16))
+			wait = wait * (1 + JITTER * (2 * random.random() - 1))
+			if wait > self.periods[NORMAL]:
+				wait = self.periods[NORMAL]
+
+		# hold to the budget once it's running short
+		day_left = DAY - (now - self.day_start) / _NS
+		calls_left = self.budget - self.today
+		if calls_left <= 0:
+			wait = max(wait, day_left)
+			self.paced = self.paced + 1
+		elif calls_left * self.periods[NORMAL] < day_left and wait < day_left / calls_left:
+			wait = day_left / calls_left
+			self.paced = self.paced + 1
+		return wait
+
+	# failing for long enough that the waits are back up to the usual period,
+	#   so what the last good call got is too old to keep showing
+	def gave_up(self):
+		if self.failing == 0:
+			return False
+		return self.backoff_min * (1 << min(self.failing - 1, 16)) >= self.periods[NORMAL]
+
+	def budget_left(self):
+		if self.day_start == None or time.monotonic_ns() - self.day_start >= DAY * _NS:
+			return self.budget
+		return max(0, self.budget - self.today)
+
+	def report(self):
+		print("  %-12s %d calls, %d failed, %d of %d left today, %d waits stretched for the budget" % (
+			self.name, self.calls, self.failures, self.budget_left(), self.budget, self.paced))
+		return;
@@ -0,0 +1,54 @@
+# Fixed-layout binary record helpers for Dakota
+#
+# The data cache (datacache.py), the hub payload (hubpayload.py) and the
+# watchdog breadcrumb (health.py) are all struct-packed records with a
+# checksum on the end.  This is what they have in common: the checksum, and
+# turning the values Dakota shows into fields and back.  A number that's
+# missing ("--") goes as NO_NUMBER in a short int field, or NaN in a float
+# one, and comes back as "--".  A string goes in a fixed number of bytes, cut
+# at a character rather than in the middle of one.
+
+from textfmt import utf8_end
+
+NO_NUMBER = -32768		# stands in for "--" in the short int fields
+
+# 16-bit sum of the bytes, which catches a record that's half written or was never written
+def checksum(record):
+	total = 0
+	for b in record:
+		total = (total + b) & 0xFFFF
+	return total
+
+def pack_number(n):
+	try:
+		return int(n)
+	except Exception:
+		return NO_NUMBER
+
+def unpack_number(n):
+	if n == NO_NUMBER:
+		return "--"
+	return n
+
+def pack_float(f):
+	try:
+		return float(f)
+	except Exception:
+		return float("nan")
+
+def unpack_float(f):
+	if f != f:		# nan
+		return "--"
+	return f
+
+# at most size bytes, struct pads it out with zeros
+def pack_string(s, size):
+	if not isinstance(s, str):
+		s = "--"
+	b = s.encode()
+	if len(b) > size:
+		b = b[:utf8_end(b, size)]
+	return b
+
+def unpack_string(b):
+	return str(b.rstrip(b"\x00"), "utf-8")
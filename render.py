@@ -0,0 +1,201 @@
+# Change-tracked drawing for Dakota
+#
+# Setting .text on a bitmap_label re-rasterizes its whole bitmap, even when the
+# text is the same as before, and most passes through the loop change nothing
+# (or just the minute).  Each label gets a LabelView that remembers what it last
+# showed and only touches the label when the text or color is different.  The
+# display's auto refresh is turned off and the Screen pushes one refresh per
+# pass through the loop, and only when some label actually changed.
+#
+# Shapes work the same way: a ShapeView switches a vectorio.Polygon between a
+# few outlines made up ahead of time, and hides it by making its color
+# transparent, so nothing is built while the loop runs.  A ChartView draws a
+# day of sensor history into a bitmap, again only when there's a new column.
+#
+# The screen can have more than one page, each a Group built at startup with
+# views of its own.  The pages that aren't showing are kept up to date just the
+# same, they just don't cause a refresh, so switching to one is a single
+# refresh of what's already there.
+
+import bitmaptools
+
+class Screen:
+
+	def __init__(self, display, pages):
+		self.display = display
+		self.pages = pages
+		self.page = 0				# index of the page showing
+		self.refreshes = 0
+
+		display.auto_refresh = False
+		display.show(pages[0].group)
+		pages[0].dirty = True
+
+	def show_page(self, index):
+		if index != self.page:
+			self.page = index
+			self.display.show(self.pages[index].group)
+			self.pages[index].dirty = True
+		return;
+
+	def next_page(self):
+		self.show_page((self.page + 1) % len(self.pages))
+		return;
+
+	# push the changes on the page showing out to the display, returns True if there were any
+	def refresh(self):
+		page = self.pages[self.page]
+		if not page.dirty:
+			return False
+
+		self.display.refresh()
+		page.dirty = False
+		self.refreshes = self.refreshes + 1
+		return True
+
+class Page:
+	__slots__ = ("group", "dirty")
+
+	def __init__(self, group):
+		self.group = group
+		self.dirty = True
+
+	# wrap a label that's already in the group
+	def view(self, label, color):
+		return LabelView(self, label, color)
+
+	# wrap a polygon that's already in the group, outlines are lists of points
+	def shape(self, polygon, palette, outlines):
+		return ShapeView(self, polygon, palette, outlines)
+
+	# wrap a 2 color bitmap that's shown by a TileGrid in the group
+	def chart(self, bitmap, span):
+		return ChartView(self, bitmap, span)
+
+class LabelView:
+	__slots__ = ("page", "label", "text", "color")
+
+	def __init__(self, page, label, color):
+		self.page = page
+		self.label = label
+		self.text = label.text
+		self.color = color
+
+	def update(self, text, color=None):
+		if color != None and color != self.color:
+			self.label.color = color
+			self.color = color
+			self.page.dirty = True
+
+		if text != self.text:
+			self.label.text = text
+			self.text = text
+			self.page.dirty = True
+		return;
+
+class ShapeView:
+	__slots__ = ("page", "polygon", "palette", "outlines", "outline", "color")
+
+	def __init__(self, page, polygon, palette, outlines):
+		self.page = page
+		self.polygon = polygon
+		self.palette = palette
+		self.outlines = outlines
+		self.outline = None
+		self.color = None
+		palette.make_transparent(0)
+
+	# outline is an index into outlines, None hides the shape
+	def update(self, outline, color):
+		if outline == None:
+			if self.color != None:
+				self.palette.make_transparent(0)
+				self.color = None
+				self.page.dirty = True
+			return;
+
+		if outline != self.outline:
+			self.polygon.points = self.outlines[outline]
+			self.outline = outline
+			self.page.dirty = True
+
+		if color != self.color:
+			if self.color == None:
+				self.palette.make_opaque(0)
+			self.palette[0] = color
+			self.color = color
+			self.page.dirty = True
+		return;
+
+class ChartView:
+	__slots__ = ("page", "bitmap", "span", "per_column", "column")
+
+	# span is the least the chart's range is stretched to, in the series' units
+	def __init__(self, page, bitmap, span):
+		self.page = page
+		self.bitmap = bitmap
+		self.span = span
+		self.per_column = 1
+		self.column = -1		# the newest column when it was last drawn
+
+	# draw the whole of a history.Series, a column of min to max for every few
+	#   samples with the newest on the right, but only once there's a new column
+	def update(self, series):
+		bitmap = self.bitmap
+		width = bitmap.width
+		per_column = (series.capacity + width - 1) // width
+		column = (series.added - 1) // per_column
+		if column == self.column and per_column == self.per_column:
+			return;
+		self.column = column
+		self.per_column = per_column
+
+		bitmap.fill(0)
+		self.page.dirty = True
+		if series.count == 0:
+			return;
+
+		# the range is the whole day's, so columns line up with each other
+		low = series.min()
+		high = series.max()
+		if high - low < self.span:
+			middle = (high + low) / 2
+			low = middle - self.span / 2
+			high = middle + self.span / 2
+		rows = bitmap.height - 1
+		scale = rows / (high - low) / series.scale
+		low = low * series.scale
+
+		samples = series.samples
+		capacity = series.capacity
+		newest = series.added - 1
+		oldest = newest - series.count + 1
+		x = width - 1
+		while x >= 0 and column >= 0:
+			first = max(column * per_column, oldest)
+			last = min(column * per_column + per_column - 1, newest)
+			if first > last:
+				break
+
+			# absolute sample numbers to places in the ring
+			pos = (series.head - (newest - first) - 1) % capacity
+			lo = samples[pos]
+			hi = lo
+			n = last - first
+			while n > 0:
+				pos = pos + 1
+				if pos == capacity:
+					pos = 0
+				sample = samples[pos]
+				if sample < lo:
+					lo = sample
+				elif sample > hi:
+					hi = sample
+				n = n - 1
+
+			top = rows - int((hi - low) * scale)
+			bottom = rows - int((lo - low) * scale)
+			bitmaptools.fill_region(bitmap, x, top, x + 1, bottom + 1, 1)
+			x = x - 1
+			column = column - 1
+		return;
@@ -0,0 +1,137 @@
+# Deadline scheduler for Dakota
+#
+# Each job main_loop does (weather, air quality, sensor, clock, flex line,
+# drawing, backlight) is a task with its own period.  The loop runs whatever
+# is due and then sleeps until the next deadline, rather than waking on a
+# fixed heartbeat and checking counters.  Tasks run one after another, so a
+# task that takes a while only delays the ones due behind it.
+#
+# A task can decide when it next runs by returning a delay in seconds,
+# otherwise it's due again one period after it was last due.  A task with no
+# period only runs when another task wakes it.
+#
+# Deadlines are kept in time.monotonic_ns() so they don't lose precision as
+# the device stays up, the way float seconds from time.monotonic() do.
+
+import time
+
+_NS = 1_000_000_000
+_MS = 1_000_000
+
+class Task:
+	__slots__ = ("name", "func", "period", "due", "runs", "late_total", "late_max")
+
+	def __init__(self, name, func, period, due):
+		self.name = name
+		self.func = func
+		self.period = period		# ns, or None to run only when woken
+		self.due = due				# ns, or None when not scheduled
+		self.runs = 0
+		self.late_total = 0			# ms
+		self.late_max = 0			# ms
+
+class Scheduler:
+
+	# monitor, if there is one, has begin(name) called before each task runs and
+	#   end() after (see health.py)
+	def __init__(self, monitor=None):
+		self.tasks = []
+		self.monitor = monitor
+		self.wakeups = 0			# times run_due has been called
+
+	# delay is seconds until the first run
+	def add(self, name, period, func, delay=0):
+		now = time.monotonic_ns()
+		if period != None:
+			period = int(period * _NS)
+		if delay == None:
+			due = None
+		else:
+			due = now + int(delay * _NS)
+		task = Task(name, func, period, due)
+		self.tasks.append(task)
+		return task
+
+	def find(self, name):
+		for task in self.tasks:
+			if task.name == name:
+				return task
+		raise KeyError(name)
+
+	# run a task as soon as possible (or after delay secs), unless it's already due sooner
+	def wake(self, name, delay=0):
+		task = self.find(name)
+		due = time.monotonic_ns() + int(delay * _NS)
+		if task.due == None or due < task.due:
+			task.due = due
+		return;
+
+	# secs until a task is due, None if it isn't scheduled
+	def due_in(self, name):
+		task = self.find(name)
+		if task.due == None:
+			return None
+		return max(0, task.due - time.monotonic_ns()) / _NS
+
+	# run every task that's due, in the order they were added
+	def run_due(self):
+		self.wakeups = self.wakeups + 1
+		ran = 0
+		for task in self.tasks:
+			now = time.monotonic_ns()
+			if task.due == None or task.due > now:
+				continue
+
+			late = (now - task.due) // _MS
+			task.late_total = task.late_total + late
+			if late > task.late_max:
+				task.late_max = late
+			task.runs = task.runs + 1
+			ran = ran + 1
+
+			last_due = task.due
+			if self.monitor == None:
+				next_delay = task.func()
+			else:
+				self.monitor.begin(task.name)
+				try:
+					next_delay = task.func()
+				finally:
+					self.monitor.end()
+
+			now = time.monotonic_ns()
+			if next_delay != None:
+				task.due = now + int(next_delay * _NS)
+			elif task.period == None:
+				task.due = None
+			else:
+				# stay on the original cadence, unless we've fallen a whole period behind
+				task.due = last_due + task.period
+				if task.due <= now:
+					task.due = now + task.period
+		return ran
+
+	# seconds until the next task is due, 0 if something is due now
+	def delay(self):
+		soonest = None
+		for task in self.tasks:
+			if task.due != None and (soonest == None or task.due < soonest):
+				soonest = task.due
+
+		if soonest == None:
+			return None
+
+		wait = soonest - time.monotonic_ns()
+		if wait <= 0:
+			return 0
+		return wait / _NS
+
+	def report(self):
+		print("  wakeups:", self.wakeups)
+		print("  task           runs   avg late ms   max late ms")
+		for task in self.tasks:
+			avg = 0
+			if task.runs > 0:
+				avg = task.late_total // task.runs
+			print("  %-12s %6d %13d %13d" % (task.name, task.runs, avg, task.late_max))
+		return;
@@ -0,0 +1,146 @@
+# Append-only sensor log on the SD card for Dakota
+#
+# Every reading from the SCD-30 goes into a fixed-size binary record along with
+# the outside temperature, humidity and air quality.  The record is stamped
+# with local time: the onboard clock corrected by local_time_correction.
+# Records pile up in a RAM buffer one SD block in size and go out to the card
+# a whole block at a time, about every 25 minutes at the usual sensor rate,
+# so the loop only waits on the card now and then and the card sees whole
+# block writes rather than a rewrite of the same block every reading.  A power
+# cut loses whatever is still in the buffer.
+#
+# There's one file per local day, log/YYYYMMDD.bin, starting with a header
+# record.  tools/logcsv.py turns them into CSV.
+
+import os
+import struct
+import time
+
+MOUNT = "/sd"
+DIRECTORY = "log"
+BLOCK_SIZE = 512
+
+_MAGIC = b"DKLG"
+_VERSION = 1
+_NO_NUMBER = -32768		# stands in for "--" in the short int fields
+_NO_BYTE = 255			# and in the byte fields
+
+# local time, CO2 ppm, inside temp (tenths F), inside humidity (tenths %),
+#   outside temp (tenths F), outside humidity %, aq index
+RECORD_FORMAT = "<IHhHhBBxx"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+FIELDS = ("time", "co2", "inside_temp", "inside_humidity", "temp", "humidity", "aq_index")
+
+# magic, version, record size, when the file was started
+_HEADER_FORMAT = "<4sBBxxIxxxx"
+
+# mount the card at MOUNT, returns True if it's there
+def mount(spi, cs_pin):
+	try:
+		import adafruit_sdcard
+		import digitalio
+		import storage
+
+		cs = digitalio.DigitalInOut(cs_pin)
+		card = adafruit_sdcard.SDCard(spi, cs)
+		storage.mount(storage.VfsFat(card), MOUNT)
+		try:
+			os.mkdir(MOUNT + "/" + DIRECTORY)
+		except OSError:
+			pass		# already there
+	except Exception as e:
+		print("!!!! No SD card:", e)
+		return False
+	return True
+
+class Log:
+
+	def __init__(self, root=MOUNT):
+		self.directory = root + "/" + DIRECTORY
+		self.buffer = bytearray(BLOCK_SIZE)
+		self.used = 0				# bytes of buffer in use
+		self.path = None			# file the buffer belongs to
+		self.day = None				# (year, month, day) of that file
+		self.records = 0			# records logged since boot
+		self.flushes = 0
+		self.errors = 0
+
+	# log one reading, local_time is secs like time.time() but local
+	def add(self, local_time, co2, inside_temp, inside_humidity, temp, humidity, aq_index):
+		t = time.localtime(local_time)
+		day = (t.tm_year, t.tm_mon, t.tm_mday)
+		if day != self.day:
+			# a new day, what's buffered goes in yesterday's file
+			self.flush()
+			self.day = day
+			self.path = "%s/%04d%02d%02d.bin" % (self.directory, t.tm_year, t.tm_mon, t.tm_mday)
+			if self._size(self.path) == 0:
+				struct.pack_into(_HEADER_FORMAT, self.buffer, 0, _MAGIC, _VERSION, RECORD_SIZE, int(local_time))
+				self.used = RECORD_SIZE
+
+		struct.pack_into(RECORD_FORMAT, self.buffer, self.used, int(local_time),
+			_pack(co2, 1, 0, 65535, 65535),
+			_pack(inside_temp, 10, -32767, 32767, _NO_NUMBER),
+			_pack(inside_humidity, 10, 0, 65534, 65535),
+			_pack(temp, 10, -32767, 32767, _NO_NUMBER),
+			_pack(humidity, 1, 0, 254, _NO_BYTE),
+			_pack(aq_index, 1, 0, 254, _NO_BYTE))
+		self.used = self.used + RECORD_SIZE
+		self.records = self.records + 1
+
+		if self.used + RECORD_SIZE > BLOCK_SIZE:
+			self.flush()
+		return;
+
+	# append whatever is buffered to today's file
+	def flush(self):
+		if self.used == 0:
+			return;
+
+		try:
+			with open(self.path, "ab") as f:
+				f.write(memoryview(self.buffer)[:self.used])
+			self.flushes = self.flushes + 1
+		except OSError as e:
+			# card is gone or full, drop the buffer rather than let it grow
+			print("    > Sensor log not written:", e)
+			self.errors = self.errors + 1
+		self.used = 0
+		return;
+
+	def _size(self, path):
+		try:
+			return os.stat(path)[6]
+		except OSError:
+			return 0
+
+# fixed point for a record field, missing is used for "--" and anything out of range
+def _pack(value, scale, low, high, missing):
+	try:
+		n = round(value * scale)
+	except Exception:
+		return missing
+	if n < low or n > high:
+		return missing
+	return n
+
+# the rest is for reading logs back, on the host (see tools/logcsv.py)
+
+# yields a tuple of FIELDS for each record in a log file's bytes, with None for
+#   anything missing and tenths turned back into floats
+def read_records(data):
+	if len(data) < RECORD_SIZE:
+		return
+	magic, version, size, started = struct.unpack_from(_HEADER_FORMAT, data, 0)
+	if magic != _MAGIC or version != _VERSION or size != RECORD_SIZE:
+		raise ValueError("not a Dakota sensor log")
+
+	for offset in range(RECORD_SIZE, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+		when, co2, inside_temp, inside_humidity, temp, humidity, aq_index = struct.unpack_from(RECORD_FORMAT, data, offset)
+		yield (when,
+			None if co2 == 65535 else co2,
+			None if inside_temp == _NO_NUMBER else inside_temp / 10,
+			None if inside_humidity == 65535 else inside_humidity / 10,
+			None if temp == _NO_NUMBER else temp / 10,
+			None if humidity == _NO_BYTE else humidity,
+			None if aq_index == _NO_BYTE or aq_index == 0 else aq_index)
@@ -0,0 +1,144 @@
+# Digit sprites for Dakota's big readouts
+#
+# The clock and the temperature are in the 72pt font, and as bitmap_labels
+# every new minute rasterized the whole "12:34" again.  A SpriteSheet draws
+# the few characters they use (digits, colon, minus) just once, at startup,
+# into one bitmap, and each readout is a TileGrid over it: showing a new
+# minute is a few tile indexes changing, with nothing rasterized or allocated.
+# The color is the one non-transparent entry of the grid's palette, so a new
+# color is a palette write.
+#
+# A TileGrid's tiles are all the same width, but the font's colon is about
+# half as wide as a digit, so the tiles are narrow (half a digit, say) and a
+# character takes up as many of them as fits its width: two for a digit, one
+# for the colon.  Tile 0 is blank, for the space around a shorter text.
+
+import bitmaptools
+import displayio
+
+class SpriteSheet:
+
+	def __init__(self, font, chars, tile_width):
+		self.tile_width = tile_width
+		self.first = bytearray(128)			# first tile of each char, 0 if it isn't on the sheet
+		self.count = bytearray(128)			# how many tiles it takes
+
+		# lay out the tiles, tile 0 is blank
+		glyphs = []
+		tiles = 1
+		ascent = 0
+		descent = 0
+		for c in chars:
+			code = ord(c)
+			glyph = font.get_glyph(code)
+			if glyph == None or code >= 128:
+				continue
+			n = max(1, (glyph.shift_x + tile_width // 2) // tile_width)
+			self.first[code] = tiles
+			self.count[code] = n
+			glyphs.append((tiles, n, glyph))
+			tiles = tiles + n
+			ascent = max(ascent, glyph.dy + glyph.height)
+			descent = max(descent, -glyph.dy)
+
+		self.baseline = ascent					# rows above the baseline
+		self.tile_height = ascent + descent
+		self.tiles = tiles
+		self.bitmap = displayio.Bitmap(tiles * tile_width, self.tile_height, 2)
+
+		# draw each glyph once, centered in its tiles, clipped to them
+		for first, n, glyph in glyphs:
+			left = first * tile_width
+			right = left + n * tile_width
+			x = left + (n * tile_width - glyph.shift_x) // 2 + glyph.dx
+			y = ascent - glyph.dy - glyph.height
+			x1 = max(0, left - x)
+			x2 = min(glyph.width, right - x)
+			if x2 > x1 and glyph.height > 0:
+				bitmaptools.blit(self.bitmap, glyph.bitmap, x + x1, y, x1=x1, y1=0, x2=x2, y2=glyph.height)
+
+	# tiles text takes up
+	def width(self, text):
+		n = 0
+		for c in text:
+			code = ord(c)
+			if code < 128 and self.count[code] > 0:
+				n = n + self.count[code]
+			else:
+				n = n + 1
+		return n
+
+	# a TileGrid wide enough for widest, placed like a label: anchor_point is
+	#   a fraction of its size, and y is measured to the baseline
+	def grid(self, widest, anchor_point, anchored_position):
+		palette = displayio.Palette(2)
+		palette.make_transparent(0)
+		palette[1] = 0xFFFFFF
+		width = self.width(widest)
+		return displayio.TileGrid(self.bitmap, pixel_shader=palette, width=width, height=1,
+			tile_width=self.tile_width, tile_height=self.tile_height, default_tile=0,
+			x=anchored_position[0] - int(anchor_point[0] * width * self.tile_width),
+			y=anchored_position[1] - int(anchor_point[1] * self.baseline))
+
+	# wrap a grid that's already in the page's group, right_align for one anchored at its right
+	def view(self, page, grid, right_align, text, color):
+		view = SpriteView(page, self, grid, right_align)
+		view.update(text, color)
+		return view
+
+class SpriteView:
+	__slots__ = ("page", "sheet", "grid", "palette", "right_align", "text", "color")
+
+	def __init__(self, page, sheet, grid, right_align):
+		self.page = page
+		self.sheet = sheet
+		self.grid = grid
+		self.palette = grid.pixel_shader
+		self.right_align = right_align
+		self.text = None
+		self.color = None
+
+	# same as render.LabelView.update, characters not on the sheet show blank
+	def update(self, text, color=None):
+		if color != None and color != self.color:
+			self.palette[1] = color
+			self.color = color
+			self.page.dirty = True
+
+		if text == self.text:
+			return;
+
+		sheet = self.sheet
+		grid = self.grid
+		size = grid.width
+		i = 0
+		if self.right_align:
+			i = size - sheet.width(text)
+			j = 0
+			while j < i:
+				grid[j] = 0
+				j = j + 1
+
+		for c in text:
+			code = ord(c)
+			if code < 128 and sheet.count[code] > 0:
+				tile = sheet.first[code]
+				n = sheet.count[code]
+			else:
+				tile = 0
+				n = 1
+			while n > 0:
+				if i >= 0 and i < size:
+					grid[i] = tile
+				if tile != 0:
+					tile = tile + 1
+				i = i + 1
+				n = n - 1
+
+		while i < size:
+			grid[i] = 0
+			i = i + 1
+
+		self.text = text
+		self.page.dirty = True
+		return;
@@ -0,0 +1,170 @@
+# State for Dakota, kept apart from what's on the screen
+#
+# Raw values live in a few small groups (weather, the forecast, air quality, the inside
+# sensor, the clock, status), each a __slots__ class with a revision counter
+# that goes up whenever something in the group changes.  Whoever updates a
+# group calls changed() once they're done with it.
+#
+# Anything worked out from those values (a label's text and color, the flex
+# line, the warning light) is a Derived: a function plus the groups it reads.
+# Asking a Derived for its value only calls the function again if one of its
+# inputs has a new revision since last time, so a pass through the loop where
+# nothing has changed costs a comparison or two per value.  A Derived has a
+# revision of its own, so one Derived can be the input of another.  A value
+# that's changed in place (a textfmt.Line) is the same object every time, so
+# its own count of changes is compared as well.
+
+class Source:
+	__slots__ = ("rev",)
+
+	def __init__(self):
+		self.rev = 0
+
+	def changed(self):
+		self.rev = self.rev + 1
+		return;
+
+	def revision(self):
+		return self.rev
+
+class Weather(Source):
+	__slots__ = ("temp", "humidity", "pressure", "uv_index", "conditions", "wind_dir", "wind_speed",
+		"sunrise", "sunset", "moon_phase", "alert", "local_time_correction", "timezone_offset", "status_code")
+
+	def __init__(self):
+		super().__init__()
+		self.clear()
+
+	def clear(self):
+		self.temp = "--"
+		self.humidity = "--"
+		self.pressure = "--"
+		self.uv_index = "--"
+		self.conditions = "--"
+		self.wind_dir = -1				# compass point, index into code.py's WIND_DIRS
+		self.wind_speed = 0
+		self.sunrise = 0
+		self.sunset = 0
+		self.moon_phase = "--"
+		self.alert = "NoAlert"
+		self.local_time_correction = 0
+		self.timezone_offset = 0		# secs, local time less UTC
+		self.status_code = 0
+		return;
+
+FORECAST_DAYS = 7
+
+class Forecast(Source):
+	# the days after today from the weather API's daily list, kept until a
+	#   newer forecast comes in
+	__slots__ = ("days", "day_of_week", "low", "high", "summary")
+
+	def __init__(self):
+		super().__init__()
+		self.days = 0								# how many days are filled in
+		self.day_of_week = bytearray(FORECAST_DAYS)	# 0 is Monday
+		self.low = [0] * FORECAST_DAYS				# degrees F
+		self.high = [0] * FORECAST_DAYS
+		self.summary = ["--"] * FORECAST_DAYS		# one word, "Clouds", "Rain"
+
+class AirQuality(Source):
+	__slots__ = ("aq_index", "status_code")
+
+	def __init__(self):
+		super().__init__()
+		self.clear()
+
+	def clear(self):
+		self.aq_index = 0
+		self.status_code = 0
+		return;
+
+class Inside(Source):
+	__slots__ = ("co2", "temp", "humidity", "co2_trend")
+
+	def __init__(self):
+		super().__init__()
+		self.co2 = 0
+		self.temp = 0
+		self.humidity = 0
+		self.co2_trend = None		# None until there's enough history
+
+class Clock(Source):
+	# local date and time, as of the last minute the clock task saw
+	__slots__ = ("year", "month", "day_of_month", "day_of_week", "hour", "minute", "local_time")
+
+	def __init__(self):
+		super().__init__()
+		self.year = 0
+		self.month = 0				# 1 to 12, 0 until it's known
+		self.day_of_month = 0
+		self.day_of_week = -1		# 0 is Monday
+		self.hour = -1
+		self.minute = -1
+		self.local_time = 0			# secs, like time.time() but local
+
+class Status(Source):
+	__slots__ = ("connected", "ambient")
+
+	def __init__(self):
+		super().__init__()
+		self.connected = False
+		self.ambient = None			# light sensor, None until it's been read
+
+class State:
+	__slots__ = ("weather", "forecast", "air_quality", "inside", "clock", "status")
+
+	def __init__(self):
+		self.weather = Weather()
+		self.forecast = Forecast()
+		self.air_quality = AirQuality()
+		self.inside = Inside()
+		self.clock = Clock()
+		self.status = Status()
+
+class Derived:
+	__slots__ = ("func", "inputs", "seen", "value", "changes", "rev", "gets", "computes")
+
+	# func is called with the inputs (Sources or other Deriveds) as its arguments
+	def __init__(self, func, *inputs):
+		self.func = func
+		self.inputs = inputs
+		self.seen = [-1] * len(inputs)		# input revisions the value was worked out from
+		self.value = None
+		self.changes = None					# the value's count of changes, if it keeps one
+		self.rev = 0
+		self.gets = 0
+		self.computes = 0
+
+	def get(self):
+		self.gets = self.gets + 1
+		stale = False
+		seen = self.seen
+		i = len(seen)
+		while i > 0:
+			i = i - 1
+			rev = self.inputs[i].revision()
+			if rev != seen[i]:
+				seen[i] = rev
+				stale = True
+
+		if stale:
+			self.computes = self.computes + 1
+			value = self.func(*self.inputs)
+			changes = getattr(value, "changes", None)
+			if value != self.value or changes != self.changes:
+				self.value = value
+				self.changes = changes
+				self.rev = self.rev + 1
+		return self.value
+
+	def revision(self):
+		self.get()
+		return self.rev
+
+# how often each Derived was asked for and how often it had to be worked out
+def report(deriveds):
+	print("  derived              gets  computes")
+	for d in deriveds:
+		print("  %-18s %6d %9d" % (d.func.__name__, d.gets, d.computes))
+	return;
@@ -0,0 +1,232 @@
+# Adafruit IO telemetry for Dakota
+#
+# The inside readings (CO2, temp, humidity) and how the device is getting on
+# (loop time, free memory, RSSI, API status codes) go to Adafruit IO feeds.
+# Points wait in a small fixed-size queue for each feed and go up a feed at a
+# time through the batch data endpoint, one request for however many points
+# have piled up rather than one request per value.  A feed goes once it has a
+# full batch or its oldest point has waited HOLD secs.  While WiFi is down
+# points keep piling up; once a feed's queue is full, the oldest point makes room for
+# the newest.
+#
+# Adafruit IO counts every point (not every request) against a per-minute
+# limit, so the uploader keeps a token bucket and sends no more than rate
+# points a minute, after a burst of at most one batch.  If Adafruit IO says we're over anyway (429) it backs off.
+#
+# lib/adafruit_io does the same over adafruit_requests, which holds up the
+# device until the server answers.  This goes through fetcher.HttpFetch, the
+# same as the weather.
+
+import time
+from array import array
+
+import fetcher
+
+AIO_URL = "https://io.adafruit.com"		# the key goes in a header, so not in the clear
+
+QUEUE_SIZE = 48			# points kept for each feed, about 4 hours at one every 5 mins
+BATCH_SIZE = 15			# most points sent in one request, and the most saved up to send at once
+RATE = 15				# points a minute, so a burst and a minute's worth stay within the free plan's 30
+HOLD = 1_800			# secs a point waits for others to go with it
+STEP_WAIT = 0.05		# secs between steps of a request in progress
+RETRY_WAIT = 60			# secs after a request fails
+THROTTLE_WAIT = 120		# secs after Adafruit IO says we're over the limit
+IDLE_WAIT = 300			# secs to wait when there's nothing to send
+MIN_WAIT = 1			# secs, shortest wait for the rate limit (fractions of a point round badly)
+
+_NS = 1_000_000_000
+
+class Feed:
+	__slots__ = ("key", "values", "stamps", "head", "count", "first", "dropped", "since")
+
+	def __init__(self, key, size):
+		self.key = key
+		self.values = array("f", bytes(4 * size))
+		self.stamps = array("I", bytes(4 * size))	# unix time (UTC) of each point, 0 if not known
+		self.head = 0				# where the next point goes
+		self.count = 0
+		self.first = 0				# sequence number of the oldest point
+		self.dropped = 0			# points pushed out by newer ones before they were sent
+		self.since = 0				# time.monotonic_ns() the oldest point has been waiting since
+
+	def add(self, value, stamp):
+		size = len(self.values)
+		if self.count == 0:
+			self.since = time.monotonic_ns()
+		if self.count == size:
+			self.first = self.first + 1
+			self.dropped = self.dropped + 1
+		else:
+			self.count = self.count + 1
+		self.values[self.head] = value
+		self.stamps[self.head] = stamp
+		self.head = (self.head + 1) % size
+		return;
+
+	# slot of the i'th oldest point
+	def slot(self, i):
+		size = len(self.values)
+		return (self.head - self.count + i + size) % size
+
+	# forget the points up to sequence number end, the ones that were sent
+	#   (some of them may have been pushed out already)
+	def remove(self, end):
+		n = end - self.first
+		if n > self.count:
+			n = self.count
+		if n > 0:
+			self.count = self.count - n
+			self.first = self.first + n
+			self.since = time.monotonic_ns()
+		return;
+
+class Uploader:
+
+	def __init__(self, username, key, feeds, url=AIO_URL, queue_size=QUEUE_SIZE, rate=RATE, hold=HOLD, session=None):
+		self.url = url + "/api/v2/" + username + "/feeds/"
+		self.headers = {"X-AIO-Key": key, "Content-Type": "application/json"}
+		self.feeds = tuple(Feed(k, queue_size) for k in feeds)
+		self.session = session		# a fetcher.Session, so feeds sent one after another share a connection
+		self.rate = rate
+		self.hold = hold * _NS
+		self.tokens = float(BATCH_SIZE)		# points we're allowed to send right now
+		self.filled = time.monotonic_ns()
+		self.wait_until = 0
+		self.fetch = None
+		self.sending = None			# feed being sent
+		self.sending_end = 0		# sequence number after the last point being sent
+		self.sending_count = 0
+
+		self.sent = 0				# points
+		self.requests = 0
+		self.failures = 0
+		self.throttled = 0
+
+	# queue a point for feed number index, stamp is unix time (UTC) or 0 if not known
+	def add(self, index, value, stamp):
+		self.feeds[index].add(value, stamp)
+		return;
+
+	def pending(self):
+		total = 0
+		for feed in self.feeds:
+			total = total + feed.count
+		return total
+
+	@property
+	def busy(self):
+		return self.fetch != None
+
+	# move things along, returns secs until it's worth calling again
+	def step(self, esp):
+		if self.fetch != None:
+			if not self.fetch.step():
+				return STEP_WAIT
+			return self._finished()
+
+		now = time.monotonic_ns()
+		if now < self.wait_until:
+			return (self.wait_until - now) / _NS
+
+		# of the feeds that are ready to go, the one that's waited longest goes first
+		feed = None
+		soonest = now + IDLE_WAIT * _NS
+		for f in self.feeds:
+			if f.count == 0:
+				continue
+			ready = f.since + self.hold
+			if f.count >= BATCH_SIZE:
+				ready = now
+			if ready <= now:
+				if feed == None or f.since < feed.since:
+					feed = f
+			elif ready < soonest:
+				soonest = ready
+		if feed == None:
+			return max((soonest - now) / _NS, MIN_WAIT)
+
+		# wait until there's room in the rate limit for the whole batch
+		self._fill(now)
+		n = min(feed.count, BATCH_SIZE)
+		if self.tokens < n:
+			return max((n - self.tokens) * 60 / self.rate, MIN_WAIT)
+		self.tokens = self.tokens - n
+
+		print("***** Sending", n, "points to", feed.key)
+		self.sending = feed
+		self.sending_end = feed.first + n
+		self.sending_count = n
+		self.requests = self.requests + 1
+		self.fetch = fetcher.HttpFetch(esp, self.url + feed.key + "/data/batch", None,
+			"POST", batch_body(feed, n), self.headers, self.session)
+		return STEP_WAIT
+
+	# give up on a request in progress
+	def close(self):
+		if self.fetch != None:
+			self.fetch.close()
+			self.fetch = None
+			self.sending = None
+		return;
+
+	def report(self):
+		dropped = 0
+		for feed in self.feeds:
+			dropped = dropped + feed.dropped
+		print("  telemetry:", self.sent, "points sent in", self.requests, "requests,", self.pending(), "waiting,",
+			dropped, "dropped,", self.failures, "failed,", self.throttled, "throttled")
+		return;
+
+	def _finished(self):
+		fetch = self.fetch
+		feed = self.sending
+		self.fetch = None
+		self.sending = None
+
+		if fetch.ok:
+			self.sent = self.sent + self.sending_count
+			feed.remove(self.sending_end)
+			return 0
+
+		# the points stay queued for next time
+		self.failures = self.failures + 1
+		wait = RETRY_WAIT
+		if fetch.status == 429:
+			self.throttled = self.throttled + 1
+			wait = THROTTLE_WAIT
+		print("      Telemetry to", feed.key, "failed, status", fetch.status)
+		self.wait_until = time.monotonic_ns() + wait * _NS
+		return wait
+
+	def _fill(self, now):
+		self.tokens = self.tokens + (now - self.filled) * self.rate / (60 * _NS)
+		if self.tokens > BATCH_SIZE:
+			self.tokens = float(BATCH_SIZE)
+		self.filled = now
+		return;
+
+# the JSON for the batch data endpoint, the n oldest points of feed:
+#   {"data":[{"value":"812","created_at":"2022-08-22T17:00:00Z"},...]}
+def batch_body(feed, n):
+	parts = [b'{"data":[']
+	i = 0
+	while i < n:
+		slot = feed.slot(i)
+		if i > 0:
+			parts.append(b",")
+		parts.append(b'{"value":"')
+		parts.append(format_value(feed.values[slot]).encode())
+		stamp = feed.stamps[slot]
+		if stamp > 0:
+			t = time.localtime(stamp)
+			parts.append(('","created_at":"%04d-%02d-%02dT%02d:%02d:%02dZ' % (
+				t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec)).encode())
+		parts.append(b'"}')
+		i = i + 1
+	parts.append(b"]}")
+	return b"".join(parts)
+
+def format_value(value):
+	if value == int(value):
+		return str(int(value))
+	return "%.2f" % value
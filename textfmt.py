@@ -0,0 +1,157 @@
+# Allocation-free text for Dakota's display lines
+#
+# Building "Inside:   71   45%   812ppm" with + and str() makes a handful of
+# short-lived strings every time, and the heap fragments.  A Line is written
+# into a bytearray allocated once, from bytes constants and ints turned into
+# digits in place.  When the line is finished it's compared with what it
+# said last time, and only a line that reads differently becomes a new str
+# (a label needs a str).  So a line whose values haven't changed costs no
+# allocations at all.
+#
+# A Line also carries the color it's shown in.  The functions that fill one
+# in hand back the same Line every time, changed in place, so it counts how
+# many times what it says (or its color) has changed, and a Derived holding
+# it can tell (see state.py).  Fixed is for things that only ever show one of
+# a few values made up ahead of time.
+#
+# Also here are lookup tables that turn readings into classes, in place of
+# if/elif chains.
+
+# where to cut the first length bytes of buf so a multi-byte UTF-8 character
+#   cut off at the end is left out whole, rather than half of it failing to decode
+def utf8_end(buf, length):
+	start = length
+	while start > 0 and buf[start - 1] & 0xC0 == 0x80:		# continuation bytes, 10xxxxxx
+		start = start - 1
+	if start == 0:
+		return length
+	lead = buf[start - 1]
+	if lead & 0xE0 == 0xC0:
+		need = 2
+	elif lead & 0xF0 == 0xE0:
+		need = 3
+	elif lead & 0xF8 == 0xF0:
+		need = 4
+	else:
+		return length				# ASCII, nothing cut
+	if length - (start - 1) < need:
+		return start - 1
+	return length
+
+class Line:
+	__slots__ = ("buffer", "length", "last", "last_length", "text", "color", "last_color", "changes")
+
+	def __init__(self, size, color=None):
+		self.buffer = bytearray(size)
+		self.length = 0
+		self.last = bytearray(size)			# what text says
+		self.last_length = -1
+		self.text = ""
+		self.color = color
+		self.last_color = color
+		self.changes = 0					# times the text or color has changed
+
+	def start(self, color=None):
+		self.length = 0
+		self.color = color
+		return self
+
+	# bytes (or a str, but that costs an allocation), cut off if there's no room
+	#   (finish() leaves out a character cut in half)
+	def add(self, b):
+		if isinstance(b, str):
+			b = b.encode()
+		n = min(len(b), len(self.buffer) - self.length)
+		self.buffer[self.length:self.length + n] = b
+		self.length = self.length + n
+		return self
+
+	# an int in decimal, with leading zeros to width
+	def add_int(self, n, width=1):
+		buffer = self.buffer
+		if n < 0:
+			if self.length < len(buffer):
+				buffer[self.length] = 45		# "-"
+				self.length = self.length + 1
+			n = -n
+
+		digits = 1
+		scale = 10
+		while scale <= n:
+			digits = digits + 1
+			scale = scale * 10
+		if digits < width:
+			digits = width
+
+		end = self.length + digits
+		if end > len(buffer):
+			return self
+		i = end
+		while i > self.length:
+			i = i - 1
+			buffer[i] = 48 + n % 10			# "0"
+			n = n // 10
+		self.length = end
+		return self
+
+	# a reading that's "--" (or anything else not a number) until it's known
+	def add_value(self, value):
+		if isinstance(value, int):
+			return self.add_int(value)
+		if isinstance(value, float):
+			return self.add_int(round(value))
+		return self.add(b"--")
+
+	# done writing, make the text a str again only if it reads differently
+	def finish(self):
+		length = self.length
+		buffer = self.buffer
+		last = self.last
+		same = length == self.last_length
+		i = 0
+		while same and i < length:
+			same = buffer[i] == last[i]
+			i = i + 1
+
+		if not same:
+			last[:length] = buffer[:length]
+			self.last_length = length
+			self.text = str(buffer[:utf8_end(buffer, length)], "utf-8")
+		if not same or self.color != self.last_color:
+			self.last_color = self.color
+			self.changes = self.changes + 1
+		return self
+
+class Fixed:
+	__slots__ = ("text", "color")
+
+	def __init__(self, text, color):
+		self.text = text
+		self.color = color
+
+# class of a reading that runs from low to high, clamped at both ends
+def classify(table, low, value):
+	i = value - low
+	if i < 0:
+		i = 0
+	elif i >= len(table):
+		i = len(table) - 1
+	return table[i]
+
+# a class table for the ints from low to high: each of limits is the lowest
+#   value in its class, in order, so class 0 is everything below limits[0]
+def class_table(low, high, limits):
+	table = bytearray(high - low + 1)
+	for i in range(len(table)):
+		c = 0
+		while c < len(limits) and low + i >= limits[c]:
+			c = c + 1
+		table[i] = c
+	return table
+
+# smallest int not less than x
+def ceil_int(x):
+	i = int(x)
+	if x > i:
+		i = i + 1
+	return i
@@ -0,0 +1,184 @@
+# Wall clock time for Dakota
+#
+# The onboard clock only knows how long it's been since boot, and not very
+# well: the SAMD51's clock gains or loses a few seconds a day.  The clock
+# used to be set from the weather API's current.dt on every call, so it was
+# only as good as the last weather call and went back to 2000-01-01 whenever
+# a call failed.
+#
+# A TimeKeeper asks the ESP32 for network time (esp.get_time(), which the
+# ESP32 keeps with NTP) and, from the syncs it's seen, works out how fast the
+# onboard clock runs compared to it.  Between syncs the time is the last sync
+# plus the onboard time since, stretched by that drift, so syncs can be hours
+# apart and the clock still right to the second.  It's all integer ms and ns:
+# CircuitPython's floats can't hold a Unix time to the second.
+#
+# get_time() only has whole seconds, which on its own would leave each sync
+# up to a second out and the drift unmeasurable over an hour or two.  So a
+# sync reads it every EDGE_POLL secs until the second changes, and takes the
+# moment it did as the start of that second.
+#
+#   - the drift is measured from the first sync (the anchor) to the latest, so
+#     the longer it runs the better it knows it.  A sync that disagrees with
+#     the model by more than STEP_MS means one clock or the other jumped, and
+#     it starts over from there
+#   - syncs start SYNC_MIN apart.  Once the drift is known, each one that finds
+#     the time within GOOD_MS doubles the wait to the next, up to SYNC_MAX, and
+#     one that doesn't halves it
+#   - until there's been a sync, times from the weather API (hint()) are used
+#     instead, without drift
+#
+# The time zone is kept here too, from the weather API, so it stays put when a
+# weather call fails.
+
+import time
+
+SYNC_MIN = 900			# secs between syncs to start with
+SYNC_MAX = 43_200		# secs, longest wait between syncs
+SYNC_RETRY = 60			# secs after a failed sync
+EDGE_POLL = 0.05		# secs between reads while waiting for the second to change
+EDGE_WAIT = 1.5			# secs to wait for it before making do with the middle of the second
+DRIFT_MIN_SPAN = 3_600	# secs of syncs before the drift is worked out
+GOOD_MS = 500			# a sync this close to the model lets the next one wait longer
+STEP_MS = 60_000		# a sync this far off the model starts over
+MAX_DRIFT_PPB = 2_000_000	# drift is assumed no more than 2000 ppm either way
+VALID_AFTER = 1_600_000_000	# Unix secs, earlier network times are the ESP32 not knowing yet
+
+_NS = 1_000_000_000
+_MS_NS = 1_000_000
+
+class TimeKeeper:
+
+	def __init__(self):
+		self.zone = 0				# secs, local time less UTC
+		self.source = None			# "ntp", "api" or None while the time is unknown
+		self.at_ns = 0				# time.monotonic_ns() of the last sync
+		self.utc_ms = 0				# Unix time then, ms
+		self.anchor_ns = 0			# and of the first sync, for the drift
+		self.anchor_ms = 0
+		self.drift_ppb = 0			# how much faster network time runs than ours, parts per billion
+		self.drift_known = False
+		self.interval = SYNC_MIN
+		self.edge = None			# the second a sync in progress is waiting to see the end of
+		self.edge_ns = 0
+
+		self.syncs = 0
+		self.failures = 0
+		self.steps = 0
+		self.last_error_ms = None	# how far off the model was at the last sync
+		self.worst_error_ms = 0
+
+	@property
+	def known(self):
+		return self.source != None
+
+	# network time, not just a hint
+	@property
+	def synced(self):
+		return self.source == "ntp"
+
+	# Unix time now, ms
+	def utc_ms_now(self):
+		if self.source == None:
+			return time.time() * 1000
+		elapsed = time.monotonic_ns() - self.at_ns
+		return self.utc_ms + (elapsed + elapsed * self.drift_ppb // _NS) // _MS_NS
+
+	# Unix time now, secs
+	def utc(self):
+		return self.utc_ms_now() // 1000
+
+	# local time now, secs like time.time() but local
+	def local(self):
+		return self.utc() + self.zone
+
+	# ms until the local minute turns over
+	def ms_to_next_minute(self):
+		return 60_000 - (self.utc_ms_now() + self.zone * 1000) % 60_000
+
+	def set_zone(self, zone):
+		self.zone = zone
+		return;
+
+	# Unix time from somewhere less exact than network time (an API response),
+	#   only used until there's been a sync
+	def hint(self, utc):
+		if self.synced:
+			return;
+		self.source = "api"
+		self.at_ns = time.monotonic_ns()
+		self.utc_ms = utc * 1000
+		return;
+
+	# ask the ESP32 for the time, returns secs until it's worth calling again:
+	#   EDGE_POLL while a sync is in progress, longer once it's done
+	def sync(self, esp):
+		try:
+			utc = esp.get_time()[0]
+		except Exception as e:
+			print("!!!! Time sync failed:", e)
+			self.failures = self.failures + 1
+			self.edge = None
+			return SYNC_RETRY
+
+		if utc < VALID_AFTER:
+			print("!!!! Time sync got", utc)
+			self.failures = self.failures + 1
+			self.edge = None
+			return SYNC_RETRY
+
+		# wait for the next second to start
+		now = time.monotonic_ns()
+		if self.edge == None:
+			self.edge = utc
+			self.edge_ns = now
+			return EDGE_POLL
+		if utc == self.edge:
+			if now - self.edge_ns < EDGE_WAIT * _NS:
+				return EDGE_POLL
+			utc_ms = utc * 1000 + 500		# it didn't, so the middle of the second is as good as it gets
+		else:
+			utc_ms = utc * 1000
+		self.edge = None
+		self.syncs = self.syncs + 1
+
+		if self.synced:
+			error = utc_ms - self.utc_ms_now()
+			self.last_error_ms = error
+			if abs(error) > STEP_MS:
+				print("!!!! Time jumped", error, "ms, starting over")
+				self.steps = self.steps + 1
+				self._anchor(now, utc_ms)
+			else:
+				self.worst_error_ms = max(self.worst_error_ms, abs(error))
+				if self.drift_known and abs(error) <= GOOD_MS:
+					self.interval = min(self.interval * 2, SYNC_MAX)
+				elif abs(error) > GOOD_MS:
+					self.interval = max(self.interval // 2, SYNC_MIN)
+		else:
+			self._anchor(now, utc_ms)
+		self.source = "ntp"
+		self.at_ns = now
+		self.utc_ms = utc_ms
+
+		# the drift, once the syncs are far enough apart to say
+		span = now - self.anchor_ns
+		if span >= DRIFT_MIN_SPAN * _NS:
+			drift = ((utc_ms - self.anchor_ms) * _MS_NS - span) * _NS // span
+			self.drift_ppb = max(-MAX_DRIFT_PPB, min(MAX_DRIFT_PPB, drift))
+			self.drift_known = True
+		return self.interval
+
+	def report(self):
+		print("  time: %s, %d syncs, %d failed, %d steps, last off by %s ms, worst %d ms, drift %s ppm, next in %d secs, zone %+d secs" % (
+			self.source or "unknown", self.syncs, self.failures, self.steps, self.last_error_ms, self.worst_error_ms,
+			"%.1f" % (self.drift_ppb / 1000) if self.drift_known else "unknown", self.interval, self.zone))
+		return;
+
+	def _anchor(self, now, utc_ms):
+		self.anchor_ns = now
+		self.anchor_ms = utc_ms
+		self.drift_ppb = 0
+		self.drift_known = False
+		self.interval = SYNC_MIN
+		return;
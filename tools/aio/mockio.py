@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# A stand-in for the Adafruit IO batch data endpoint, to try telemetry.py
+#
+# Accepts the points a Dakota sends, checks the key, keeps them in memory and
+# holds the device to the same per-minute limit Adafruit IO does, answering
+# 429 when it's over.  Point a device at it by adding 'aio_url' to
+# secrets.py (for example "http://192.168.1.20:8082").
+#
+#   python3 tools/aio/mockio.py [--port 8082] [--key <key>] [--rate 30]
+#
+#   POST /api/v2/<user>/feeds/<feed>/data/batch    {"data":[{"value":..,"created_at":..},..]}
+#   GET /points                                    what's been received, as text
+
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RATE = 30			# points a minute, as on Adafruit IO's free plan
+
+class MockIO:
+
+	def __init__(self, key=None, rate=RATE, clock=time.time):
+		self.key = key				# None takes any key
+		self.rate = rate
+		self.clock = clock
+		self.feeds = {}				# feed key: [(created_at, value)]
+		self.recent = []			# (time, points) for the last minute
+		self.requests = 0
+		self.throttled = 0
+		self.lock = threading.Lock()
+
+	# (status, body bytes) for a request
+	def handle(self, method, path, headers, body):
+		parts = urllib.parse.urlsplit(path).path.strip("/").split("/")
+		if method != "POST" or len(parts) != 7 or parts[:2] != ["api", "v2"] or parts[3] != "feeds" or parts[5:] != ["data", "batch"]:
+			return 404, b'{"error":"not found"}'
+		if self.key is not None and headers.get("x-aio-key") != self.key:
+			return 401, b'{"error":"invalid API key"}'
+
+		try:
+			points = json.loads(body)["data"]
+			values = [(p.get("created_at"), str(p["value"])) for p in points]
+		except (ValueError, KeyError, TypeError, AttributeError):
+			return 400, b'{"error":"bad batch"}'
+
+		with self.lock:
+			self.requests = self.requests + 1
+			now = self.clock()
+			self.recent = [r for r in self.recent if now - r[0] < 60]
+			if sum(r[1] for r in self.recent) + len(values) > self.rate:
+				self.throttled = self.throttled + 1
+				return 429, b'{"error":"data rate limit reached"}'
+			self.recent.append((now, len(values)))
+			self.feeds.setdefault(parts[4], []).extend(values)
+
+		created = [{"feed_key": parts[4], "value": v, "created_at": c} for c, v in values]
+		return 200, json.dumps(created).encode()
+
+	def points(self):
+		return sum(len(v) for v in self.feeds.values())
+
+	def stats(self):
+		lines = ["requests: %d   throttled: %d   points: %d" % (self.requests, self.throttled, self.points())]
+		for feed, values in sorted(self.feeds.items()):
+			last = values[-1]
+			lines.append("%-28s %5d  last %s at %s" % (feed, len(values), last[1], last[0]))
+		return "\n".join(lines) + "\n"
+
+def handler(io):
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.0"
+
+		def do_POST(self):
+			length = int(self.headers.get("Content-Length", 0))
+			body = self.rfile.read(length)
+			headers = {k.lower(): v for k, v in self.headers.items()}
+			self._send(*io.handle("POST", self.path, headers, body), "application/json")
+
+		def do_GET(self):
+			if urllib.parse.urlsplit(self.path).path == "/points":
+				self._send(200, io.stats().encode(), "text/plain")
+			else:
+				self._send(404, b'{"error":"not found"}', "application/json")
+
+		def _send(self, status, body, content_type):
+			self.send_response(status)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+	return Handler
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Stand in for Adafruit IO's batch data endpoint")
+	parser.add_argument("--port", type=int, default=8082)
+	parser.add_argument("--key", default=None, help="only accept this key, default any")
+	parser.add_argument("--rate", type=int, default=RATE, help="points a minute before answering 429")
+	options = parser.parse_args(args)
+
+	io = MockIO(options.key, options.rate)
+	server = ThreadingHTTPServer(("", options.port), handler(io))
+	print("mockio: serving on port %d" % options.port)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
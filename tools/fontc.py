@@ -0,0 +1,287 @@
+# Dakota font compiler - runs on the host computer, not on the PyPortal
+#
+# Turns the BDF fonts in /fonts into PCF fonts holding just the glyphs each
+# font is used for on the display.  PCF is a binary format that
+# adafruit_bitmap_font reads directly, so there's no text to parse at boot and
+# the glyph bitmaps are read straight into place.
+#
+# Usage, from the top of the project:
+#
+#	python3 tools/fontc.py				compile all three fonts
+#	python3 tools/fontc.py in.bdf out.pcf "0123456789"	compile one font
+#
+# The glyph sets below have to cover what code.py draws with each font and
+# should be kept in step with BIG_GLYPHS, MED_GLYPHS and SM_GLYPHS there.
+
+import os
+import struct
+import sys
+
+# ASCII letters and digits
+_ALNUM = "".join(chr(c) for c in range(128) if chr(c).isalnum())
+
+BIG_GLYPHS = "0123456789:-"						# time and temperature
+MED_GLYPHS = _ALNUM + " ,%-./'"					# humidity, conditions and date
+SM_GLYPHS = "".join(chr(c) for c in range(32, 127))	# alerts can say anything
+
+FONTS = (
+	("Source_Sans_Pro_Bold-72", BIG_GLYPHS),
+	("Source_Sans_Pro-32", MED_GLYPHS),
+	("Source_Sans_Pro-24", SM_GLYPHS),
+	)
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fonts")
+
+# PCF table types
+PCF_PROPERTIES = 1 << 0
+PCF_ACCELERATORS = 1 << 1
+PCF_METRICS = 1 << 2
+PCF_BITMAPS = 1 << 3
+PCF_BDF_ENCODINGS = 1 << 5
+PCF_BDF_ACCELERATORS = 1 << 8
+
+# every table is big endian, most significant bit first, rows padded to 4 bytes
+PCF_FORMAT = 0x0000000E
+PCF_GLYPH_PAD = 4
+
+class Glyph:
+	def __init__(self, code):
+		self.code = code
+		self.dwidth = 0
+		self.width = 0
+		self.height = 0
+		self.x_offset = 0
+		self.y_offset = 0
+		self.rows = []		# one int per row, bit (width-1) is the leftmost pixel
+
+	# PCF metrics: left bearing, right bearing, advance, ascent, descent, attributes
+	def metrics(self):
+		return (self.x_offset, self.x_offset + self.width, self.dwidth,
+			self.y_offset + self.height, -self.y_offset, 0)
+
+	def bitmap(self, pad):
+		stride = ((self.width + 7) // 8 + pad - 1) // pad * pad
+		data = bytearray()
+		for row in self.rows:
+			data += (row << (stride * 8 - self.width)).to_bytes(stride, "big")
+		return bytes(data)
+
+class BdfFont:
+	def __init__(self, path):
+		self.properties = []		# (name, value) in file order
+		self.name = ""
+		self.ascent = 0
+		self.descent = 0
+		self.glyphs = {}
+
+		with open(path) as f:
+			lines = iter(f.read().splitlines())
+
+		for line in lines:
+			key, _, rest = line.partition(" ")
+			if key == "FONT":
+				self.name = rest
+			elif key == "STARTPROPERTIES":
+				for line in lines:
+					if line == "ENDPROPERTIES":
+						break
+					name, _, value = line.partition(" ")
+					if value.startswith('"'):
+						value = value[1:-1].replace('""', '"')
+					else:
+						value = int(value)
+					self.properties.append((name, value))
+					if name == "FONT_ASCENT":
+						self.ascent = value
+					elif name == "FONT_DESCENT":
+						self.descent = value
+			elif key == "STARTCHAR":
+				glyph = self._read_glyph(lines)
+				if glyph.code >= 0:
+					self.glyphs[glyph.code] = glyph
+
+	def _read_glyph(self, lines):
+		glyph = Glyph(-1)
+		for line in lines:
+			key, _, rest = line.partition(" ")
+			if key == "ENCODING":
+				glyph.code = int(rest.split()[0])
+			elif key == "DWIDTH":
+				glyph.dwidth = int(rest.split()[0])
+			elif key == "BBX":
+				glyph.width, glyph.height, glyph.x_offset, glyph.y_offset = (int(v) for v in rest.split())
+			elif key == "BITMAP":
+				for line in lines:
+					if line == "ENDCHAR":
+						return glyph
+					bits = len(line) * 4
+					glyph.rows.append(int(line, 16) >> (bits - glyph.width))
+			elif key == "ENDCHAR":
+				break
+		return glyph
+
+	def subset(self, chars):
+		missing = [c for c in chars if ord(c) not in self.glyphs]
+		if missing:
+			raise ValueError("no glyph for " + repr("".join(missing)))
+		return [self.glyphs[code] for code in sorted(set(ord(c) for c in chars))]
+
+def _table(format_, data):
+	# every table starts with its format, which is always little endian
+	return struct.pack("<I", format_) + data
+
+def _metrics(m):
+	return struct.pack(">5hH", *m)
+
+def _properties_table(font):
+	props = [("FONT", font.name)] + [p for p in font.properties if p[0] != "FONT"]
+	strings = bytearray()
+	entries = bytearray()
+	for name, value in props:
+		name_offset = len(strings)
+		strings += name.encode("latin-1") + b"\x00"
+		if isinstance(value, str):
+			entries += struct.pack(">IBI", name_offset, 1, len(strings))
+			strings += value.encode("latin-1") + b"\x00"
+		else:
+			entries += struct.pack(">IBi", name_offset, 0, value)
+	pad = b"\x00" * ((4 - len(props) % 4) % 4)
+	data = struct.pack(">I", len(props)) + entries + pad + struct.pack(">I", len(strings)) + strings
+	return _table(PCF_FORMAT, data)
+
+def _accelerators_table(font, glyphs):
+	metrics = [g.metrics() for g in glyphs]
+	minbounds = tuple(min(m[i] for m in metrics) for i in range(6))
+	maxbounds = tuple(max(m[i] for m in metrics) for i in range(6))
+	max_overlap = max(m[1] - m[2] for m in metrics)
+
+	no_overlap = 1 if max_overlap <= minbounds[0] else 0
+	constant_metrics = 1 if minbounds == maxbounds else 0
+	constant_width = 1 if minbounds[2] == maxbounds[2] else 0
+	ink_inside = 1 if (minbounds[0] >= 0 and max_overlap <= 0
+		and maxbounds[3] <= font.ascent and maxbounds[4] <= font.descent) else 0
+
+	data = struct.pack(">BBBBBBBBiii", no_overlap, constant_metrics, constant_metrics,
+		constant_width, ink_inside, 0, 0, 0, font.ascent, font.descent, max_overlap)
+	data += _metrics(minbounds) + _metrics(maxbounds)
+	return _table(PCF_FORMAT, data)
+
+def _metrics_table(glyphs):
+	data = struct.pack(">I", len(glyphs))
+	for glyph in glyphs:
+		data += _metrics(glyph.metrics())
+	return _table(PCF_FORMAT, data)
+
+def _bitmaps_table(glyphs):
+	offsets = bytearray()
+	bitmaps = bytearray()
+	for glyph in glyphs:
+		offsets += struct.pack(">I", len(bitmaps))
+		bitmaps += glyph.bitmap(PCF_GLYPH_PAD)
+	sizes = [sum(len(g.bitmap(pad)) for g in glyphs) for pad in (1, 2, 4, 8)]
+	data = struct.pack(">I", len(glyphs)) + offsets + struct.pack(">4I", *sizes) + bitmaps
+	return _table(PCF_FORMAT, data)
+
+def _encodings_table(glyphs):
+	first = glyphs[0].code
+	last = glyphs[-1].code
+	if last > 0xFF:
+		raise ValueError("only single byte encodings are supported")
+
+	index = [0xFFFF] * (last - first + 1)
+	for i, glyph in enumerate(glyphs):
+		index[glyph.code - first] = i
+	data = struct.pack(">hhhhh", first, last, 0, 0, first)
+	data += struct.pack(">%dH" % len(index), *index)
+	return _table(PCF_FORMAT, data)
+
+def compile_font(bdf_path, pcf_path, chars):
+	font = BdfFont(bdf_path)
+	glyphs = font.subset(chars)
+
+	tables = (
+		(PCF_PROPERTIES, _properties_table(font)),
+		(PCF_ACCELERATORS, _accelerators_table(font, glyphs)),
+		(PCF_METRICS, _metrics_table(glyphs)),
+		(PCF_BITMAPS, _bitmaps_table(glyphs)),
+		(PCF_BDF_ENCODINGS, _encodings_table(glyphs)),
+		(PCF_BDF_ACCELERATORS, _accelerators_table(font, glyphs)),
+		)
+
+	header = b"\x01fcp" + struct.pack("<I", len(tables))
+	offset = len(header) + 16 * len(tables)
+	toc = bytearray()
+	body = bytearray()
+	for type_, data in tables:
+		toc += struct.pack("<IIII", type_, PCF_FORMAT, len(data), offset + len(body))
+		body += data
+		body += b"\x00" * ((4 - len(data) % 4) % 4)
+
+	with open(pcf_path, "wb") as f:
+		f.write(header + toc + body)
+
+	check_font(pcf_path, glyphs)
+	return glyphs
+
+# read the PCF back the way adafruit_bitmap_font does and compare every glyph
+def check_font(pcf_path, glyphs):
+	with open(pcf_path, "rb") as f:
+		data = f.read()
+
+	if data[:4] != b"\x01fcp":
+		raise ValueError("bad header")
+	tables = {}
+	(count,) = struct.unpack_from("<I", data, 4)
+	for i in range(count):
+		type_, format_, size, offset = struct.unpack_from("<IIII", data, 8 + 16 * i)
+		tables[type_] = offset
+		if struct.unpack_from("<I", data, offset)[0] != format_:
+			raise ValueError("table format mismatch")
+
+	encodings = tables[PCF_BDF_ENCODINGS]
+	min_byte2, max_byte2, min_byte1, max_byte1, default_char = struct.unpack_from(">hhhhh", data, encodings + 4)
+	metrics = tables[PCF_METRICS]
+	bitmaps = tables[PCF_BITMAPS]
+	(glyph_count,) = struct.unpack_from(">I", data, bitmaps + 4)
+	bitmap_data = bitmaps + 8 + 4 * glyph_count + 16
+
+	for glyph in glyphs:
+		(index,) = struct.unpack_from(">H", data, encodings + 14 + 2 * (glyph.code - min_byte2))
+		m = struct.unpack_from(">5hH", data, metrics + 8 + 12 * index)
+		if m != glyph.metrics():
+			raise ValueError("metrics mismatch for %r" % chr(glyph.code))
+		(offset,) = struct.unpack_from(">I", data, bitmaps + 8 + 4 * index)
+		bitmap = glyph.bitmap(PCF_GLYPH_PAD)
+		if data[bitmap_data + offset:bitmap_data + offset + len(bitmap)] != bitmap:
+			raise ValueError("bitmap mismatch for %r" % chr(glyph.code))
+	return;
+
+# bytes of displayio.Bitmap storage the glyphs take once loaded, 1 bit per pixel
+#   in rows of 32 bit words
+def glyph_ram(glyphs):
+	return sum((g.width + 31) // 32 * 4 * g.height for g in glyphs)
+
+def report(name, bdf_path, pcf_path, glyphs):
+	all_glyphs = list(BdfFont(bdf_path).glyphs.values())
+	print("%-24s %3d of %3d glyphs  %7d -> %6d bytes on disk  %6d -> %6d bytes of glyph RAM" % (
+		name, len(glyphs), len(all_glyphs), os.path.getsize(bdf_path), os.path.getsize(pcf_path),
+		glyph_ram(all_glyphs), glyph_ram(glyphs)))
+	return;
+
+def main(args):
+	if len(args) == 3:
+		glyphs = compile_font(args[0], args[1], args[2])
+		report(os.path.basename(args[0]), args[0], args[1], glyphs)
+	elif not args:
+		for name, chars in FONTS:
+			bdf_path = os.path.join(FONT_DIR, name + ".bdf")
+			pcf_path = os.path.join(FONT_DIR, name + ".pcf")
+			glyphs = compile_font(bdf_path, pcf_path, chars)
+			report(name, bdf_path, pcf_path, glyphs)
+	else:
+		print("usage: fontc.py [in.bdf out.pcf glyphs]")
+		return 2
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
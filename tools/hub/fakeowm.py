@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# A stand-in for the OpenWeatherMap endpoints Dakota uses
+#
+# Serves the recorded responses in tools/sim/fixtures for any location and
+# any key, and counts the calls, so the hub (or a device pointed at this
+# machine) can be tried out without an API key or an internet connection.
+#
+#   python3 tools/hub/fakeowm.py [--port 8081] [--status 200]
+#
+#   GET /data/3.0/onecall          fixtures/onecall.json
+#   GET /data/2.5/air_pollution    fixtures/air_pollution.json
+#   GET /calls                     how many calls there have been, as text
+
+import argparse
+import os
+import sys
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sim", "fixtures"))
+
+ROUTES = {
+	"/data/3.0/onecall": "onecall.json",
+	"/data/2.5/air_pollution": "air_pollution.json",
+	}
+
+def handler(status, calls):
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.0"
+
+		def do_GET(self):
+			path = urllib.parse.urlsplit(self.path).path
+			if path == "/calls":
+				body = "".join("%s %d\n" % (p, calls.get(p, 0)) for p in ROUTES).encode()
+				self._send(200, "text/plain", body)
+			elif path in ROUTES:
+				calls[path] = calls.get(path, 0) + 1
+				if status != 200:
+					self._send(status, "application/json", b'{"cod":%d,"message":"stand-in error"}' % status)
+					return
+				with open(os.path.join(FIXTURES, ROUTES[path]), "rb") as f:
+					self._send(200, "application/json", f.read())
+			else:
+				self._send(404, "application/json", b'{"cod":404,"message":"not found"}')
+
+		def _send(self, code, content_type, body):
+			self.send_response(code)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+	return Handler
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Serve recorded OpenWeatherMap responses")
+	parser.add_argument("--port", type=int, default=8081)
+	parser.add_argument("--status", type=int, default=200, help="answer every call with this status, to try out failures")
+	options = parser.parse_args(args)
+
+	server = ThreadingHTTPServer(("", options.port), handler(options.status, {}))
+	print("fakeowm: serving %s on port %d" % (FIXTURES, options.port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# A LAN hub for a houseful of Dakotas
+#
+# Each Dakota calls OpenWeatherMap for itself, for the same latitude and
+# longitude as all the others, and parses several K of JSON to pick out a
+# dozen values.  Run this on any machine on the LAN and put its address in
+# each device's secrets.py as 'hub_url' (for example "http://192.168.1.20:8080/weather")
+# and the hub calls OpenWeatherMap once per location, every WEATHER_TTL secs
+# for the weather and AIR_QUALITY_TTL for the air quality, and hands every
+# device the same small binary payload (see hubpayload.py).
+#
+#   python3 tools/hub/hub.py --key <OpenWeatherMap API key> [--port 8080]
+#
+# To try it without an API key, run tools/hub/fakeowm.py and point the hub
+# at it with --owm http://localhost:8081.
+#
+#   GET /weather?lat=..&lon=..    the payload for a location
+#   GET /stats                    what the hub has done, as text
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the payload layout lives in the repo root, next to the device code that reads it
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")))
+import hubpayload
+
+OWM = "http://api.openweathermap.org"
+WEATHER_TTL = 600			# secs, how long a weather response is good for
+AIR_QUALITY_TTL = 3_300		# secs, and an air quality one
+TIMEOUT = 15				# secs to wait on OpenWeatherMap
+
+# (status, body bytes) for a GET, status is 0 if there was no HTTP response at all
+def http_get(url):
+	try:
+		with urllib.request.urlopen(url, timeout=TIMEOUT) as response:
+			return response.status, response.read()
+	except urllib.error.HTTPError as e:
+		return e.code, e.read()
+	except (urllib.error.URLError, OSError) as e:
+		print("hub: %s failed: %s" % (url.split("?")[0], e), file=sys.stderr)
+		return 0, b""
+
+# the same conversions code.py's get_weather and get_air_quality make
+def normalize(weather_status, onecall, aqi_status, air_pollution):
+	values = {"weather_status": weather_status, "aqi_status": aqi_status}
+
+	if weather_status == 200:
+		try:
+			current = onecall["current"]
+			dt = int(current["dt"])
+			tz_off = int(onecall["timezone_offset"])
+			values["dt"] = dt
+			values["timezone_offset"] = tz_off
+			values["temp"] = round(((float(current["temp"]) * 9.0) / 5.0) - 459.67)
+			values["humidity"] = round(current["humidity"])
+			values["pressure"] = round(current["pressure"])
+			values["uv_index"] = float(current["uvi"])
+			values["sunrise"] = int(current["sunrise"]) + tz_off
+			values["sunset"] = int(current["sunset"]) + tz_off
+			values["moon_phase"] = float(onecall["daily"][0]["moon_phase"])
+
+			description = current["weather"][0]["description"]
+			values["conditions"] = description[0].upper() + description[1:].lower()
+
+			values["wind_dir"] = (int(current["wind_deg"]) + 22) // 45 % 8
+			values["wind_speed"] = round(int(current["wind_speed"]) * 2.237)
+
+			# only the first alert that's in effect now
+			values["alert"] = "NoAlert"
+			for alert in onecall.get("alerts", ()):
+				if dt > alert["start"] and dt < alert["end"]:
+					values["alert"] = alert["event"]
+					break
+		except (KeyError, IndexError, TypeError, ValueError) as e:
+			print("hub: weather response missing", e, file=sys.stderr)
+			values = {"weather_status": weather_status, "aqi_status": aqi_status}
+
+	if aqi_status == 200:
+		try:
+			values["aq_index"] = int(air_pollution["list"][0]["main"]["aqi"])
+		except (KeyError, IndexError, TypeError, ValueError) as e:
+			print("hub: air quality response missing", e, file=sys.stderr)
+	return values
+
+class Location:
+	# what the hub last got from OpenWeatherMap for one place
+	def __init__(self):
+		self.weather_status = 0
+		self.onecall = None
+		self.weather_at = None
+		self.aqi_status = 0
+		self.air_pollution = None
+		self.air_at = None
+		self.values = None
+		self.lock = threading.Lock()
+
+class Hub:
+
+	def __init__(self, key, owm=OWM, get=http_get, weather_ttl=WEATHER_TTL, air_ttl=AIR_QUALITY_TTL,
+			clock=time.time):
+		self.key = key
+		self.owm = owm.rstrip("/")
+		self.get = get
+		self.weather_ttl = weather_ttl
+		self.air_ttl = air_ttl
+		self.clock = clock
+		self.locations = {}
+		self.lock = threading.Lock()
+		self.served = 0
+		self.upstream = 0
+
+	# the payload for a location, going to OpenWeatherMap only if what we
+	#   have is too old.  Locations are rounded to about a kilometer
+	def payload(self, lat, lon):
+		key = (round(float(lat), 2), round(float(lon), 2))
+		with self.lock:
+			location = self.locations.get(key)
+			if location is None:
+				location = self.locations[key] = Location()
+
+		with location.lock:
+			now = self.clock()
+			changed = False
+			if location.weather_at is None or now - location.weather_at >= self.weather_ttl:
+				location.weather_status, location.onecall = self._fetch(
+					"/data/3.0/onecall?lat=%s&lon=%s&exclude=hourly,minutely&appid=%s" % (key[0], key[1], self.key))
+				location.weather_at = now
+				changed = True
+			if location.air_at is None or now - location.air_at >= self.air_ttl:
+				location.aqi_status, location.air_pollution = self._fetch(
+					"/data/2.5/air_pollution?lat=%s&lon=%s&appid=%s" % (key[0], key[1], self.key))
+				location.air_at = now
+				changed = True
+			if changed:
+				location.values = normalize(location.weather_status, location.onecall, location.aqi_status, location.air_pollution)
+
+			# devices set their clocks from dt, so it's the time now rather than when
+			#   OpenWeatherMap answered (the hub's clock is assumed to be set by NTP)
+			location.values["dt"] = int(now)
+			self.served = self.served + 1
+			return hubpayload.pack(location.values)
+
+	def _fetch(self, path):
+		self.upstream = self.upstream + 1
+		status, body = self.get(self.owm + path)
+		if status != 200:
+			return status, None
+		try:
+			return status, json.loads(body)
+		except ValueError:
+			return 0, None
+
+	def stats(self):
+		lines = ["payloads served: %d" % self.served, "OpenWeatherMap calls: %d" % self.upstream]
+		for key, location in sorted(self.locations.items()):
+			lines.append("%s,%s  weather %d  air quality %d" % (key[0], key[1], location.weather_status, location.aqi_status))
+		return "\n".join(lines) + "\n"
+
+def handler(hub):
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.0"
+
+		def do_GET(self):
+			url = urllib.parse.urlsplit(self.path)
+			if url.path == "/weather":
+				query = urllib.parse.parse_qs(url.query)
+				try:
+					body = hub.payload(query["lat"][0], query["lon"][0])
+				except (KeyError, ValueError):
+					self._send(400, "text/plain", b"need lat and lon\n")
+					return
+				self._send(200, "application/octet-stream", body)
+			elif url.path == "/stats":
+				self._send(200, "text/plain", hub.stats().encode())
+			else:
+				self._send(404, "text/plain", b"not found\n")
+
+		def _send(self, status, content_type, body):
+			self.send_response(status)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+	return Handler
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Share OpenWeatherMap fetches among Dakotas on a LAN")
+	parser.add_argument("--port", type=int, default=8080)
+	parser.add_argument("--key", default=os.environ.get("OWM_API_KEY", ""), help="OpenWeatherMap API key, default $OWM_API_KEY")
+	parser.add_argument("--owm", default=OWM, help="OpenWeatherMap base URL, default " + OWM)
+	options = parser.parse_args(args)
+
+	hub = Hub(options.key, options.owm)
+	server = ThreadingHTTPServer(("", options.port), handler(hub))
+	print("hub: serving on port %d, weather from %s" % (options.port, options.owm))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Turn Dakota's SD card sensor logs into CSV
+#
+# Copy the log directory off the card and point this at it (or at some of the
+# files in it).  Records from all the files come out in one CSV, oldest first,
+# with blank cells where Dakota didn't have a value.  Times are Dakota's local
+# time, the same as it shows on the screen.
+#
+#   python3 tools/logcsv.py /Volumes/SD/log > sensors.csv
+#   python3 tools/logcsv.py 20220822.bin 20220823.bin -o sensors.csv
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+# the record format lives with the code that writes it
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+import sdlog
+
+def log_files(paths):
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			for name in os.listdir(path):
+				if name.endswith(".bin"):
+					files.append(os.path.join(path, name))
+		else:
+			files.append(path)
+	# the names are dates, so this is oldest first
+	return sorted(files, key=os.path.basename)
+
+def convert(files, out):
+	writer = csv.writer(out)
+	writer.writerow(("local_time",) + sdlog.FIELDS)
+	count = 0
+	for path in files:
+		with open(path, "rb") as f:
+			data = f.read()
+		try:
+			for record in sdlog.read_records(data):
+				stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(record[0]))
+				writer.writerow((stamp,) + tuple("" if v is None else v for v in record))
+				count = count + 1
+		except ValueError as e:
+			print("%s: %s, skipped" % (path, e), file=sys.stderr)
+	return count
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Convert Dakota sensor logs to CSV")
+	parser.add_argument("paths", nargs="+", help="log files, or directories of them")
+	parser.add_argument("-o", "--output", help="CSV file to write, default standard output")
+	options = parser.parse_args(args)
+
+	files = log_files(options.paths)
+	if options.output:
+		with open(options.output, "w", newline="") as out:
+			count = convert(files, out)
+	else:
+		count = convert(files, sys.stdout)
+	print("%d records from %d files" % (count, len(files)), file=sys.stderr)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
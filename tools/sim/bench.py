@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# Microbenchmarks for Dakota's hot paths, run under CPython against stubs.py.
+#
+#   parse        JsonPicker on the recorded onecall response, fed in fetcher
+#                  sized chunks, against json.loads on the whole thing
+#   flex_line    building the flex line from a couple of hours' worth of
+#                  state, and asking for it again when nothing has changed
+#   draw_display formatting and pushing every label, with the inside line
+#                  changing and with nothing changing
+#
+# First it checks that JsonPicker picks the same values out of the recorded
+# response as json.loads does (the response has a \u escape in it), and that
+# a Derived built on another one (the inside line, a
+# textfmt.Line changed in place) is worked out again when, and only when, the
+# line it's built on reads differently.
+#
+# Like sim.py, the times are only good for comparing one version of the code
+# with another on the same machine.  Allocations come from tracemalloc, and
+# include CPython-only ones: ints past 256 (the Derived counters, say) are heap
+# objects here but not on CircuitPython.
+#
+#   python3 tools/sim/bench.py [--repeat N]
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim
+import stubs
+
+CHUNK = 512			# fetcher.STEP_BYTES
+
+def measure(func, repeat):
+	# returns (us per call, bytes allocated per call, peak bytes in one call)
+	func()							# warm up, fills any caches
+	tracemalloc.start()
+	try:
+		before = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		func()
+		after, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+
+	start = time.perf_counter_ns()
+	for i in range(repeat):
+		func()
+	ns = time.perf_counter_ns() - start
+	return ns / repeat / 1000, max(0, after - before), peak - before
+
+def parse_benchmarks(ns):
+	body = stubs.fixture("onecall.json")
+	chunks = [body[i:i + CHUNK] for i in range(0, len(body), CHUNK)]
+	picker_class = sys.modules["jsonpick"].JsonPicker
+	picks = ns["WEATHER_PICKS"]
+
+	def picker():
+		p = picker_class(picks)
+		for chunk in chunks:
+			p.feed(chunk)
+			if p.done:
+				break
+		return p.found
+
+	def loads():
+		return json.loads(body)
+
+	return [("parse JsonPicker", picker), ("parse json.loads", loads)]
+
+def stage_benchmarks(ns):
+	views = ns["Views"]
+	texts = ns["Texts"]
+	draw_display = ns["draw_display"].func
+	flex = texts[7]
+	flex_line = flex.func.func
+	inside = texts[8].inputs[0]
+
+	def flex_fresh():
+		flex_line(*flex.inputs)
+
+	def flex_cached():
+		flex.get()
+
+	# alternate the inside line so each call has something to redraw
+	def draw():
+		inside.co2 = 1000 if inside.co2 != 1000 else 1001
+		inside.changed()
+		draw_display(views, texts)
+
+	def draw_unchanged():
+		draw_display(views, texts)
+
+	return [("flex_line", flex_fresh), ("flex_line unchanged", flex_cached),
+		("draw_display", draw), ("draw unchanged", draw_unchanged)]
+
+# values at a dotted path in a json.loads document, a list for "*" paths
+def walk(doc, parts):
+	if not parts:
+		return doc
+	part = parts[0]
+	if part == "*":
+		return [walk(item, parts[1:]) for item in doc]
+	if isinstance(doc, list):
+		return walk(doc[int(part)], parts[1:])
+	return walk(doc[part], parts[1:])
+
+# JsonPicker turns \u escapes into "?", our fonts are ASCII
+def as_picked(value):
+	if isinstance(value, list):
+		return [as_picked(v) for v in value]
+	if isinstance(value, str):
+		return "".join(c if ord(c) < 128 else "?" for c in value)
+	return value
+
+# JsonPicker against json.loads on the recorded response, returns what went wrong or None
+def check_parse(ns):
+	body = stubs.fixture("onecall.json")
+	doc = json.loads(body)
+	paths = list(ns["WEATHER_PICKS"]) + ["current.summary"]
+	picker = sys.modules["jsonpick"].JsonPicker(paths)
+	for i in range(0, len(body), CHUNK):
+		picker.feed(body[i:i + CHUNK])
+	for path in paths:
+		try:
+			want = walk(doc, path.split("."))
+		except (KeyError, IndexError):
+			continue
+		if isinstance(want, list):
+			want = want[:sys.modules["jsonpick"].MAX_MATCHES]
+		want = as_picked(want)
+		got = picker.found.get(path)
+		if got != want:
+			return "%s: %r, json.loads has %r" % (path, got, want)
+	return None
+
+# a Derived on top of the inside line's Derived, returns what went wrong or None
+def check_chained(ns):
+	inner = ns["Texts"][8]
+	inside = inner.inputs[0]
+	outer = type(inner)(lambda derived: derived.get().text, inner)
+
+	first = outer.get()
+	inside.co2 = inside.co2 + 1 if isinstance(inside.co2, int) else 1000
+	inside.changed()
+	second = outer.get()
+	if second == first or outer.computes != 2:
+		return "didn't refresh when the inside line changed: %r, then %r" % (first, second)
+
+	inside.changed()
+	outer.get()
+	if outer.computes != 2:
+		return "refreshed when the inside line read the same"
+	return None
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Benchmark Dakota's hot paths")
+	parser.add_argument("--repeat", type=int, default=2000, help="calls timed per benchmark, default 2000")
+	options = parser.parse_args(args)
+
+	# run a couple of simulated hours so the state holds real weather
+	device, ns, meters, took = sim.run(2)
+
+	problem = check_parse(ns)
+	if problem is not None:
+		print("JsonPicker", problem)
+		return 1
+	print("JsonPicker matches json.loads: ok")
+
+	benchmarks = parse_benchmarks(ns) + stage_benchmarks(ns)
+	device.install()
+	try:
+		with open(os.devnull, "w") as quiet:
+			with contextlib.redirect_stdout(quiet):
+				problem = check_chained(ns)
+			if problem is not None:
+				print("chained Derived", problem)
+				return 1
+			print("chained Derived refreshes: ok")
+
+			print("benchmark              us/call   alloc/call   peak bytes")
+			for name, func in benchmarks:
+				with contextlib.redirect_stdout(quiet):
+					us, alloc, peak = measure(func, options.repeat)
+				print("%-20s %9.1f %12d %12d" % (name, us, alloc, peak))
+	finally:
+		device.uninstall()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
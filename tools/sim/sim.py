@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Run Dakota's code.py on the desktop under CPython, against the stand-ins in
+# stubs.py, for a few hours of virtual time, then report what each stage of
+# the main loop cost.
+#
+# The numbers are CPython's, so they say nothing absolute about the SAMD51,
+# but they're good for comparing one version of code.py with the next: which
+# stage got slower, which one allocates more, how many times the loop woke up.
+# Allocations are measured with tracemalloc, so they're CPython object sizes
+# rather than CircuitPython heap bytes.
+#
+#   python3 tools/sim/sim.py [--hours N] [--verbose]
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs
+
+# the functions in code.py measured, in the order they're reported
+STAGES = ("get_weather", "get_air_quality", "get_sensor_data", "set_now", "flex_line",
+	"draw_display", "show_data", "collect_garbage", "nap")
+
+class Meter:
+	# times one stage in real (not virtual) time and tracks what it allocates
+	def __init__(self, name, func):
+		self.name = name
+		self.__name__ = name		# state.report() prints it
+		self.func = func
+		self.calls = 0
+		self.ns = 0
+		self.alloc = 0
+		self.peak = 0
+
+	def __call__(self, *args):
+		before = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		start = time.perf_counter_ns()
+		try:
+			return self.func(*args)
+		finally:
+			self.ns = self.ns + time.perf_counter_ns() - start
+			current, peak = tracemalloc.get_traced_memory()
+			self.calls = self.calls + 1
+			self.alloc = self.alloc + max(0, current - before)
+			self.peak = max(self.peak, peak - before)
+
+def run(hours, verbose=False, device=None, hook=None):
+	# hook(namespace) is called once code.py has loaded, before main_loop starts.
+	#   Returns (device, code.py's globals, meters by stage, real secs the run took)
+	device = device if device is not None else stubs.Device()
+	device.install()
+	tracemalloc.start()
+	out = sys.stdout if verbose else open(os.devnull, "w")
+	try:
+		with contextlib.redirect_stdout(out):
+			ns = device.load()
+			meters = {}
+			for name in STAGES:
+				if name in ns:
+					meters[name] = ns[name] = Meter(name, ns[name])
+
+			# the screen's Deriveds were made as code.py loaded, point them at the meters too
+			if "Texts" in ns:
+				for derived in ns["Texts"] + (ns["Warning"],):
+					meter = meters.get(derived.func.__name__)
+					if meter is not None and meter.func is derived.func:
+						derived.func = meter
+			if hook is not None:
+				hook(ns)
+
+			stubs.CLOCK.stop_at = stubs.CLOCK.now + hours * 3600
+			start = time.perf_counter()
+			try:
+				# code.py's forever loop, with the restarts counted on the way through
+				main_loop = ns["main_loop"]
+
+				def counted(esp):
+					try:
+						return main_loop(esp)
+					except Exception as e:
+						device.restarts.append("%s: %s" % (type(e).__name__, e))
+						raise
+
+				ns["main_loop"] = counted
+				ns["run_forever"](ns["esp"])
+			except stubs.StopSimulation:
+				pass
+			took = time.perf_counter() - start
+	finally:
+		tracemalloc.stop()
+		device.uninstall()
+		if out is not sys.stdout:
+			out.close()
+	return device, ns, meters, took
+
+def report(device, ns, meters, took, hours):
+	print("simulated %.1f hours in %.2f real secs" % (hours, took))
+	print("  sleeps:", stubs.CLOCK.sleeps, "  display refreshes:", device.display.refreshes,
+		"  label rasterizations:", stubs.Label.rasterized)
+	print("  main_loop restarts:", len(device.restarts))
+	screen = ns.get("Screen")
+	if screen is not None and hasattr(screen, "pages"):
+		print("  page showing at the end: %d of %d" % (screen.page, len(screen.pages)))
+	wifi = ns.get("Wifi")
+	if wifi is not None:
+		print("  wifi: %d attempts, %d failed, %d reconnects, %d drops, %d resets, up %.1f of %.1f hours" % (
+			wifi.attempts, wifi.failures, wifi.reconnects, wifi.drops, wifi.resets, wifi.uptime() / 3600, hours))
+	keeper = ns.get("Time")
+	if keeper is not None and keeper.known:
+		print("  time: %d syncs, off by %d ms at the end, drift %.1f ppm (the sim's is %d)" % (
+			keeper.syncs, keeper.utc_ms_now() - device.esp.network_time() * 1000,
+			keeper.drift_ppb / 1000, stubs.CLOCK_DRIFT_PPM))
+	supervisor = ns.get("Health")
+	if supervisor is not None:
+		print("  watchdog: %d feeds, %d timeouts, %d resets, loop pass p99 %d ms, worst %d ms" % (
+			stubs.WATCHDOG.feeds, stubs.WATCHDOG.timeouts, stubs.WATCHDOG.resets,
+			supervisor.loop.percentile(0.99), supervisor.loop.worst))
+	sensor = ns.get("Sensor")
+	if sensor is not None:
+		scd30 = sensor.scd30
+		print("  SCD-30: %d samples, %d early polls, %d I2C transactions, %d flash writes" % (
+			sensor.samples, sensor.misses, scd30.transactions, scd30.flash_writes))
+	for error in sorted(set(device.restarts)):
+		print("    %5d  %s" % (device.restarts.count(error), error))
+	print("  requests:", len(device.esp.requests), "  connections:", device.esp.connects, "  DNS lookups:", device.esp.lookups)
+	if device.hub is not None:
+		print("    (hub made %d OpenWeatherMap calls)" % device.hub.upstream)
+	if device.aio is not None:
+		print("    (Adafruit IO got %d points in %d requests, %d throttled)" % (
+			device.aio.points(), device.aio.requests, device.aio.throttled))
+	for method, path in sorted(set(device.esp.requests)):
+		print("    %-4s %-28s %5d" % (method, path, device.esp.requests.count((method, path))))
+	print()
+	print("stage               calls    mean us   alloc/call   peak bytes")
+	for name in STAGES:
+		m = meters.get(name)
+		if m is None or m.calls == 0:
+			continue
+		print("%-17s %7d %10.1f %12d %12d" % (name, m.calls, m.ns / m.calls / 1000, m.alloc // m.calls, m.peak))
+
+	naps = meters.get("nap")
+	if naps is not None and naps.calls > 0:
+		print()
+		# show_data includes draw_display, so add up the whole run rather than the stages
+		awake = took * 1_000_000 - naps.ns / 1000
+		print("per loop pass, not counting the nap: %.1f us over %d passes" % (awake / naps.calls, naps.calls))
+	return;
+
+def main(args):
+	parser = argparse.ArgumentParser(description="Run code.py on a simulated PyPortal")
+	parser.add_argument("--hours", type=float, default=24, help="virtual hours to run, default 24")
+	parser.add_argument("--verbose", action="store_true", help="show what code.py prints")
+	parser.add_argument("--hub", action="store_true", help="get the weather from a simulated hub (tools/hub)")
+	parser.add_argument("--aio", action="store_true", help="send telemetry to a simulated Adafruit IO (tools/aio)")
+	parser.add_argument("--outage", action="append", default=[], metavar="START:END",
+		help="the access point is down from hour START to hour END, can be given more than once")
+	parser.add_argument("--tap", action="append", default=[], type=float, metavar="HOUR",
+		help="tap the screen at this hour, can be given more than once")
+	options = parser.parse_args(args)
+	outages = [tuple(float(h) * 3600 for h in o.split(":")) for o in options.outage]
+	taps = [h * 3600 for h in options.tap]
+
+	device, ns, meters, took = run(options.hours, options.verbose, stubs.Device(hub=options.hub, aio=options.aio,
+		outages=outages, taps=taps))
+	report(device, ns, meters, took, options.hours)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
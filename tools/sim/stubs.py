@@ -0,0 +1,953 @@
+# Stand-ins for the CircuitPython modules and hardware code.py uses, so it can
+# run under CPython on a desktop.  They do just enough for code.py to run: the
+# display keeps its objects but draws nothing, the ESP32 serves the recorded
+# OpenWeatherMap responses in fixtures/, and the SCD-30 makes up readings.
+#
+# Time is virtual.  time.sleep() moves the clock forward instantly and raises
+# StopSimulation (which isn't an Exception, so code.py's retry loop doesn't
+# catch it) once the run is over.
+
+import gc as _gc
+import os
+import random
+import sys
+import time as _time
+import tracemalloc
+import types
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.normpath(os.path.join(HERE, "..", ".."))
+FIXTURES = os.path.join(HERE, "fixtures")
+FONT_DIR = os.path.join(ROOT, "fonts")
+
+DEVICE_EPOCH = 946_684_800		# a PyPortal's clock starts at 2000-01-01
+HEAP_SIZE = 192 * 1024			# roughly what a Titano has free for Python
+
+class StopSimulation(BaseException):
+	pass
+
+# ---------------------------------------------------------------- time
+
+class Clock:
+	def __init__(self):
+		self.now = 0.0			# secs since boot
+		self.stop_at = None
+		self.sleeps = 0
+		self.slept = 0.0
+
+	def advance(self, secs):
+		self.now = self.now + secs
+		return;
+
+	def sleep(self, secs):
+		if secs < 0:
+			raise ValueError("sleep length must be non-negative")
+		self.sleeps = self.sleeps + 1
+		self.slept = self.slept + secs
+		self.advance(secs)
+		if self.stop_at is not None and self.now >= self.stop_at:
+			raise StopSimulation()
+		WATCHDOG.check()
+		return;
+
+CLOCK = Clock()
+
+def _time_module():
+	m = types.ModuleType("time")
+	m.struct_time = _time.struct_time
+	m.time = lambda: int(DEVICE_EPOCH + CLOCK.now)
+	m.monotonic = lambda: CLOCK.now
+	m.monotonic_ns = lambda: int(CLOCK.now * 1_000_000_000)
+	m.sleep = CLOCK.sleep
+	m.localtime = lambda secs=None: _time.gmtime(m.time() if secs is None else secs)
+	m.gmtime = m.localtime
+	m.mktime = lambda t: int(_time.mktime(t) - _time.timezone)
+	return m
+
+# ---------------------------------------------------------------- gc
+
+# CPython objects are several times the size of CircuitPython's, so the heap
+#   is counted from a baseline taken once code.py has loaded, see Device.load()
+def _gc_module():
+	m = types.ModuleType("gc")
+	m.baseline = 0
+	m.collect = _gc.collect
+	m.enable = _gc.enable
+	m.disable = _gc.disable
+	m.mem_alloc = lambda: max(0, (tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0) - m.baseline)
+	m.mem_free = lambda: HEAP_SIZE - m.mem_alloc()
+	return m
+
+HUB_URL = "http://hub.local:8080/weather"
+AIO_URL = "http://aio.local:8082"
+AIO_KEY = "aio_0123456789abcdef"
+
+def _secrets_module(hub, aio):
+	# made up, the fake ESP32 doesn't care what they are
+	m = types.ModuleType("secrets")
+	m.secrets = {
+		'ssid' : 'simulated',
+		'password' : 'simulated',
+		'openweather_api_token' : '0123456789abcdef0123456789abcdef',
+		'Latitude' : '45.52',
+		'Longitude' : '-122.68',
+		}
+	if hub:
+		m.secrets['hub_url'] = HUB_URL
+	if aio:
+		m.secrets['aio_username'] = 'simulated'
+		m.secrets['aio_key'] = AIO_KEY
+		m.secrets['aio_url'] = AIO_URL
+	return m
+
+# ---------------------------------------------------------------- displayio and friends
+
+class Bitmap:
+	def __init__(self, width, height, value_count):
+		self.width = width
+		self.height = height
+		self.value_count = value_count
+		self.bits = max(1, (value_count - 1).bit_length())
+		self.data = bytearray(width * height)
+
+	def __getitem__(self, xy):
+		x, y = xy if isinstance(xy, tuple) else (xy % self.width, xy // self.width)
+		return self.data[y * self.width + x]
+
+	def __setitem__(self, xy, value):
+		x, y = xy if isinstance(xy, tuple) else (xy % self.width, xy // self.width)
+		self.data[y * self.width + x] = value
+
+	def fill(self, value):
+		for i in range(len(self.data)):
+			self.data[i] = value
+
+	# bytes displayio would use: rows of 32 bit words
+	def nbytes(self):
+		return (self.width * self.bits + 31) // 32 * 4 * self.height
+
+class Palette:
+	def __init__(self, count):
+		self.colors = [0] * count
+		self.transparent = set()
+
+	def __len__(self):
+		return len(self.colors)
+
+	def __getitem__(self, i):
+		return self.colors[i]
+
+	def __setitem__(self, i, color):
+		self.colors[i] = color
+
+	def make_transparent(self, i):
+		self.transparent.add(i)
+
+	def make_opaque(self, i):
+		self.transparent.discard(i)
+
+class TileGrid:
+	def __init__(self, bitmap, pixel_shader=None, width=1, height=1, tile_width=None, tile_height=None,
+			default_tile=0, x=0, y=0):
+		self.bitmap = bitmap
+		self.pixel_shader = pixel_shader
+		self.width = width
+		self.height = height
+		self.tile_width = tile_width if tile_width is not None else bitmap.width
+		self.tile_height = tile_height if tile_height is not None else bitmap.height
+		self.tiles = [default_tile] * (width * height)
+		self.x = x
+		self.y = y
+		self.hidden = False
+
+	def __getitem__(self, i):
+		if isinstance(i, tuple):
+			i = i[1] * self.width + i[0]
+		return self.tiles[i]
+
+	def __setitem__(self, i, tile):
+		if isinstance(i, tuple):
+			i = i[1] * self.width + i[0]
+		self.tiles[i] = tile
+
+class Group(list):
+	def __init__(self, scale=1, x=0, y=0):
+		super().__init__()
+		self.scale = scale
+		self.x = x
+		self.y = y
+		self.hidden = False
+
+class Display:
+	def __init__(self):
+		self.width = 480
+		self.height = 320
+		self.auto_refresh = True
+		self.auto_brightness = False
+		self.brightness = 1.0
+		self.root_group = None
+		self.refreshes = 0
+
+	def show(self, group):
+		self.root_group = group
+
+	def refresh(self, target_frames_per_second=None, minimum_frames_per_second=0):
+		self.refreshes = self.refreshes + 1
+		return True
+
+def _displayio_module():
+	m = types.ModuleType("displayio")
+	m.Bitmap = Bitmap
+	m.Palette = Palette
+	m.TileGrid = TileGrid
+	m.Group = Group
+	return m
+
+class _Shape:
+	def __init__(self, pixel_shader=None, x=0, y=0, **kwargs):
+		self.pixel_shader = pixel_shader
+		self.x = x
+		self.y = y
+		self.hidden = False
+		self.color_index = 0
+		for name, value in kwargs.items():
+			setattr(self, name, value)
+
+def _vectorio_module():
+	m = types.ModuleType("vectorio")
+	m.Rectangle = type("Rectangle", (_Shape,), {})
+	m.Polygon = type("Polygon", (_Shape,), {})
+	m.Circle = type("Circle", (_Shape,), {})
+	return m
+
+def _bitmaptools_module():
+	m = types.ModuleType("bitmaptools")
+
+	def blit(dest, source, x, y, *, x1=0, y1=0, x2=None, y2=None, skip_index=None):
+		x2 = source.width if x2 is None else x2
+		y2 = source.height if y2 is None else y2
+		for sy in range(y1, y2):
+			for sx in range(x1, x2):
+				value = source[sx, sy]
+				dx = x + sx - x1
+				dy = y + sy - y1
+				if value != skip_index and 0 <= dx < dest.width and 0 <= dy < dest.height:
+					dest[dx, dy] = value
+
+	def fill_region(dest, x1, y1, x2, y2, value):
+		for y in range(max(0, y1), min(dest.height, y2)):
+			for x in range(max(0, x1), min(dest.width, x2)):
+				dest[x, y] = value
+
+	m.blit = blit
+	m.fill_region = fill_region
+	return m
+
+# ---------------------------------------------------------------- fonts and labels
+
+class Glyph:
+	def __init__(self, bitmap, tile_index, width, height, dx, dy, shift_x, shift_y):
+		self.bitmap = bitmap
+		self.tile_index = tile_index
+		self.width = width
+		self.height = height
+		self.dx = dx
+		self.dy = dy
+		self.shift_x = shift_x
+		self.shift_y = shift_y
+
+class Font:
+	# a BDF font read with the font compiler's parser, looks like a fontio font
+	def __init__(self, path):
+		sys.path.insert(0, os.path.join(ROOT, "tools"))
+		try:
+			import fontc
+		finally:
+			sys.path.pop(0)
+		self.bdf = fontc.BdfFont(path)
+		self.ascent = self.bdf.ascent
+		self.descent = self.bdf.descent
+		self._glyphs = {}
+
+	def get_bounding_box(self):
+		glyphs = self.bdf.glyphs.values()
+		left = min(g.x_offset for g in glyphs)
+		bottom = min(g.y_offset for g in glyphs)
+		right = max(g.x_offset + g.width for g in glyphs)
+		top = max(g.y_offset + g.height for g in glyphs)
+		return (right - left, top - bottom, left, bottom)
+
+	def load_glyphs(self, code_points):
+		if isinstance(code_points, str):
+			code_points = [ord(c) for c in code_points]
+		for code in code_points:
+			self.get_glyph(code)
+
+	def get_glyph(self, code):
+		if code in self._glyphs:
+			return self._glyphs[code]
+		g = self.bdf.glyphs.get(code)
+		if g is None:
+			return None
+		bitmap = Bitmap(max(1, g.width), max(1, g.height), 2)
+		for y, row in enumerate(g.rows):
+			for x in range(g.width):
+				if row & (1 << (g.width - 1 - x)):
+					bitmap[x, y] = 1
+		glyph = Glyph(bitmap, 0, g.width, g.height, g.x_offset, g.y_offset, g.dwidth, 0)
+		self._glyphs[code] = glyph
+		return glyph
+
+def _bitmap_font_module():
+	m = types.ModuleType("adafruit_bitmap_font.bitmap_font")
+
+	def load_font(path, bitmap=None):
+		name = os.path.splitext(os.path.basename(path))[0]
+		return Font(os.path.join(FONT_DIR, name + ".bdf"))
+
+	m.load_font = load_font
+	return m
+
+class Label:
+	# counts how often a label would rasterize, and allocates about as much as it would
+	rasterized = 0
+
+	def __init__(self, font, text="", color=0xFFFFFF, **kwargs):
+		self.font = font
+		self._color = color
+		self.anchor_point = (0, 0)
+		self.anchored_position = (0, 0)
+		self.x = 0
+		self.y = 0
+		self.hidden = False
+		self._text = None
+		self.bitmap = None
+		self.text = text
+
+	@property
+	def text(self):
+		return self._text
+
+	@text.setter
+	def text(self, text):
+		Label.rasterized = Label.rasterized + 1
+		self._text = text
+		width = 0
+		for c in text:
+			glyph = self.font.get_glyph(ord(c))
+			if glyph is not None:
+				width = width + glyph.shift_x
+		self.bitmap = bytearray((width + 31) // 32 * 4 * (self.font.ascent + self.font.descent))
+
+	@property
+	def color(self):
+		return self._color
+
+	@color.setter
+	def color(self, color):
+		self._color = color
+
+	@property
+	def bounding_box(self):
+		return (0, 0, len(self.bitmap) * 8 // max(1, self.font.ascent + self.font.descent), self.font.ascent + self.font.descent)
+
+def _display_text_modules():
+	package = types.ModuleType("adafruit_display_text")
+	package.__path__ = []
+	bitmap_label = types.ModuleType("adafruit_display_text.bitmap_label")
+	bitmap_label.Label = Label
+	label = types.ModuleType("adafruit_display_text.label")
+	label.Label = Label
+	package.bitmap_label = bitmap_label
+	package.label = label
+	return package, bitmap_label, label
+
+# ---------------------------------------------------------------- ESP32
+
+SERVER_KEEP_ALIVE = 60		# secs a server keeps an idle connection open
+CLOCK_DRIFT_PPM = 40		# the onboard clock runs this much slow, a few secs a day
+JOIN_SECS = 2				# secs the ESP32 takes to join the network
+
+class FakeEsp:
+	# serves fixtures/ for api.openweathermap.org, a few bytes at a time.
+	#   The access point is down during outages, (start, end) secs of simulated time
+	TCP_MODE = 0
+	TLS_MODE = 2
+	WL_IDLE_STATUS = 0
+	WL_NO_SSID_AVAIL = 1
+	WL_CONNECTED = 3
+	WL_CONNECTION_LOST = 5
+	WL_DISCONNECTED = 6
+
+	def __init__(self, routes=None, connect_polls=2, bytes_per_poll=700, outages=()):
+		self.routes = routes if routes is not None else default_routes()
+		self.connect_polls = connect_polls
+		self.bytes_per_poll = bytes_per_poll
+		self.outages = outages
+		self.joining = None			# when the network was last given to join
+		self.joined = False
+		self.last_status = self.WL_DISCONNECTED
+		self.joins = 0
+		self.resets = 0
+		self.ssid = b"simulated"
+		self.ip_address = b"\x0a\x00\x00\x17"
+		self.requests = []
+		self.lookups = 0
+		self.connects = 0
+		self.sockets = {}
+		self.next_socket = 0
+		self.unix_time_offset = 1_661_187_600 - DEVICE_EPOCH		# when the fixtures were recorded
+
+	def ap_down(self):
+		return any(start <= CLOCK.now < end for start, end in self.outages)
+
+	@property
+	def status(self):
+		if self.joining is None:
+			return self.last_status
+		if self.ap_down():
+			if self.joined:
+				# dropped, the firmware gives up on the network
+				self.joining = None
+				self.joined = False
+				self.last_status = self.WL_CONNECTION_LOST
+				return self.last_status
+			if CLOCK.now - self.joining >= JOIN_SECS:
+				return self.WL_NO_SSID_AVAIL
+			return self.WL_IDLE_STATUS
+		if CLOCK.now - self.joining >= JOIN_SECS:
+			self.joined = True
+			return self.WL_CONNECTED
+		return self.WL_IDLE_STATUS
+
+	@property
+	def is_connected(self):
+		return self.status == self.WL_CONNECTED
+
+	@property
+	def rssi(self):
+		if not self.is_connected:
+			return 0
+		return -52 - int(CLOCK.now // 600) % 7
+
+	# blocks, the way the real one does
+	def connect_AP(self, ssid, password, timeout_s=10):
+		self.wifi_set_passphrase(ssid, password)
+		for i in range(timeout_s):
+			if self.is_connected:
+				return self.WL_CONNECTED
+			CLOCK.sleep(1)
+		raise ConnectionError("Failed to connect to ssid", ssid)
+
+	def wifi_set_passphrase(self, ssid, password):
+		self.joins = self.joins + 1
+		self.joining = CLOCK.now
+		self.joined = False
+
+	def disconnect(self):
+		self.joining = None
+		self.joined = False
+		self.last_status = self.WL_DISCONNECTED
+
+	def reset(self):
+		self.resets = self.resets + 1
+		self.disconnect()
+		self.sockets = {}
+
+	def pretty_ip(self, ip):
+		return ".".join(str(b) for b in ip)
+
+	def get_time(self):
+		if not self.is_connected:
+			raise OSError("Must be connected to WiFi before obtaining NTP.")
+		return (int(self.network_time()), 0)
+
+	# Unix time by the network, which the onboard clock falls behind by CLOCK_DRIFT_PPM
+	def network_time(self):
+		return CLOCK.now * (1 + CLOCK_DRIFT_PPM / 1_000_000) + DEVICE_EPOCH + self.unix_time_offset
+
+	def get_host_by_name(self, host):
+		if not self.is_connected:
+			raise ConnectionError("not connected")
+		self.lookups = self.lookups + 1
+		return b"\x7f\x00\x00\x01"
+
+	def get_socket(self):
+		# a free one, like the ESP32 firmware hands out
+		for i in range(8):
+			self.next_socket = (self.next_socket + 1) % 8
+			if self.next_socket not in self.sockets:
+				return self.next_socket
+		raise RuntimeError("No sockets available")
+
+	def socket_open(self, socket_num, dest, port, conn_mode=0):
+		self.connects = self.connects + 1
+		self.sockets[socket_num] = {"polls": 0, "request": b"", "response": None, "sent": 0, "keep": False}
+
+	def socket_connected(self, socket_num):
+		s = self.sockets.get(socket_num)
+		if s is None:
+			return False
+		s["polls"] = s["polls"] + 1
+		if not self.is_connected:
+			return False
+		if s["response"] is not None:
+			if s["sent"] < len(s["response"]):
+				return True
+			# servers close kept-alive connections that sit idle for a while
+			return s["keep"] and CLOCK.now - s["at"] < SERVER_KEEP_ALIVE
+		return s["polls"] > self.connect_polls
+
+	def socket_status(self, socket_num):
+		return 4 if self.socket_connected(socket_num) else 0
+
+	def socket_write(self, socket_num, data, conn_mode=0):
+		s = self.sockets[socket_num]
+		if s["response"] is not None and s["sent"] >= len(s["response"]):
+			# the next request on a kept-alive connection
+			s["request"], s["response"], s["sent"] = b"", None, 0
+		s["request"] = s["request"] + bytes(data)
+		if b"\r\n\r\n" in s["request"]:
+			s["keep"] = b"connection: keep-alive" in s["request"].lower()
+			s["response"] = self._respond(s["request"], s["keep"])
+			s["at"] = CLOCK.now
+
+	def socket_available(self, socket_num):
+		s = self.sockets.get(socket_num)
+		if s is None or s["response"] is None:
+			return 0
+		return min(self.bytes_per_poll, len(s["response"]) - s["sent"])
+
+	def socket_read(self, socket_num, size):
+		s = self.sockets[socket_num]
+		data = s["response"][s["sent"]:s["sent"] + size]
+		s["sent"] = s["sent"] + len(data)
+		return data
+
+	def socket_close(self, socket_num, conn_mode=0):
+		self.sockets.pop(socket_num, None)
+
+	def _respond(self, request, keep=False):
+		line = request.split(b"\r\n", 1)[0].decode()
+		method, target, version = line.split(" ")
+		path = target.split("?", 1)[0]
+		self.requests.append((method, path))
+		for prefix, handler in self.routes:
+			if path.startswith(prefix):
+				status, body = handler(request)
+				break
+		else:
+			status, body = 404, b'{"cod":404,"message":"not found"}'
+		head = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n" % (
+			status, "OK" if status == 200 else "Error", len(body), "keep-alive" if keep else "close")
+		return head.encode() + body
+
+def fixture(name):
+	with open(os.path.join(FIXTURES, name), "rb") as f:
+		return f.read()
+
+def default_routes():
+	onecall = fixture("onecall.json")
+	air_pollution = fixture("air_pollution.json")
+	return [
+		("/data/3.0/onecall", lambda request: (200, onecall)),
+		("/data/2.5/air_pollution", lambda request: (200, air_pollution)),
+		]
+
+# a tools/hub Hub running in the simulation, with the fixtures for OpenWeatherMap
+def hub_route():
+	sys.path.insert(0, os.path.join(ROOT, "tools", "hub"))
+	try:
+		import hub
+	finally:
+		sys.path.pop(0)
+
+	routes = default_routes()
+
+	def owm(url):
+		path = url.split("//", 1)[1]
+		path = path[path.index("/"):].split("?", 1)[0]
+		for prefix, handler in routes:
+			if path.startswith(prefix):
+				return handler(None)
+		return 404, b""
+
+	the_hub = hub.Hub("simulated", "http://owm.local", get=owm, clock=lambda: DEVICE_EPOCH + CLOCK.now)
+
+	def serve(request):
+		line = request.split(b"\r\n", 1)[0].decode()
+		query = urllib.parse.parse_qs(urllib.parse.urlsplit(line.split(" ")[1]).query)
+		return 200, the_hub.payload(query["lat"][0], query["lon"][0])
+
+	return ("/weather", serve), the_hub
+
+# a tools/aio MockIO taking telemetry in the simulation
+def aio_route():
+	sys.path.insert(0, os.path.join(ROOT, "tools", "aio"))
+	try:
+		import mockio
+	finally:
+		sys.path.pop(0)
+
+	io = mockio.MockIO(AIO_KEY, clock=lambda: CLOCK.now)
+
+	def serve(request):
+		head, body = request.split(b"\r\n\r\n", 1)
+		lines = head.decode().split("\r\n")
+		method, target = lines[0].split(" ")[:2]
+		headers = {}
+		for line in lines[1:]:
+			name, value = line.split(":", 1)
+			headers[name.strip().lower()] = value.strip()
+		return io.handle(method, target, headers, body)
+
+	return ("/api/v2/", serve), io
+
+def _esp32spi_modules(esp):
+	package = types.ModuleType("adafruit_esp32spi")
+	package.__path__ = []
+	control = types.ModuleType("adafruit_esp32spi.adafruit_esp32spi")
+	control.ESP_SPIcontrol = lambda *args, **kwargs: esp
+	control.WL_CONNECTED = FakeEsp.WL_CONNECTED
+	socket = types.ModuleType("adafruit_esp32spi.adafruit_esp32spi_socket")
+	socket.set_interface = lambda iface: None
+	package.adafruit_esp32spi = control
+	package.adafruit_esp32spi_socket = socket
+	return package, control, socket
+
+# ---------------------------------------------------------------- SCD-30 and other hardware
+
+SCD30_CLOCK_PPM = 300		# the SCD-30 samples this much slower than its interval says
+
+class FakeScd30:
+	# like adafruit_scd30: each of CO2, temperature and relative_humidity checks
+	#   whether a sample is ready (an I2C transaction) and reads it if it is.
+	#   Counts the transactions, and the times the interval and offset were
+	#   written (they go to the sensor's flash)
+	def __init__(self, i2c=None, seed=30):
+		self.random = random.Random(seed)
+		self._co2 = 650.0
+		self._temperature = 22.4		# what the sensor measures, before its offset
+		self._relative_humidity = 48.0
+		self._measurement_interval = 2
+		self._temperature_offset = 0.0
+		self.self_calibration_enabled = True
+		self.ambient_pressure = 0
+		self.altitude = 0
+		self.reads = 0					# data ready checks
+		self.transactions = 0
+		self.flash_writes = 0
+		self._started = 0.0				# when it started measuring at this interval
+		self._sample = 0				# latest sample read, counting from 1
+
+	@property
+	def data_available(self):
+		self.reads = self.reads + 1
+		self.transactions = self.transactions + 1
+		return self._latest() > self._sample
+
+	# samples so far, the sensor's clock runs SCD30_CLOCK_PPM slow
+	def _latest(self):
+		period = self._measurement_interval * (1 + SCD30_CLOCK_PPM / 1_000_000)
+		return int((CLOCK.now - self._started) / period)
+
+	def _read_data(self):
+		self.transactions = self.transactions + 1
+		self._sample = self._latest()
+		self._co2 = min(3000.0, max(400.0, self._co2 + self.random.uniform(-25, 28)))
+		self._temperature = self._temperature + self.random.uniform(-0.1, 0.1)
+		self._relative_humidity = min(90.0, max(20.0, self._relative_humidity + self.random.uniform(-0.5, 0.5)))
+
+	@property
+	def CO2(self):
+		if self.data_available:
+			self._read_data()
+		return self._co2
+
+	@property
+	def temperature(self):
+		if self.data_available:
+			self._read_data()
+		return self._temperature - self._temperature_offset
+
+	@property
+	def relative_humidity(self):
+		if self.data_available:
+			self._read_data()
+		return self._relative_humidity
+
+	@property
+	def measurement_interval(self):
+		self.transactions = self.transactions + 1
+		return self._measurement_interval
+
+	@measurement_interval.setter
+	def measurement_interval(self, value):
+		if value < 2 or value > 1800:
+			raise AttributeError("measurement_interval must be from 2-1800 seconds")
+		self.transactions = self.transactions + 1
+		self.flash_writes = self.flash_writes + 1
+		self._measurement_interval = int(value)
+		self._started = CLOCK.now
+		self._sample = 0
+
+	@property
+	def temperature_offset(self):
+		self.transactions = self.transactions + 1
+		return self._temperature_offset
+
+	@temperature_offset.setter
+	def temperature_offset(self, offset):
+		if offset > 655.35:
+			raise AttributeError("Offset value must be less than or equal to 655.35")
+		self.transactions = self.transactions + 1
+		self.flash_writes = self.flash_writes + 1
+		self._temperature_offset = int(offset * 100) / 100
+
+def _adafruit_scd30_module():
+	m = types.ModuleType("adafruit_scd30")
+	m.SCD30 = FakeScd30
+	return m
+
+class AnalogIn:
+	# bright during the day and dark at night, by virtual local time
+	def __init__(self, pin):
+		self.pin = pin
+
+	@property
+	def value(self):
+		hour = (CLOCK.now / 3600 + 17) % 24		# the sim starts at 17:00 local
+		return 600 if hour >= 22 or hour < 6 else 24_000
+
+TAP_SECS = 0.6			# how long a simulated tap holds the screen down, long enough for the main page's polling
+
+class Touchscreen:
+	# touched at each of taps (virtual secs since boot), in the middle of the screen
+	taps = ()
+
+	def __init__(self, x1, x2, y1, y2, calibration=None, size=None, samples=4, z_threshold=10000):
+		self.size = size or (480, 320)
+		self.points = 0				# times touch_point was read
+
+	@property
+	def touch_point(self):
+		self.points = self.points + 1
+		now = CLOCK.now
+		for tap in self.taps:
+			if tap <= now < tap + TAP_SECS:
+				return (self.size[0] // 2, self.size[1] // 2, 30000)
+		return None
+
+def _touchscreen_module(taps):
+	m = types.ModuleType("adafruit_touchscreen")
+	m.Touchscreen = type("Touchscreen", (Touchscreen,), {"taps": taps})
+	return m
+
+class DigitalInOut:
+	def __init__(self, pin):
+		self.pin = pin
+		self.value = False
+		self.direction = None
+		self.pull = None
+
+	def switch_to_output(self, value=False):
+		self.value = value
+
+	def switch_to_input(self, pull=None):
+		self.pull = pull
+
+class NeoPixel(list):
+	def __init__(self, pin, n, auto_write=True, brightness=1.0):
+		super().__init__([(0, 0, 0)] * n)
+		self.brightness = brightness
+
+	def show(self):
+		pass
+
+class _Bus:
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def try_lock(self):
+		return True
+
+	def unlock(self):
+		pass
+
+	def configure(self, **kwargs):
+		pass
+
+class WatchDogMode:
+	RAISE = "RAISE"
+	RESET = "RESET"
+
+class WatchDogTimeout(Exception):
+	pass
+
+class Watchdog:
+	# microcontroller.watchdog, checked whenever the clock sleeps.  In RAISE mode
+	#   it stops and raises WatchDogTimeout, in RESET mode (or on
+	#   microcontroller.reset()) the board resets, which ends the simulation
+	def __init__(self):
+		self.timeout = 16
+		self.mode = None
+		self.fed = 0.0
+		self.feeds = 0
+		self.timeouts = 0
+		self.resets = 0
+
+	def feed(self):
+		self.fed = CLOCK.now
+		self.feeds = self.feeds + 1
+		return;
+
+	def deinit(self):
+		self.mode = None
+		return;
+
+	def check(self):
+		if self.mode is None or CLOCK.now - self.fed <= self.timeout:
+			return;
+		self.timeouts = self.timeouts + 1
+		if self.mode == WatchDogMode.RESET:
+			self.reset()
+		self.mode = None
+		raise WatchDogTimeout()
+
+	def reset(self):
+		self.resets = self.resets + 1
+		self.mode = None
+		raise StopSimulation()
+
+WATCHDOG = Watchdog()
+
+def _hardware_modules():
+	board = types.ModuleType("board")
+	for pin in ("SCK", "MOSI", "MISO", "SCL", "SDA", "ESP_CS", "ESP_BUSY", "ESP_RESET", "LIGHT",
+			"NEOPIXEL", "SD_CS", "TOUCH_XL", "TOUCH_XR", "TOUCH_YD", "TOUCH_YU"):
+		setattr(board, pin, pin)
+	board.DISPLAY = Display()
+
+	busio = types.ModuleType("busio")
+	busio.SPI = _Bus
+	busio.I2C = _Bus
+
+	digitalio = types.ModuleType("digitalio")
+	digitalio.DigitalInOut = DigitalInOut
+
+	analogio = types.ModuleType("analogio")
+	analogio.AnalogIn = AnalogIn
+
+	neopixel = types.ModuleType("neopixel")
+	neopixel.NeoPixel = NeoPixel
+
+	microcontroller = types.ModuleType("microcontroller")
+	microcontroller.nvm = bytearray(8192)
+	microcontroller.watchdog = WATCHDOG
+	microcontroller.reset = WATCHDOG.reset
+
+	watchdog = types.ModuleType("watchdog")
+	watchdog.WatchDogMode = WatchDogMode
+	watchdog.WatchDogTimeout = WatchDogTimeout
+
+	supervisor = types.ModuleType("supervisor")
+	supervisor.runtime = types.SimpleNamespace(serial_bytes_available=False)
+
+	micropython = types.ModuleType("micropython")
+	micropython.const = lambda x: x
+
+	return {
+		"board": board, "busio": busio, "digitalio": digitalio, "analogio": analogio,
+		"neopixel": neopixel, "microcontroller": microcontroller, "supervisor": supervisor,
+		"micropython": micropython, "watchdog": watchdog,
+		}
+
+# ---------------------------------------------------------------- putting it together
+
+class Device:
+	# everything one simulated PyPortal needs, installed into sys.modules by install().
+	#   With hub, the weather comes from a simulated hub (see tools/hub), with
+	#   and with aio, telemetry goes to a simulated Adafruit IO (see tools/aio).
+	#   The screen is tapped at each of taps, virtual secs since boot
+	def __init__(self, esp=None, hub=False, aio=False, outages=(), taps=()):
+		self.hub = None
+		self.aio = None
+		if esp is None:
+			routes = default_routes()
+			if hub:
+				route, self.hub = hub_route()
+				routes.append(route)
+			if aio:
+				route, self.aio = aio_route()
+				routes.append(route)
+			esp = FakeEsp(routes, outages=outages)
+		self.esp = esp
+		self.modules = _hardware_modules()
+		self.modules["time"] = _time_module()
+		self.modules["gc"] = _gc_module()
+		self.modules["secrets"] = _secrets_module(hub, aio)
+		self.modules["displayio"] = _displayio_module()
+		self.modules["vectorio"] = _vectorio_module()
+		self.modules["bitmaptools"] = _bitmaptools_module()
+		self.modules["adafruit_scd30"] = _adafruit_scd30_module()
+		self.modules["adafruit_touchscreen"] = _touchscreen_module(tuple(taps))
+
+		package, bitmap_label, label = _display_text_modules()
+		self.modules["adafruit_display_text"] = package
+		self.modules["adafruit_display_text.bitmap_label"] = bitmap_label
+		self.modules["adafruit_display_text.label"] = label
+
+		fonts = types.ModuleType("adafruit_bitmap_font")
+		fonts.__path__ = []
+		fonts.bitmap_font = _bitmap_font_module()
+		self.modules["adafruit_bitmap_font"] = fonts
+		self.modules["adafruit_bitmap_font.bitmap_font"] = fonts.bitmap_font
+
+		package, control, socket = _esp32spi_modules(self.esp)
+		self.modules["adafruit_esp32spi"] = package
+		self.modules["adafruit_esp32spi.adafruit_esp32spi"] = control
+		self.modules["adafruit_esp32spi.adafruit_esp32spi_socket"] = socket
+
+		self.saved = {}
+		self.restarts = []			# exceptions that made main_loop start over
+
+	@property
+	def display(self):
+		return self.modules["board"].DISPLAY
+
+	def install(self):
+		# the project's own modules get imported fresh, against these stand-ins
+		for name in list(sys.modules):
+			if os.path.dirname(getattr(sys.modules[name], "__file__", None) or "") == ROOT:
+				del sys.modules[name]
+		for name, module in self.modules.items():
+			self.saved[name] = sys.modules.get(name)
+			sys.modules[name] = module
+		if ROOT not in sys.path:
+			sys.path.insert(0, ROOT)
+		return;
+
+	def uninstall(self):
+		WATCHDOG.deinit()
+		for name, module in self.saved.items():
+			if module is None:
+				sys.modules.pop(name, None)
+			else:
+				sys.modules[name] = module
+		self.saved = {}
+		return;
+
+	# run code.py's top level (fonts, hardware, the stage wrappers) without
+	#   starting its forever loop, returns code.py's globals
+	def load(self):
+		path = os.path.join(ROOT, "code.py")
+		with open(path) as f:
+			source = f.read()
+		namespace = {"__name__": "dakota_sim", "__file__": path}
+		exec(compile(source, path, "exec"), namespace)
+		gc = self.modules["gc"]
+		gc.collect()
+		if tracemalloc.is_tracing():
+			gc.baseline = tracemalloc.get_traced_memory()[0]
+		return namespace
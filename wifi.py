@@ -0,0 +1,203 @@
+# WiFi connection manager for Dakota
+#
+# esp.connect_AP() (and the bundled wifimanager, which calls it) holds up the
+# whole device for up to 10 secs an attempt, and with the access point down
+# main_loop used to try again every time round.  A Connection instead moves
+# through explicit states:
+#
+#   IDLE        not connected, about to try
+#   CONNECTING  the ESP32 has been given the network and is joining it in the
+#               background; its status is checked each step, for up to
+#               ATTEMPT_TIMEOUT secs
+#   CONNECTED   checked every check_freq secs in case it drops, with the RSSI
+#               kept in a small history
+#   BACKOFF     an attempt failed; wait BACKOFF_MIN secs, doubling with each
+#               failure in a row (with jitter) up to BACKOFF_MAX
+#
+# step() does one quick thing and says how soon it wants to be called again,
+# so the clock and sensor carry on at their usual rate while we're offline.
+# After RESET_AFTER failures in a row the ESP32 is reset, in case it's the
+# one that's stuck.
+
+import random
+import time
+
+import history
+
+# states
+IDLE = 0
+CONNECTING = 1
+CONNECTED = 2
+BACKOFF = 3
+
+STATE_NAMES = ("idle", "connecting", "connected", "backoff")
+
+# ESP32 firmware status codes (adafruit_esp32spi)
+WL_NO_SSID_AVAIL = 1
+WL_CONNECTED = 3
+WL_CONNECT_FAILED = 4
+
+ATTEMPT_TIMEOUT = 15	# secs an attempt to join gets
+POLL = 0.5				# secs between status checks while joining
+CHECK_FREQ = 11			# secs between checks while connected
+BACKOFF_MIN = 5			# secs after the first failed attempt
+BACKOFF_MAX = 300		# secs, longest wait between attempts
+JITTER = 0.25			# waits are this fraction either way of the doubling
+RESET_AFTER = 8			# failed attempts in a row before the ESP32 is reset
+RSSI_SIZE = 60			# RSSI samples kept
+RSSI_FREQ = 60			# secs between RSSI samples, so about an hour of them
+
+_NS = 1_000_000_000
+
+class Connection:
+
+	def __init__(self, esp, ssid, password, check_freq=CHECK_FREQ):
+		self.esp = esp
+		self.ssid = ssid
+		self.password = password
+		self.check_freq = check_freq
+		self.state = IDLE
+		self.entered = time.monotonic_ns()
+		self.failing = 0			# failed attempts in a row
+		self.retry_at = 0			# time.monotonic_ns() the backoff ends
+		self.rssi = history.Series(RSSI_SIZE)
+		self.rssi_at = None
+
+		self.attempts = 0
+		self.failures = 0
+		self.connects = 0
+		self.drops = 0				# times a connection was lost
+		self.resets = 0
+		self.uptime_ns = 0			# connected time, not counting the current stretch
+		self.connected_since = None
+
+	@property
+	def connected(self):
+		return self.state == CONNECTED
+
+	# times we've connected again after the first
+	@property
+	def reconnects(self):
+		return max(0, self.connects - 1)
+
+	# secs connected altogether
+	def uptime(self):
+		total = self.uptime_ns
+		if self.connected_since != None:
+			total = total + time.monotonic_ns() - self.connected_since
+		return total / _NS
+
+	# move things along, returns secs until it's worth calling again
+	def step(self):
+		state = self.state
+		now = time.monotonic_ns()
+
+		if state == CONNECTED:
+			if not self._is_connected():
+				print("!!!! WiFi connection lost")
+				self.drops = self.drops + 1
+				self.uptime_ns = self.uptime_ns + now - self.connected_since
+				self.connected_since = None
+				self._enter(IDLE)
+				return 0
+			self._sample_rssi(now)
+			return self.check_freq
+
+		if state == BACKOFF:
+			if now < self.retry_at:
+				return (self.retry_at - now) / _NS
+			state = IDLE
+
+		if state == IDLE:
+			self._start()
+			return POLL
+
+		# CONNECTING
+		try:
+			status = self.esp.status
+		except Exception as e:
+			print("!!!! WiFi status exception:", e)
+			status = None
+
+		if status == WL_CONNECTED:
+			self._connected(now)
+			return self.check_freq
+		if status == WL_CONNECT_FAILED or status == WL_NO_SSID_AVAIL:
+			return self._failed("status " + str(status))
+		if now - self.entered > ATTEMPT_TIMEOUT * _NS:
+			return self._failed("timed out")
+		return POLL
+
+	def report(self):
+		print("  wifi: %s, up %d secs altogether, %d attempts, %d failed, %d reconnects, %d drops, %d resets" % (
+			STATE_NAMES[self.state], self.uptime(), self.attempts, self.failures, self.reconnects, self.drops, self.resets))
+		if self.rssi.count > 0:
+			print("        RSSI last %.0f, min %.0f, mean %.1f, max %.0f dBm" % (
+				self.rssi.last(), self.rssi.min(), self.rssi.mean(), self.rssi.max()))
+		return;
+
+	def _start(self):
+		if self.failing > 0 and self.failing % RESET_AFTER == 0:
+			print("* Resetting the ESP32")
+			self.resets = self.resets + 1
+			try:
+				self.esp.reset()
+			except Exception as e:
+				print("!!!! ESP32 reset exception:", e)
+
+		print("* Connecting to", self.ssid)
+		self.attempts = self.attempts + 1
+		self._enter(CONNECTING)
+		try:
+			self.esp.wifi_set_passphrase(bytes(self.ssid, "utf-8"), bytes(self.password, "utf-8"))
+		except Exception as e:
+			self._failed(str(e))
+		return;
+
+	def _connected(self, now):
+		self.failing = 0
+		self.connects = self.connects + 1
+		self.connected_since = now
+		self._enter(CONNECTED)
+		self.rssi_at = None
+		try:
+			print("* Connected to", str(self.esp.ssid, "utf-8"), "\tRSSI:", self.esp.rssi)
+			print("  IP address", self.esp.pretty_ip(self.esp.ip_address))
+		except Exception as e:
+			print("!!!! WiFi info exception:", e)
+		self._sample_rssi(now)
+		return;
+
+	def _failed(self, why):
+		print("!!!! WiFi connect failed:", why)
+		self.failures = self.failures + 1
+		self.failing = self.failing + 1
+		wait = BACKOFF_MIN * (1 << min(self.failing - 1, 16))
+		wait = wait * (1 + JITTER * (2 * random.random() - 1))
+		if wait > BACKOFF_MAX:
+			wait = BACKOFF_MAX
+		self._enter(BACKOFF)
+		self.retry_at = self.entered + int(wait * _NS)
+		return wait
+
+	def _is_connected(self):
+		try:
+			return self.esp.status == WL_CONNECTED
+		except Exception as e:
+			print("!!!! WiFi status exception:", e)
+			return False
+
+	def _sample_rssi(self, now):
+		if self.rssi_at != None and now - self.rssi_at < RSSI_FREQ * _NS:
+			return;
+		try:
+			self.rssi.add(self.esp.rssi)
+			self.rssi_at = now
+		except Exception as e:
+			print("!!!! RSSI exception:", e)
+		return;
+
+	def _enter(self, state):
+		self.state = state
+		self.entered = time.monotonic_ns()
+		return;